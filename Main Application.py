@@ -1,12 +1,31 @@
-import pandas as pd
+import multiprocessing
+
 import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 
 from tkinter import filedialog
 import ttkbootstrap as ttk
 from ttkbootstrap.constants import *
 
+from ttkbootstrap.dialogs import Messagebox
+
+from analysis import analyze_pair, cached_analysis, cached_prepare_pair, cointegration_store
+from largedata import analyze_large_pair
+from charts import PairCharts, apply_plot_style, portfolio_figure
+from sweep import parse_values, parse_sd_range, run_sweep, sweep_table
+from screener import load_universe, screen_universe
+from worker import BackgroundTask
+from stream import LiveFeed, LivePair
+from walkforward import walk_forward
+from significance import significance_test
+from portfolio import backtest_portfolio, read_pairs
+from report import generate_report, screened_pairs
+from instrument import tracer, span
+
+WINDOW_MODES = {"Full History": "full", "Rolling": "rolling", "Expanding": "expanding"} # SD window setting -> analyze_pair window
+HEDGE_MODELS = {"Equal Shares": "equal", "OLS": "ols", "Rolling OLS": "rolling", "Kalman Filter": "kalman"} # hedge ratio setting -> analyze_pair hedge
+
 class TradingApp(ttk.Frame): # class is extension of a tkinter frame
     def __init__(self, master_window): # main setup
         super().__init__(master_window)
@@ -14,6 +33,9 @@ class TradingApp(ttk.Frame): # class is extension of a tkinter frame
         self.colors = master_window.style.colors
 
         self.labels = {} # dictionary to store labels that need updating
+        self.task = None # background task currently running
+        self.task_buttons = [] # buttons disabled while a task is running
+        self.live_feed = None # live feed being followed, if any
 
 
         # Generate stocks section frame
@@ -27,19 +49,22 @@ class TradingApp(ttk.Frame): # class is extension of a tkinter frame
 
         self.create_stock_widget(stocks_frame, self.stock1_name, 0, self.file_path1)
         self.create_stock_widget(stocks_frame, self.stock2_name, 1, self.file_path2)
+        self.create_screener(stocks_frame)
 
 
         # Generate graphs section
-        self.fig1 = None # Strategy plot
-        self.fig2 = None # Portfolio plot
-        self.analysis_graph = None # Strategy graph
-        self.portfolio_graph = None # Portfolio graph
-        self.analysis_toolbar = None
-        self.portfolio_toolbar = None
+        self.charts = None # Strategy and portfolio graphs, created on the first test and reused after that
+        self.sweep_fig = None # Sweep heatmaps plot
+        self.sweep_graph = None # Sweep heatmaps graph
+        self.fold_table = None # Walk-forward per fold metrics, shown next to the portfolio graph
+        self.portfolio_graph = None # Portfolio test equity graph
+        self.portfolio_table = None # Portfolio test per pair metrics, shown under its graph
 
         graphs_frame = ttk.Frame(self, width=720, height=940, relief="solid") # graphs frame
         graphs_frame.grid(row=0, column=2, sticky="e", padx = 10, pady=40, rowspan=4)
         graphs_frame.grid_propagate(False)
+        self.graphs_frame = graphs_frame
+        self.last_analysis = None # results currently graphed, reused when display settings change
 
 
         # Generate Test/Reset buttons
@@ -56,15 +81,37 @@ class TradingApp(ttk.Frame): # class is extension of a tkinter frame
         self.return_pct = ttk.DoubleVar()
 
         self.create_stats()
+        self.create_performance()
 
 
         # Generate settings section
         self.threshold_setting = ttk.BooleanVar(value=False) # True = show stdev thresholds, False = don't
         self.mean_setting = ttk.BooleanVar(value=False) # True = show stocks mean prices, False = don't
         self.signal_setting = ttk.BooleanVar(value=False) # True = show trade entries and exits, False = don't
+        self.window_mode = ttk.StringVar(value="Full History") # bars used for the spread mean and stdev, a key of WINDOW_MODES
+        self.lookback = ttk.IntVar(value=60) # bars in the rolling window (and rolling OLS hedge), or bars before the expanding window starts trading
+        self.hedge_model = ttk.StringVar(value="Equal Shares") # how many shares of stock2 are traded per share of stock1, a key of HEDGE_MODELS
+        self.sweep_sd_range = ttk.StringVar(value="0.5, 3.0, 0.1") # start, stop, step of SD thresholds to sweep
+        self.sweep_order_sizes = ttk.StringVar(value="5, 10, 20") # order sizes to sweep
+        self.sweep_capitals = ttk.StringVar(value="10000") # starting capitals to sweep
+        self.screen_top_k = ttk.IntVar(value=20) # number of most correlated pairs to backtest when screening a folder
+        self.live_source = ttk.StringVar(value="") # live feed: growing CSV file, tcp://host:port or - for stdin. Empty asks for a file
+        self.walk_forward_train = ttk.IntVar(value=500) # bars the thresholds are fitted on in each walk-forward fold
+        self.walk_forward_test = ttk.IntVar(value=125) # bars traded after each training window
+        self.walk_forward_pick_sd = ttk.BooleanVar(value=False) # True = pick the best of the sweep SD thresholds in each fold, False = use the SD threshold setting
+        self.large_data = ttk.BooleanVar(value=False) # True = test in chunks from compact files on disk, for histories too large for memory
+        self.max_memory = ttk.IntVar(value=512) # rough memory limit in MB for large data mode and significance tests
+        self.profile_runs = ttk.BooleanVar(value=False) # True = capture a cProfile of each test, False = only time the stages
+        self.significance_paths = ttk.IntVar(value=2000) # random paths the strategy is tested on in a significance test
+        self.significance_block = ttk.IntVar(value=20) # consecutive bars kept together when resampling returns
+        self.profiling = False # whether the test being run is profiled, read on the Tk thread when it starts
         
         self.create_settings()
 
+        # Display settings only change overlays, so redraw from the last results instead of testing again
+        for display_setting in [self.threshold_setting, self.mean_setting, self.signal_setting]:
+            display_setting.trace_add("write", self.redraw_graphs)
+
 
     def create_stock_widget(self, frame, stock_name, widget_number, file_path_var):
         """
@@ -117,173 +164,84 @@ class TradingApp(ttk.Frame): # class is extension of a tkinter frame
         self.labels[f"file{widget_number+1}"] = file_label
 
 
-    def analyze_stocks(self, stock1_name: str, file_path1: str, stock2_name: str, file_path2: str):
+    def create_screener(self, frame):
         """
-        Takes the two stocks file locations and performs analysis, returning statistics and graphs.
-        Uses format from NASDAQ
+        Creates button for screening a folder of NASDAQ quote files for the best pairs
+        Results are shown in a new window, double clicking a pair loads it into the stock widgets and tests it
         """
-        # Read and clean stock1 data
-        stock1_df = pd.read_csv(file_path1, usecols = ["Date", "Close/Last"])
-        stock1_df["Close/Last"] = stock1_df["Close/Last"].replace({"\\$": ""}, regex=True)  # Remove '$' symbol
-        stock1_df["Close/Last"] = pd.to_numeric(stock1_df["Close/Last"], errors="coerce")  # Convert to numbers
-
-        # Read and clean stock2 data
-        stock2_df = pd.read_csv(file_path2, usecols = ["Date", "Close/Last"])
-        stock2_df["Close/Last"] = stock2_df["Close/Last"].replace({"\\$": ""}, regex=True)  # Remove '$' symbol
-        stock2_df["Close/Last"] = pd.to_numeric(stock2_df["Close/Last"], errors="coerce")  # Convert to numbers
-
-        # Merge into one df
-        stock1_price_col = f"{self.stock1_name.get()} Price" # the name of the column containing the historical prices of stock 1
-        stock2_price_col = f"{self.stock2_name.get()} Price" # the name of the column containing the historical prices of stock 2
-
-        df = pd.merge(stock1_df, stock2_df, on = "Date", how = "inner")
-        df.rename(columns={"Close/Last_x": stock1_price_col, "Close/Last_y": stock2_price_col}, inplace = True)
-        df = df.iloc[::-1] # Sort from oldest to newest
-
-        df["Spread"] = abs(df[stock1_price_col] - df[stock2_price_col]) # calculate spreads column
-
-        # Calculate statistics
-        self.correlation = df[stock1_price_col].corr(df[stock2_price_col]) # correlation betwen stock1 and stock2
-
-        stock1_mean_price = df[stock1_price_col].mean() # historical mean price of stock1
-        stock2_mean_price = df[stock2_price_col].mean() # historical mean price of stock2
-
-        mean_spread = df["Spread"].mean() # historical mean spread
-        spread_stdev = df["Spread"].std() # calculate standard deviation
-        upper_threshold = mean_spread + (self.num_stdevs.get() * spread_stdev)
-        lower_threshold = mean_spread - (self.num_stdevs.get() * spread_stdev)
-
-
-        # Simulate trades
-        capital = self.capital.get()
-        order_size = self.order_size.get()
-        num_trades = self.num_trades.get()
-        trade_active = 0 # 0 = not in trade, -1 = trade on lower, 1 = trade on upper
-        stock1_position = 0 # -1 is short, 1 is long
-        stock2_position = 0 # use enum?
-
-        for index, row in df.iterrows(): # iterate through each day
-            # Open trades
-            if trade_active == 0:
-                if row["Spread"] > upper_threshold: # spread is above -> buy Pep, short KO
-                    stock1_position = -1
-                    capital += row[stock1_price_col] * order_size
-
-                    stock2_position = 1
-                    capital -= row[stock2_price_col] * order_size
-
-                    trade_active = 1
-                    df.loc[index, "Entries"] = df.loc[index, "Spread"]
-            
-                elif row["Spread"] < lower_threshold: # spread is below -> buy KO, short PEP
-                    stock1_position = 1
-                    capital -= row[stock1_price_col] * order_size
-
-                    stock2_position = -1
-                    capital += row[stock2_price_col] * order_size
-
-                    trade_active = -1
-                    df.loc[index, "Entries"] = df.loc[index, "Spread"]
-            
-            # Close trades
-            elif trade_active == -1 and row["Spread"] > lower_threshold:
-                stock1_position = 0
-                capital += row[stock1_price_col] * order_size # sell
-
-                stock2_position = 0
-                capital -= row[stock2_price_col] * order_size # buy to cover
-
-                trade_active = 0
-                num_trades += 1
-                df.loc[index, "Exits"] = df.loc[index, "Spread"]
-
-            elif trade_active == 1 and row["Spread"] < upper_threshold:
-                stock1_position = 0
-                capital -= row[stock1_price_col] * order_size # buy to cover
-
-                stock2_position = 0
-                capital += row[stock2_price_col] * order_size # sell
-
-                trade_active = 0
-                num_trades += 1
-                df.loc[index, "Exits"] = df.loc[index, "Spread"]
-
-            # Get portfolio value --> cash + holdings
-            holdings_value = 0
-            if stock1_position == 1:
-                holdings_value = row[stock1_price_col] * order_size
-
-            elif stock2_position == 1:
-                holdings_value = row[stock2_price_col] * order_size
-
-            df.loc[index, "Portfolio Value"] = capital + holdings_value
-
-
-        # Calculate Performance
-        print("trade active at end?: " + str(trade_active)) # flag if trade still active at end of simulation
-
-        final_value = df["Portfolio Value"].iloc[-1]
-
-        self.return_pct = (final_value - 10000) / 10000 * 100
-
-        self.sharpe_ratio = df["Portfolio Value"].pct_change(fill_method=None).mean() / df["Portfolio Value"].pct_change(fill_method=None).std()
-
-        self.num_trades.set(num_trades) # set with updated value
-
-
-        # Update rcParams to set all text colours to white
-        plt.rcParams.update({
-            "figure.facecolor": "#190831",
-            "axes.facecolor": "#190831",
-            "legend.facecolor": "#190831",
-            "text.color": "white",
-            "axes.labelcolor": "white",
-            "xtick.color": "white",
-            "ytick.color": "white",
-            "axes.titlecolor": "white",
-            "legend.edgecolor": "white",
-            "font.size": 8
-        })
-
-
-        # Graph historical prices and spread
-        self.fig1, ax1 = plt.subplots(figsize=(7, 4))
-        ax1.plot(df["Date"], df[stock1_price_col], linestyle = "-", label=stock1_price_col, color="darkorange", marker=None)
-        ax1.plot(df["Date"], df[stock2_price_col], linestyle = "--", label=stock2_price_col, color="dodgerblue", marker=None)
-        ax1.plot(df["Date"], df["Spread"], linestyle = "-", label="Spread", color="violet", marker=None)
-
-        if self.threshold_setting.get() is True: # shows stdev of spread threshold lines if setting on
-            ax1.axhline(y = mean_spread, color = 'm', linestyle = '-') # mean spread
-            ax1.axhline(y = upper_threshold, color = 'm', linestyle = '-') # + num_stdev spread
-            ax1.axhline(y = lower_threshold, color = 'm', linestyle = '-') # - num_stdev spread
-        
-        if self.mean_setting.get() is True:
-            ax1.axhline(y = stock1_mean_price, color = 'darkorange', linestyle = '-') # mean price stock1
-            ax1.axhline(y = stock2_mean_price, color = 'dodgerblue', linestyle = '-') # mean price stock2
+        def screen_folder():
+            num_stdevs, capital, order_size, top_k = self.num_stdevs.get(), self.capital.get(), self.order_size.get(), self.screen_top_k.get()
+            if top_k < 1:
+                Messagebox.show_error(message="Screen Top Pairs must be at least 1", title="Invalid Settings")
+                return
+            folder = filedialog.askdirectory(title="Select Folder of Quote Files")
+            if not folder:
+                return
+            window, lookback, hedge = self.window_settings()
+
+            def run(task):
+                prices, file_paths = load_universe(folder, progress=task.progress)
+                results = screen_universe(prices, num_stdevs, capital, order_size, top_k=top_k, window=window, lookback=lookback, hedge=hedge,
+                                          store=cointegration_store, progress=task.progress)
+                return results, file_paths
+
+            self.start_task(run, lambda screened: self.show_screen_results(*screened))
+
+        screen_btn = ttk.Button(frame, text="Screen Folder", bootstyle="outline", command=screen_folder)
+        screen_btn.grid(row=4, column=0, columnspan=2, pady=5)
+        self.task_buttons.append(screen_btn) # disabled while a task is running
+
+
+    def show_screen_results(self, results, file_paths):
+        """
+        Shows ranked pairs from screen_universe in a table window, with a button to save a report of every pair's charts
+        Parameters:
+            results (df): output of screen_universe
+            file_paths (dict): ticker -> quote file, from load_universe
+        """
+        window = ttk.Toplevel(title="Screened Pairs")
+        columns = ["Stock 1", "Stock 2", "Correlation", "p-value", "Half-life", "Sharpe Ratio", "Total Return", "Trades"]
+        table = ttk.Treeview(window, columns=columns, show="headings", height=25)
+        for column in columns:
+            table.heading(column, text=column)
+            table.column(column, width=100, anchor="e")
+        table.pack(fill=BOTH, expand=YES, padx=10, pady=10)
+
+        for row in results.itertuples():
+            table.insert("", END, values=(row.stock1, row.stock2, round(row.correlation, 4), round(row.p_value, 4), round(row.half_life, 1),
+                                          round(row.sharpe_ratio, 4), f"{row.return_pct:.2f}%", row.num_trades))
+
+        def load_pair_selection(event):
+            """
+            Loads the double clicked pair into the stock widgets and runs a test
+            """
+            selected = table.focus()
+            if not selected:
+                return
+            stock1, stock2 = table.item(selected, "values")[:2]
+            for widget_number, (ticker, name_var, path_var) in enumerate([(stock1, self.stock1_name, self.file_path1), (stock2, self.stock2_name, self.file_path2)]):
+                name_var.set(ticker)
+                path_var.set(file_paths[ticker])
+                self.labels[f"file{widget_number+1}"].config(text=f"File {widget_number+1}: {file_paths[ticker]}")
+            self.submit_btn.invoke()
+
+        table.bind("<Double-1>", load_pair_selection)
+
+        def save_report():
+            """
+            Saves the charts of every screened pair with a CSV and HTML summary in a chosen folder, drawn off screen in parallel
+            """
+            folder = filedialog.askdirectory(title="Select Report Folder")
+            if not folder:
+                return
+            num_stdevs, capital, order_size = self.num_stdevs.get(), self.capital.get(), self.order_size.get()
+            window, lookback, hedge = self.window_settings()
+            pairs = screened_pairs(results, file_paths, order_size)
+            self.start_task(lambda task: generate_report(pairs, folder, num_stdevs, capital, window, lookback, hedge, progress=task.progress),
+                            lambda rows: Messagebox.show_info(message=f"Saved charts of {len(rows)} pairs and summary.html in {folder}", title="Report Saved"))
 
-        if self.signal_setting.get() is True:
-            ax1.scatter(df["Date"], df["Entries"], color="green", label="Entry Signal", marker="^", s=100)
-            ax1.scatter(df["Date"], df["Exits"], color="red", label="Exit Signal", marker="v", s=100)
-        
-        ax1.xaxis.set_major_locator(mdates.YearLocator()) # Automatically sets yearly
-        self.fig1.autofmt_xdate()
-        ax1.set_xlabel("Date")
-        ax1.set_ylabel("Stock Price (USD)")
-        ax1.set_title(f"Historical Prices of {self.stock1_name.get()} & {self.stock2_name.get()}")
-        ax1.legend()
-        ax1.grid()
-
-
-        # Graph portfolio value over time
-        self.fig2, ax2 = plt.subplots(figsize=(7, 4))
-        ax2.plot(df["Date"], df["Portfolio Value"], linestyle = "-", label="Portfolio Value", marker=None)
-        ax2.xaxis.set_major_locator(mdates.YearLocator()) # Automatically sets yearly
-        self.fig2.autofmt_xdate()
-        ax2.set_xlabel("Date")
-        ax2.set_ylabel("Value (USD)")
-        ax2.set_title("Portfolio Value Over Time")
-        ax2.legend()
-        ax2.grid()
+        report_btn = ttk.Button(window, text="Save Report", bootstyle="outline", command=save_report)
+        report_btn.pack(pady=(0, 10))
 
 
     def create_submit_reset(self, graphs_frame):
@@ -298,17 +256,59 @@ class TradingApp(ttk.Frame): # class is extension of a tkinter frame
             """
             Aka "Test" function
             Defining function that will get the two stock names and execute functionality when form submitted
-            Updates displayed values
+            The analysis runs on a background thread, displayed values are updated when it finishes
             """
+            self.stop_live() # live bars were for the previous test
+            tracer.clear() # the performance panel shows this test's stages
+            self.profiling = self.profile_runs.get()
+            # Read settings here since Tk variables can't be used from the background thread
+            stock1_name, file_path1 = self.stock1_name.get(), self.file_path1.get()
+            stock2_name, file_path2 = self.stock2_name.get(), self.file_path2.get()
+            num_stdevs, capital, order_size = self.num_stdevs.get(), self.capital.get(), self.order_size.get()
+            window, lookback, hedge = self.window_settings()
+
+            if self.large_data.get():
+                max_memory_mb = self.max_memory.get()
+                self.start_task(self.traced("analyze large pair", lambda task: analyze_large_pair(
+                                    stock1_name, file_path1, stock2_name, file_path2, num_stdevs, capital, order_size,
+                                    window, lookback, hedge, max_memory_mb=max_memory_mb, progress=task.progress)),
+                                show_analysis)
+                return
+
+            # Show cached results straight away if these settings have been tested before
+            analysis = cached_analysis(stock1_name, file_path1, stock2_name, file_path2, num_stdevs, capital, order_size, window, lookback, hedge)
+            if analysis is not None:
+                show_analysis(analysis)
+                return
+
             # Call function to analyze stocks
-            self.analyze_stocks(self.stock1_name.get(), self.file_path1.get(), self.stock2_name.get(), self.file_path2.get())
-            self.create_graphs(graphs_frame)
+            self.start_task(self.traced("analyze pair", lambda task: analyze_pair(stock1_name, file_path1, stock2_name, file_path2, num_stdevs,
+                                                                                  capital, order_size, window, lookback, hedge, progress=task.progress)),
+                            show_analysis)
+
+        def show_analysis(analysis):
+            """
+            Draws graphs and updates displayed values once the analysis has finished
+            """
+            print("trade active at end?: " + str(analysis.final_position)) # flag if trade still active at end of simulation
+
+            self.correlation = analysis.correlation
+            self.sharpe_ratio = analysis.sharpe_ratio
+            self.return_pct = analysis.return_pct
+            self.num_trades.set(analysis.num_trades) # set with updated value
+
+            self.last_analysis = analysis
+            self.show_charts(analysis)
+            self.show_timings()
 
             # Update stats
             self.labels["correl"].config(text=round(self.correlation, 4))
             self.labels["sharpe"].config(text=round(self.sharpe_ratio, 4))
             self.labels["return"].config(text=f"{self.return_pct:.2f}%")
             self.labels["trades"].config(text=self.num_trades.get())
+            self.labels["hedge"].config(text=round(analysis.df["Hedge Ratio"].iloc[-1], 4)) # latest for rolling OLS and Kalman
+            self.labels["coint"].config(text=round(analysis.coint_p_value, 4) if analysis.coint_p_value == analysis.coint_p_value else "") # not tested in large data mode
+            self.labels["half_life"].config(text=round(analysis.half_life, 1) if analysis.half_life == analysis.half_life else "")
 
 
         # Create reset button
@@ -316,6 +316,9 @@ class TradingApp(ttk.Frame): # class is extension of a tkinter frame
             """
             Clear fields
             """
+            self.stop_live()
+            self.last_analysis = None # stops settings changes below redrawing graphs
+
             # reset entry forms
             self.stock1_name.set("")
             self.stock2_name.set("")
@@ -335,26 +338,225 @@ class TradingApp(ttk.Frame): # class is extension of a tkinter frame
             self.threshold_setting.set(False)
             self.mean_setting.set(False)
             self.signal_setting.set(False)
+            self.window_mode.set("Full History")
+            self.lookback.set(60)
+            self.hedge_model.set("Equal Shares")
+
+            # reset sweep settings
+            self.sweep_sd_range.set("0.5, 3.0, 0.1")
+            self.sweep_order_sizes.set("5, 10, 20")
+            self.sweep_capitals.set("10000")
+            self.screen_top_k.set(20)
+            self.live_source.set("")
+            self.walk_forward_train.set(500)
+            self.walk_forward_test.set(125)
+            self.walk_forward_pick_sd.set(False)
+            self.large_data.set(False)
+            self.max_memory.set(512)
+            self.profile_runs.set(False)
+            self.significance_paths.set(2000)
+            self.significance_block.set(20)
 
             # reset statistics
             self.labels["correl"].config(text="")
             self.labels["sharpe"].config(text="")
             self.labels["return"].config(text="")
             self.labels["trades"].config(text="")
+            self.labels["hedge"].config(text="")
+            self.labels["coint"].config(text="")
+            self.labels["half_life"].config(text="")
+
+            # reset performance panel
+            tracer.clear()
+            self.show_timings()
+
+            self.clear_graphs() # reset graphs if they exist
+
+
+        def sweep():
+            """
+            Backtests every combination of the sweep settings and shows Sharpe and return heatmaps
+            Clicking a heatmap cell loads that configuration into the single test view
+            """
+            stock1_name, file_path1 = self.stock1_name.get(), self.file_path1.get()
+            stock2_name, file_path2 = self.stock2_name.get(), self.file_path2.get()
+            try:
+                num_stdevs_values = parse_sd_range(self.sweep_sd_range.get())
+                order_sizes = parse_values(self.sweep_order_sizes.get(), int)
+                capitals = parse_values(self.sweep_capitals.get())
+                if not order_sizes or not capitals:
+                    raise ValueError("Sweep needs at least one order size and capital")
+            except ValueError as error:
+                Messagebox.show_error(message=str(error), title="Invalid Sweep Settings")
+                return
+            window, lookback, hedge = self.window_settings()
+
+            def run(task):
+                task.progress(0.0, "Loading prices")
+                prepared = cached_prepare_pair(stock1_name, file_path1, stock2_name, file_path2) # read once and share with every run
+                df = prepared.df
+                return run_sweep(df[prepared.stock1_price_col].to_numpy(), df[prepared.stock2_price_col].to_numpy(), num_stdevs_values, order_sizes, capitals,
+                                 window, lookback, hedge, progress=task.progress)
+
+            def show_sweep(results):
+                self.clear_graphs()
+                self.create_sweep_graph(graphs_frame, results, load_configuration)
+
+            self.start_task(run, show_sweep)
+
+        def live():
+            """
+            Tests the pair, then follows a live price feed and adds each new bar to the graphs and stats
+            Pressing the button again stops the feed
+            """
+            if self.live_feed:
+                self.stop_live()
+                return
+
+            source = self.live_source.get().strip() or filedialog.askopenfilename(title="Select Live Feed", filetypes=[("CSV Files", "*.csv"), ("All Files", "*.*")])
+            if not source:
+                return
+            stock1_name, file_path1 = self.stock1_name.get(), self.file_path1.get()
+            stock2_name, file_path2 = self.stock2_name.get(), self.file_path2.get()
+            num_stdevs, capital, order_size = self.num_stdevs.get(), self.capital.get(), self.order_size.get()
+            window, lookback, hedge = self.window_settings()
+
+            def run(task):
+                analysis = analyze_pair(stock1_name, file_path1, stock2_name, file_path2, num_stdevs, capital, order_size,
+                                        window, lookback, hedge, progress=task.progress)
+                task.progress(0.9, "Starting live feed")
+                df = analysis.df
+                live_pair = LivePair.from_history(df[analysis.stock1_price_col].to_numpy(), df[analysis.stock2_price_col].to_numpy(),
+                                                  num_stdevs, capital, order_size, window, lookback, hedge)
+                return analysis, live_pair
+
+            def start_feed(prepared):
+                analysis, live_pair = prepared
+                show_analysis(analysis)
+                self.live_feed = LiveFeed(source, stock1_name, stock2_name, live_pair, after=analysis.df["Date"].iloc[-1].to_pydatetime())
+                self.live_feed.start(self, show_live_bars, on_error=live_failed, on_stop=live_stopped)
+                self.live_btn.config(text="Stop Live", bootstyle="danger")
+                self.labels["status"].config(text=f"Live: {source}")
+
+            def show_live_bars(bars):
+                self.charts.append(bars)
+                latest = bars[-1]
+                self.labels["sharpe"].config(text=round(latest.sharpe_ratio, 4))
+                self.labels["return"].config(text=f"{latest.return_pct:.2f}%")
+                self.labels["trades"].config(text=latest.num_trades)
+                self.labels["hedge"].config(text=round(latest.hedge_ratio, 4))
+                self.labels["status"].config(text=f"Live: {latest.timestamp:%Y-%m-%d %H:%M:%S}")
+
+            def live_failed(error):
+                Messagebox.show_error(message=str(error), title="Live Feed Error")
+
+            def live_stopped():
+                self.live_feed = None
+                self.live_btn.config(text="Live", bootstyle="success-outline")
+                self.labels["status"].config(text="")
+
+            self.start_task(run, start_feed)
+
+        def walk_forward_test():
+            """
+            Tests the pair in and out of sample: thresholds are fitted on each training window and traded on the bars after it
+            The stitched out-of-sample portfolio is drawn with the in-sample one, and each fold's metrics are shown next to it
+            """
+            self.stop_live()
+            stock1_name, file_path1 = self.stock1_name.get(), self.file_path1.get()
+            stock2_name, file_path2 = self.stock2_name.get(), self.file_path2.get()
+            num_stdevs, capital, order_size = self.num_stdevs.get(), self.capital.get(), self.order_size.get()
+            window, lookback, hedge = self.window_settings()
+            train_bars, test_bars = self.walk_forward_train.get(), self.walk_forward_test.get()
+            try:
+                num_stdevs_values = parse_sd_range(self.sweep_sd_range.get()) if self.walk_forward_pick_sd.get() else [num_stdevs]
+            except ValueError as error:
+                Messagebox.show_error(message=str(error), title="Invalid Sweep Settings")
+                return
+
+            def run(task):
+                analysis = analyze_pair(stock1_name, file_path1, stock2_name, file_path2, num_stdevs, capital, order_size,
+                                        window, lookback, hedge, progress=task.progress)
+                df = analysis.df
+                result = walk_forward(df["Date"].to_numpy(), df[analysis.stock1_price_col].to_numpy(), df[analysis.stock2_price_col].to_numpy(),
+                                      train_bars, test_bars, num_stdevs_values, capital, order_size, hedge, lookback, progress=task.progress)
+                return analysis, result
+
+            def show_walk_forward(tested):
+                analysis, result = tested
+                show_analysis(analysis)
+                self.charts.set_walk_forward(analysis.df["Date"].to_numpy(), result.portfolio_value)
+                self.show_fold_table(graphs_frame, result)
+
+            self.start_task(run, show_walk_forward)
+
+        def significance():
+            """
+            Tests whether the strategy's Sharpe ratio and return could be luck by running it on random paths resampled from the pair's returns
+            A histogram of the random paths' Sharpe ratios with the strategy's p-value and confidence interval is drawn under the portfolio
+            """
+            self.stop_live()
+            stock1_name, file_path1 = self.stock1_name.get(), self.file_path1.get()
+            stock2_name, file_path2 = self.stock2_name.get(), self.file_path2.get()
+            num_stdevs, capital, order_size = self.num_stdevs.get(), self.capital.get(), self.order_size.get()
+            window, lookback, hedge = self.window_settings()
+            num_paths, block_size, max_memory_mb = self.significance_paths.get(), self.significance_block.get(), self.max_memory.get()
+
+            def run(task):
+                analysis = analyze_pair(stock1_name, file_path1, stock2_name, file_path2, num_stdevs, capital, order_size,
+                                        window, lookback, hedge, progress=task.progress)
+                df = analysis.df
+                result = significance_test(df[analysis.stock1_price_col].to_numpy(), df[analysis.stock2_price_col].to_numpy(), num_stdevs, capital,
+                                           order_size, window, lookback, hedge, num_paths=num_paths, block_size=block_size,
+                                           max_memory_mb=max_memory_mb, progress=task.progress)
+                return analysis, result
+
+            def show_significance(tested):
+                analysis, result = tested
+                show_analysis(analysis)
+                self.charts.set_significance(result)
+
+            self.start_task(run, show_significance)
+
+        def portfolio_test():
+            """
+            Backtests every pair in a pairs file together from one pool of the starting capital
+            The whole book's and each pair's equity are drawn, with each pair's metrics in a table under them
+            """
+            file_path = filedialog.askopenfilename(title="Select Pairs File", filetypes=[("CSV Files", "*.csv"), ("JSON Files", "*.json"), ("All Files", "*.*")])
+            if not file_path:
+                return
+            self.stop_live()
+            num_stdevs, capital, order_size = self.num_stdevs.get(), self.capital.get(), self.order_size.get()
+            window, lookback, hedge = self.window_settings()
+
+            def run(task):
+                pairs = read_pairs(file_path, order_size)
+                return pairs, backtest_portfolio(pairs, num_stdevs, capital, order_size, window, lookback, hedge, progress=task.progress)
+
+            def show_portfolio(tested):
+                pairs, result = tested
+                self.last_analysis = None # display settings have nothing to redraw
+                self.clear_graphs()
+                self.create_portfolio_graph(graphs_frame, result, pairs)
+
+                for key in ["correl", "hedge", "coint", "half_life"]: # only meaningful for one pair
+                    self.labels[key].config(text="")
+                self.labels["sharpe"].config(text=round(result.sharpe_ratio, 4))
+                self.labels["return"].config(text=f"{result.return_pct:.2f}%")
+                self.labels["trades"].config(text=result.num_trades)
+
+            self.start_task(run, show_portfolio)
+
+        def load_configuration(num_stdevs, order_size, capital):
+            """
+            Sets the settings to a configuration picked from the sweep heatmap and tests it
+            """
+            self.num_stdevs.set(num_stdevs)
+            self.order_size.set(order_size)
+            self.capital.set(capital)
+            submit()
 
-            # reset graphs if they exist
-            if self.analysis_graph: 
-                self.analysis_graph.get_tk_widget().destroy() # remove canvas from tkinter
-                self.analysis_graph = None # reset reference
-                self.analysis_toolbar.destroy() # remove toolbar
-                self.analysis_toolbar = None # reset reference
-
-                self.portfolio_graph.get_tk_widget().destroy()
-                self.portfolio_graph = None
-                self.portfolio_toolbar.destroy()
-                self.portfolio_toolbar = None
-                close_graphs() # close plots
-            
         # Create reset button
         reset_btn = ttk.Button(submit_frame, text="Reset", command = reset)
         reset_btn.grid(row=0, column=0, sticky="se")
@@ -362,41 +564,287 @@ class TradingApp(ttk.Frame): # class is extension of a tkinter frame
         # Create submit button
         submit_btn = ttk.Button(submit_frame, text="Test", command = submit)
         submit_btn.grid(row=0, column=1, sticky="se", padx=10)
+        self.submit_btn = submit_btn # kept so other widgets can trigger a test
+
+        # Create sweep button
+        sweep_btn = ttk.Button(submit_frame, text="Sweep", bootstyle="outline", command = sweep)
+        sweep_btn.grid(row=0, column=2, sticky="se")
 
+        # Create live button
+        self.live_btn = ttk.Button(submit_frame, text="Live", bootstyle="success-outline", command = live)
+        self.live_btn.grid(row=0, column=3, sticky="se", padx=10)
 
-    def create_graphs(self, graphs_frame):
+        # Create walk-forward button
+        walk_forward_btn = ttk.Button(submit_frame, text="Walk-Forward", bootstyle="outline", command = walk_forward_test)
+        walk_forward_btn.grid(row=0, column=4, sticky="se")
+
+        # Create significance button
+        significance_btn = ttk.Button(submit_frame, text="Significance", bootstyle="outline", command = significance)
+        significance_btn.grid(row=0, column=5, sticky="se", padx=10)
+
+        # Create portfolio button
+        portfolio_btn = ttk.Button(submit_frame, text="Portfolio", bootstyle="outline", command = portfolio_test)
+        portfolio_btn.grid(row=0, column=6, sticky="se")
+        self.task_buttons += [submit_btn, sweep_btn, self.live_btn, walk_forward_btn, significance_btn, portfolio_btn] # disabled while a task is running
+
+        # Progress of background tasks
+        self.progress_bar = ttk.Progressbar(submit_frame, maximum=1.0, length=200)
+        self.progress_bar.grid(row=1, column=0, columnspan=2, pady=10, sticky="ew")
+
+        self.cancel_btn = ttk.Button(submit_frame, text="Cancel", bootstyle="danger-outline", state=DISABLED, command=self.cancel_task)
+        self.cancel_btn.grid(row=1, column=2, padx=10, pady=10)
+
+        self.labels["status"] = ttk.Label(submit_frame, text="", foreground="white", font=("Helvetica Neue", 10))
+        self.labels["status"].grid(row=2, column=0, columnspan=7, sticky="nw")
+
+
+    def start_task(self, function, on_done):
+        """
+        Runs function on a background thread with progress shown under the Test button
+        Parameters:
+            function: called with the BackgroundTask, use task.progress(fraction, message) to report progress
+            on_done: called on the Tk thread with the function's return value
+        """
+        if self.task and not self.task.finished:
+            return # only one run at a time
+
+        def finish():
+            self.task = None
+            self.cancel_btn.config(state=DISABLED)
+            for button in self.task_buttons:
+                button.config(state=NORMAL)
+
+        def done(result):
+            finish()
+            self.progress_bar.config(value=1.0)
+            self.labels["status"].config(text="")
+            on_done(result)
+
+        def show_progress(fraction, message):
+            self.progress_bar.config(value=fraction)
+            self.labels["status"].config(text=message)
+
+        def cancelled():
+            finish()
+            self.progress_bar.config(value=0)
+            self.labels["status"].config(text="Cancelled")
+
+        def failed(error):
+            finish()
+            self.progress_bar.config(value=0)
+            self.labels["status"].config(text="")
+            Messagebox.show_error(message=str(error), title="Error")
+
+        for button in self.task_buttons:
+            button.config(state=DISABLED)
+        self.cancel_btn.config(state=NORMAL)
+        self.progress_bar.config(value=0)
+
+        self.task = BackgroundTask(function)
+        self.task.start(self, done, on_progress=show_progress, on_error=failed, on_cancel=cancelled)
+
+
+    def traced(self, name: str, function):
         """
-        Draws graphs in graphs_frame parameter which is initialized in __init__ and passed from create_submit_rest to this function
+        Wraps a task function so its run is timed as one stage, and profiled if Profile Runs was ticked when the test started
         """
-        # Embed trade analysis graph
-        self.analysis_graph = FigureCanvasTkAgg(self.fig1, master=graphs_frame)
-        self.analysis_graph.get_tk_widget().grid(row=0, column=0, padx = 5, pady=5)
-        self.analysis_graph.draw()
+        profiling = self.profiling
 
-        # Embed portfolio graph
-        self.portfolio_graph = FigureCanvasTkAgg(self.fig2, master=graphs_frame)
-        self.portfolio_graph.get_tk_widget().grid(row=2, column=0, padx= 5, pady=5)
+        def run(task):
+            with tracer.profiled(profiling), span(name):
+                return function(task)
+        return run
+
+
+    def window_settings(self):
+        """
+        Returns the (window, lookback, hedge) settings for analyze_pair, read on the Tk thread
+        """
+        return WINDOW_MODES[self.window_mode.get()], self.lookback.get(), HEDGE_MODELS[self.hedge_model.get()]
+
+
+    def stop_live(self):
+        """
+        Stops following the live feed, the graphs keep the bars received so far
+        """
+        if self.live_feed:
+            self.live_feed.stop() # the feed calls back once its thread has finished
+
+
+    def cancel_task(self):
+        """
+        Asks the running background task to stop
+        """
+        if self.task:
+            self.task.cancel()
+            self.labels["status"].config(text="Cancelling...")
+
+
+    def show_charts(self, analysis):
+        """
+        Draws the results of analyze_pair in the price/spread and portfolio graphs, the graphs are only built the first time
+        """
+        with tracer.profiled(self.profiling), span("show charts"):
+            self.clear_graphs()
+            if self.charts is None:
+                with span("create charts"):
+                    self.charts = PairCharts()
+                    self.charts.attach(self.graphs_frame)
+            self.charts.update(analysis, self.threshold_setting.get(), self.mean_setting.get(), self.signal_setting.get(), draw=False)
+            self.charts.show()
+            self.charts.render() # drawn now rather than when idle so the drawing is timed
+
+
+    def redraw_graphs(self, *args):
+        """
+        Updates the overlays on the price/spread graph, used when a display setting changes
+        """
+        if self.last_analysis is None or self.charts is None or not self.charts.visible:
+            return # nothing tested yet, or the sweep heatmaps are showing
+        self.charts.set_overlays(self.threshold_setting.get(), self.mean_setting.get(), self.signal_setting.get())
+
+
+    def clear_graphs(self):
+        """
+        Removes any graphs currently shown in the graphs frame
+        """
+        if self.charts:
+            self.charts.hide() # kept for the next test
+
+        if self.sweep_graph:
+            self.sweep_graph.get_tk_widget().destroy()
+            self.sweep_graph = None
+            self.sweep_fig = None
+
+        if self.fold_table:
+            self.fold_table.destroy()
+            self.fold_table = None
+
+        if self.portfolio_graph:
+            self.portfolio_graph.get_tk_widget().destroy()
+            self.portfolio_graph = None
+            self.portfolio_table.destroy()
+            self.portfolio_table = None
+
+
+    def show_fold_table(self, graphs_frame, result):
+        """
+        Shows the metrics of each walk-forward fold next to the portfolio graph, with the stitched out-of-sample totals last
+        Parameters:
+            graphs_frame: frame the graphs are in
+            result (WalkForwardResult): output of walk_forward
+        """
+        columns = ["Fold", "Test Start", "Test End", "SD", "Hedge", "Sharpe Ratio", "Return", "Trades"]
+        self.fold_table = ttk.Treeview(graphs_frame, columns=columns, show="headings", height=12)
+        for column in columns:
+            self.fold_table.heading(column, text=column)
+            self.fold_table.column(column, width=75, anchor="e")
+        self.fold_table.grid(row=2, column=1, padx=5, pady=5, sticky="n")
+
+        for row in result.folds.itertuples():
+            self.fold_table.insert("", END, values=(row.fold, f"{row.test_start:%Y-%m-%d}", f"{row.test_end:%Y-%m-%d}", row.num_stdevs,
+                                                    round(row.hedge_ratio, 3), round(row.sharpe_ratio, 4), f"{row.return_pct:.2f}%", row.num_trades))
+        self.fold_table.insert("", END, values=("All", "", "", "", "", round(result.sharpe_ratio, 4), f"{result.return_pct:.2f}%", result.num_trades))
+
+
+    def create_sweep_graph(self, graphs_frame, results, on_select):
+        """
+        Draws Sharpe ratio and total return heatmaps of sweep results in graphs_frame
+        Parameters:
+            results (df): output of run_sweep
+            on_select (function): called with (num_stdevs, order_size, capital) when a cell is clicked
+        """
+        apply_plot_style()
+        self.sweep_fig = Figure(figsize=(7, 9))
+        axes = self.sweep_fig.subplots(2, 1)
+
+        tables = {}
+        for ax, value_col, title in zip(axes, ["sharpe_ratio", "return_pct"], ["Sharpe Ratio", "Total Return (%)"]):
+            table = sweep_table(results, value_col)
+            tables[ax] = table
+
+            image = ax.imshow(table.to_numpy(), aspect="auto", cmap="viridis", origin="lower")
+            self.sweep_fig.colorbar(image, ax=ax)
+
+            ax.set_xticks(range(len(table.columns)))
+            ax.set_xticklabels([f"{sd:g}" for sd in table.columns], rotation=90)
+            ax.set_yticks(range(len(table.index)))
+            ax.set_yticklabels([f"${capital:g} / {size}" for capital, size in table.index])
+            ax.set_xlabel("SD Threshold")
+            ax.set_ylabel("Capital / Order Size")
+            ax.set_title(f"{title} - click a cell to test it")
+
+        self.sweep_fig.tight_layout()
+
+        def on_click(event):
+            """
+            Maps a click on a heatmap cell back to its configuration
+            """
+            if event.inaxes not in tables or event.xdata is None:
+                return
+            table = tables[event.inaxes]
+            column = int(round(event.xdata))
+            row = int(round(event.ydata))
+            if 0 <= column < len(table.columns) and 0 <= row < len(table.index):
+                capital, order_size = table.index[row]
+                on_select(float(table.columns[column]), int(order_size), float(capital))
+
+        self.sweep_graph = FigureCanvasTkAgg(self.sweep_fig, master=graphs_frame)
+        self.sweep_graph.mpl_connect("button_press_event", on_click)
+        self.sweep_graph.get_tk_widget().grid(row=0, column=0, padx=5, pady=5, rowspan=4)
+        self.sweep_graph.draw()
+
+
+    def create_portfolio_graph(self, graphs_frame, result, pairs):
+        """
+        Draws the equity of a portfolio test in graphs_frame with each pair's metrics under it, the whole book last
+        Double clicking a pair loads it into the stock widgets and tests it on its own
+        Parameters:
+            result (PortfolioResult): output of backtest_portfolio
+            pairs (list): (stock1, file1, stock2, file2, order_size) tuples tested, in the same order
+        """
+        self.portfolio_graph = FigureCanvasTkAgg(portfolio_figure(result), master=graphs_frame)
+        self.portfolio_graph.get_tk_widget().grid(row=0, column=0, padx=5, pady=5)
         self.portfolio_graph.draw()
 
-        # Add toolbars for both graphs
-        analysis_toolbar_frame = ttk.Frame(graphs_frame)
-        analysis_toolbar_frame.grid(row=1, column=0)
-        self.analysis_toolbar = NavigationToolbar2Tk(self.analysis_graph, analysis_toolbar_frame, pack_toolbar=False)
-        self.analysis_toolbar.update()
-        self.analysis_toolbar.pack(side="right", fill="y", expand=True)
+        columns = ["Pair", "Order Size", "Allocation", "Sharpe Ratio", "Total Return", "Trades", "Position"]
+        self.portfolio_table = ttk.Treeview(graphs_frame, columns=columns, show="headings", height=8)
+        for column in columns:
+            self.portfolio_table.heading(column, text=column)
+            self.portfolio_table.column(column, width=95, anchor="e")
+        self.portfolio_table.grid(row=1, column=0, padx=5, pady=5, sticky="n")
+
+        for i, name in enumerate(result.pair_names):
+            self.portfolio_table.insert("", END, iid=str(i), values=(name, int(result.order_sizes[i]), f"${result.allocations[i]:,.0f}",
+                                                                     round(result.pair_sharpe[i], 4), f"{result.pair_return[i]:.2f}%",
+                                                                     result.pair_trades[i], result.positions[-1, i]))
+        self.portfolio_table.insert("", END, values=("Portfolio", "", f"${result.allocations.sum():,.0f}", round(result.sharpe_ratio, 4),
+                                                     f"{result.return_pct:.2f}%", result.num_trades, ""))
+
+        def load_pair_selection(event):
+            """
+            Loads the double clicked pair into the stock widgets and tests it with its order size
+            """
+            selected = self.portfolio_table.focus()
+            if not selected.isdigit():
+                return # the whole book's row
+            stock1, file1, stock2, file2, order_size = pairs[int(selected)]
+            for widget_number, (ticker, file_path, name_var, path_var) in enumerate([(stock1, file1, self.stock1_name, self.file_path1),
+                                                                                   (stock2, file2, self.stock2_name, self.file_path2)]):
+                name_var.set(ticker)
+                path_var.set(file_path)
+                self.labels[f"file{widget_number+1}"].config(text=f"File {widget_number+1}: {file_path}")
+            self.order_size.set(order_size)
+            self.submit_btn.invoke()
 
-        portfolio_toolbar_frame = ttk.Frame(graphs_frame)
-        portfolio_toolbar_frame.grid(row=3, column=0)
-        self.portfolio_toolbar = NavigationToolbar2Tk(self.portfolio_graph, portfolio_toolbar_frame, pack_toolbar=False)
-        self.portfolio_toolbar.update()
-        self.portfolio_toolbar.pack(side="right", fill="y", expand=True)
+        self.portfolio_table.bind("<Double-1>", load_pair_selection)
 
 
     def create_stats(self):
         """
         Creates statistics widget
         """
-        stats_frame = ttk.Frame(self, width=600, height=170)
+        stats_frame = ttk.Frame(self, width=600, height=294)
         stats_frame.grid(row=0, column=1, padx=20, pady=40, sticky="n")
         stats_frame.grid_propagate(False)
 
@@ -430,6 +878,76 @@ class TradingApp(ttk.Frame): # class is extension of a tkinter frame
         num_trades_value_label.grid(row=3, column=1, sticky="nw", padx=10, pady=10)
         self.labels["trades"] = num_trades_value_label
 
+        hedge_label = ttk.Label(stats_frame, text="Hedge Ratio:", foreground="white", font=("Helvetica Neue", 10))
+        hedge_label.grid(row=4, column=0, sticky="nw", padx=10, pady=10)
+
+        hedge_value_label = ttk.Label(stats_frame, text="", foreground="white", font=("Helvetica Neue", 10))
+        hedge_value_label.grid(row=4, column=1, sticky="nw", padx=10, pady=10)
+        self.labels["hedge"] = hedge_value_label
+
+        coint_label = ttk.Label(stats_frame, text="Cointegration p-value:", foreground="white", font=("Helvetica Neue", 10))
+        coint_label.grid(row=5, column=0, sticky="nw", padx=10, pady=10)
+
+        coint_value_label = ttk.Label(stats_frame, text="", foreground="white", font=("Helvetica Neue", 10))
+        coint_value_label.grid(row=5, column=1, sticky="nw", padx=10, pady=10)
+        self.labels["coint"] = coint_value_label
+
+        half_life_label = ttk.Label(stats_frame, text="Half-life (bars):", foreground="white", font=("Helvetica Neue", 10))
+        half_life_label.grid(row=6, column=0, sticky="nw", padx=10, pady=10)
+
+        half_life_value_label = ttk.Label(stats_frame, text="", foreground="white", font=("Helvetica Neue", 10))
+        half_life_value_label.grid(row=6, column=1, sticky="nw", padx=10, pady=10)
+        self.labels["half_life"] = half_life_value_label
+
+
+    def create_performance(self):
+        """
+        Creates the performance panel showing how long each stage of the last test took
+        """
+        perf_frame = ttk.Frame(self, width=600)
+        perf_frame.grid(row=1, column=1, padx=20, pady=20, sticky="n")
+
+        perf_label = ttk.Label(perf_frame, text="Last Run:", foreground="white", font=("Helvetica Neue", 20))
+        perf_label.grid(row=0, column=0, columnspan=2, sticky="nw", padx=10, pady=10)
+
+        self.timings_table = ttk.Treeview(perf_frame, columns=["ms"], show="tree headings", height=18)
+        self.timings_table.heading("#0", text="Stage")
+        self.timings_table.heading("ms", text="Time (ms)")
+        self.timings_table.column("#0", width=320)
+        self.timings_table.column("ms", width=100, anchor="e")
+        self.timings_table.grid(row=1, column=0, columnspan=2, padx=10, pady=5)
+
+        def export_timings(trace_format: str):
+            """
+            Saves the last run's stages as JSON, or as a Chrome trace for chrome://tracing or Perfetto
+            """
+            file_path = filedialog.asksaveasfilename(title="Export Timings", defaultextension=".json", filetypes=[("JSON", "*.json")])
+            if file_path:
+                tracer.export(file_path, trace_format)
+
+        json_btn = ttk.Button(perf_frame, text="Export JSON", bootstyle="outline", command=lambda: export_timings("json"))
+        json_btn.grid(row=2, column=0, padx=10, pady=5, sticky="w")
+
+        trace_btn = ttk.Button(perf_frame, text="Export Chrome Trace", bootstyle="outline", command=lambda: export_timings("chrome"))
+        trace_btn.grid(row=2, column=1, padx=10, pady=5, sticky="e")
+
+
+    def show_timings(self):
+        """
+        Fills the performance panel with the stages recorded by the tracer, nested stages under the stage that ran them.
+        Profiled runs also list the functions with the most cumulative time
+        """
+        self.timings_table.delete(*self.timings_table.get_children())
+        for stage in tracer.ordered_spans():
+            parent = str(stage.parent_id) if self.timings_table.exists(str(stage.parent_id)) else ""
+            self.timings_table.insert(parent, END, iid=str(stage.span_id), text=stage.name, values=[f"{stage.duration * 1000:,.1f}"], open=True)
+
+        profile_rows = tracer.profile_rows(limit=15)
+        if profile_rows:
+            profile_node = self.timings_table.insert("", END, text="Profile (cumulative)", open=False)
+            for row in profile_rows:
+                self.timings_table.insert(profile_node, END, text=row["function"], values=[f"{row['cumulative_seconds'] * 1000:,.1f}"])
+
 
     def create_settings(self):
         """
@@ -463,6 +981,27 @@ class TradingApp(ttk.Frame): # class is extension of a tkinter frame
         stdev_input = ttk.Spinbox(settings_frame, from_=1, to=3, increment=0.5, textvariable=self.num_stdevs)
         stdev_input.grid(row=3, column=1, padx=10, pady=10)
 
+        # Spread mean/stdev window setting, rolling and expanding windows only use bars before each trade
+        window_label = ttk.Label(settings_frame, text="SD Window", foreground="white", font=("Helvetica Neue", 10))
+        window_label.grid(row=4, column=0, sticky="nw", padx=10, pady=10)
+
+        window_input = ttk.Combobox(settings_frame, values=list(WINDOW_MODES), textvariable=self.window_mode, state="readonly")
+        window_input.grid(row=4, column=1, padx=10, pady=10)
+
+        # Lookback setting, bars in the rolling window
+        lookback_label = ttk.Label(settings_frame, text="Lookback (bars)", foreground="white", font=("Helvetica Neue", 10))
+        lookback_label.grid(row=5, column=0, sticky="nw", padx=10, pady=10)
+
+        lookback_input = ttk.Spinbox(settings_frame, from_=2, to=1000, increment=10, textvariable=self.lookback)
+        lookback_input.grid(row=5, column=1, padx=10, pady=10)
+
+        # Hedge ratio setting, shares of stock2 traded per share of stock1
+        hedge_label = ttk.Label(settings_frame, text="Hedge Ratio", foreground="white", font=("Helvetica Neue", 10))
+        hedge_label.grid(row=6, column=0, sticky="nw", padx=10, pady=10)
+
+        hedge_input = ttk.Combobox(settings_frame, values=list(HEDGE_MODELS), textvariable=self.hedge_model, state="readonly")
+        hedge_input.grid(row=6, column=1, padx=10, pady=10)
+
         def check_setting_widget(frame, label_text: str, var, row_num: int):
             """
             Creates settings with label and checkbox
@@ -477,19 +1016,48 @@ class TradingApp(ttk.Frame): # class is extension of a tkinter frame
             check = ttk.Checkbutton(frame, variable=var, padding=10)
             check.grid(row=row_num, column=1, padx=10, pady=5)
 
-        check_setting_widget(settings_frame, "Show Thresholds", self.threshold_setting, 4) # Threshold line setting
-        check_setting_widget(settings_frame, "Show Price Mean", self.mean_setting, 5) # Stock mean setting
-        check_setting_widget(settings_frame, "Show Trade Signals", self.signal_setting, 6) # Trade signal setting
+        check_setting_widget(settings_frame, "Show Thresholds", self.threshold_setting, 7) # Threshold line setting
+        check_setting_widget(settings_frame, "Show Price Mean", self.mean_setting, 8) # Stock mean setting
+        check_setting_widget(settings_frame, "Show Trade Signals", self.signal_setting, 9) # Trade signal setting
+
+        def entry_setting_widget(frame, label_text: str, var, row_num: int):
+            """
+            Creates settings with label and text entry
+            - frame: the frame the widget is in
+            - text (str): the text to display in the label
+            - variable: the StringVar variable tied to the entry
+            - row_num (int): the row in the frames grid to place the widget
+            """
+            entry_label = ttk.Label(frame, text=label_text, foreground="white", font=("Helvetica Neue", 10))
+            entry_label.grid(row=row_num, column=0, sticky="nw", padx=10, pady=10)
+
+            entry = ttk.Entry(frame, textvariable=var)
+            entry.grid(row=row_num, column=1, padx=10, pady=10)
+
+        entry_setting_widget(settings_frame, "Sweep SD (start, stop, step)", self.sweep_sd_range, 10) # SD thresholds to sweep
+        entry_setting_widget(settings_frame, "Sweep Order Sizes", self.sweep_order_sizes, 11) # order sizes to sweep
+        entry_setting_widget(settings_frame, "Sweep Capitals", self.sweep_capitals, 12) # starting capitals to sweep
+        entry_setting_widget(settings_frame, "Screen Top Pairs", self.screen_top_k, 13) # pairs to backtest when screening
+        entry_setting_widget(settings_frame, "Live Feed", self.live_source, 14) # file, tcp://host:port or - for stdin
+        entry_setting_widget(settings_frame, "Walk-Forward Train Bars", self.walk_forward_train, 15) # bars each fold is fitted on
+        entry_setting_widget(settings_frame, "Walk-Forward Test Bars", self.walk_forward_test, 16) # bars each fold trades
+        check_setting_widget(settings_frame, "Walk-Forward Pick SD", self.walk_forward_pick_sd, 17) # pick the best sweep SD in each fold
+        check_setting_widget(settings_frame, "Large Data Mode", self.large_data, 18) # test in chunks, for minute bars
+        entry_setting_widget(settings_frame, "Memory Limit (MB)", self.max_memory, 19) # memory used for chunks in large data mode and significance batches
+        check_setting_widget(settings_frame, "Profile Runs", self.profile_runs, 20) # cProfile each test, shown in the performance panel
+        entry_setting_widget(settings_frame, "Significance Paths", self.significance_paths, 21) # random paths to test the strategy on
+        entry_setting_widget(settings_frame, "Significance Block (bars)", self.significance_block, 22) # bars kept together when resampling
     
 
 def close_graphs():
     plt.close("all") # closes all figures
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support() # needed for process pools when bundled with pyinstaller
     app = ttk.Window(title="Pairs Trading Tool", themename="vapor") # app is the master window
     app.geometry(f"{app.winfo_screenwidth()}x{app.winfo_screenheight()}")  # Set window size to screen size
     TradingApp(app) # initialize Trading app object with app as master window parameter
 
     app.protocol("WM_DELETEWINDOW", lambda: [close_graphs(), app.destory()]) # close when exit
     app.mainloop() # keep window running
-    
\ No newline at end of file
+    
\ No newline at end of file
@@ -0,0 +1,267 @@
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+from backtest import compute_spread, simulate_trades, compute_metrics, rolling_spread_stats, z_score
+from cache import LRUCache
+from cointegration import CointegrationStore, pair_cointegration
+from hedge import hedge_ratios
+from ingest import load_pair, file_identity
+from instrument import span
+
+# Merged prices and spread statistics per (file identities, tickers), shared by every setting tested on that pair
+pair_cache = LRUCache(max_size=8)
+# Full results per (file identities, tickers, capital, order size, SD threshold, window mode, lookback, hedge model)
+result_cache = LRUCache(max_size=32)
+# Engle-Granger results saved between sessions, shared with the screener
+cointegration_store = CointegrationStore()
+
+
+@dataclass
+class PreparedPair:
+    """
+    Merged prices and statistics of a pair that don't depend on the trade settings
+    """
+    df: pd.DataFrame # Date, both price columns and Spread (equal shares)
+    stock1_name: str
+    stock2_name: str
+    stock1_price_col: str
+    stock2_price_col: str
+    correlation: float
+    stock1_mean_price: float
+    stock2_mean_price: float
+    mean_spread: float
+    spread_stdev: float
+    coint_p_value: float # Engle-Granger p-value, small values mean the prices are likely cointegrated
+    half_life: float # bars the cointegrating residual takes to revert half way to its mean
+    window_stats: dict = field(default_factory=dict) # (window, lookback, hedge, hedge lookback) -> (mean_spread, spread_stdev)
+    hedged_spreads: dict = field(default_factory=dict) # (hedge, hedge lookback) -> (hedge_ratio, spread)
+
+
+@dataclass
+class PairAnalysis:
+    """
+    Everything needed to show the results of testing one pair
+    """
+    df: pd.DataFrame # Date, both price columns, Spread, Hedge Ratio, Z-Score, Entries, Exits and Portfolio Value
+    stock1_name: str
+    stock2_name: str
+    stock1_price_col: str
+    stock2_price_col: str
+    correlation: float
+    stock1_mean_price: float
+    stock2_mean_price: float
+    mean_spread: float # floats for the full history window, arrays with a value per bar for rolling and expanding windows
+    upper_threshold: float
+    lower_threshold: float
+    sharpe_ratio: float
+    return_pct: float
+    num_trades: int
+    final_position: int # trade_active at the end of the test
+    hedge_ratio: float = 1.0 # shares of stock2 per share of stock1, an array with a value per bar for rolling OLS and Kalman hedges
+    coint_p_value: float = np.nan # Engle-Granger p-value, NaN when not tested
+    half_life: float = np.nan # bars the cointegrating residual takes to revert half way to its mean
+
+
+def _no_progress(fraction: float, message: str = ""):
+    pass
+
+
+def pair_key(stock1_name: str, file_path1: str, stock2_name: str, file_path2: str):
+    """
+    Cache key for a pair, includes each file's size and modification time so edited files aren't served from the cache
+    """
+    return (file_identity(file_path1), file_identity(file_path2), stock1_name, stock2_name)
+
+
+def result_key(stock1_name: str, file_path1: str, stock2_name: str, file_path2: str, num_stdevs: float, capital: float,
+               order_size: int, window: str = "full", lookback: int = 0, hedge: str = "equal"):
+    """
+    Cache key for the results of testing a pair with the given settings
+    """
+    if window == "full" and hedge != "rolling":
+        lookback = 0 # lookback isn't used, don't let it split the cache
+    return pair_key(stock1_name, file_path1, stock2_name, file_path2) + (capital, order_size, num_stdevs, window, lookback, hedge)
+
+
+def prepare_pair(stock1_name: str, file_path1: str, stock2_name: str, file_path2: str):
+    """
+    Reads, cleans and merges the two stocks and calculates the spread, its statistics and the cointegration test. Uses format from NASDAQ
+    """
+    stock1_price_col = f"{stock1_name} Price" # the name of the column containing the historical prices of stock 1
+    stock2_price_col = f"{stock2_name} Price" # the name of the column containing the historical prices of stock 2
+
+    df = load_pair(file_path1, file_path2, stock1_price_col, stock2_price_col)
+    with span("spread"):
+        df["Spread"] = compute_spread(df[stock1_price_col], df[stock2_price_col]) # calculate spreads column
+    with span("cointegration"):
+        cointegration = pair_cointegration(stock1_name, stock2_name, df["Date"].to_numpy(), df[stock1_price_col].to_numpy(),
+                                           df[stock2_price_col].to_numpy(), cointegration_store)
+
+    return PreparedPair(
+        df=df,
+        stock1_name=stock1_name,
+        stock2_name=stock2_name,
+        stock1_price_col=stock1_price_col,
+        stock2_price_col=stock2_price_col,
+        correlation=df[stock1_price_col].corr(df[stock2_price_col]), # correlation betwen stock1 and stock2
+        stock1_mean_price=df[stock1_price_col].mean(), # historical mean price of stock1
+        stock2_mean_price=df[stock2_price_col].mean(), # historical mean price of stock2
+        mean_spread=np.nanmean(df["Spread"].to_numpy()), # historical mean spread
+        spread_stdev=np.nanstd(df["Spread"].to_numpy(), ddof=1), # sample standard deviation, same as pandas
+        coint_p_value=cointegration.p_value,
+        half_life=cointegration.half_life,
+    )
+
+
+def hedged_spread(prepared: PreparedPair, hedge: str = "equal", lookback: int = 0):
+    """
+    Returns (hedge_ratio, spread) of a prepared pair for a hedge model, see hedge.hedge_ratios
+    Kept on the prepared pair so other trade settings reuse them
+    """
+    if hedge == "equal":
+        return 1.0, prepared.df["Spread"].to_numpy()
+
+    key = (hedge, lookback if hedge == "rolling" else 0)
+    if key not in prepared.hedged_spreads:
+        price1 = prepared.df[prepared.stock1_price_col].to_numpy()
+        price2 = prepared.df[prepared.stock2_price_col].to_numpy()
+        hedge_ratio = hedge_ratios(price1, price2, hedge, lookback)
+        prepared.hedged_spreads[key] = (hedge_ratio, compute_spread(price1, price2, hedge_ratio))
+    return prepared.hedged_spreads[key]
+
+
+def spread_window_stats(prepared: PreparedPair, window: str = "full", lookback: int = 0, hedge: str = "equal"):
+    """
+    Returns (mean_spread, spread_stdev) of a prepared pair for a window mode and hedge model, see backtest.window_thresholds
+    Stats are kept on the prepared pair so other SD thresholds and order sizes reuse them
+    """
+    if window == "full" and hedge == "equal":
+        return prepared.mean_spread, prepared.spread_stdev
+    if window not in ("full", "rolling", "expanding"):
+        raise ValueError(f"Unknown window mode: {window}")
+    if window != "full" and lookback < 2:
+        raise ValueError("Lookback must be at least 2 bars")
+
+    key = (window, lookback if window != "full" else 0, hedge, lookback if hedge == "rolling" else 0)
+    if key not in prepared.window_stats:
+        spread = hedged_spread(prepared, hedge, lookback)[1]
+        if window == "full":
+            prepared.window_stats[key] = (np.nanmean(spread), np.nanstd(spread, ddof=1))
+        else:
+            prepared.window_stats[key] = rolling_spread_stats(spread, lookback, expanding=(window == "expanding"))
+    return prepared.window_stats[key]
+
+
+def simulate_pair(prepared: PreparedPair, num_stdevs: float, capital: float, order_size: int, window: str = "full", lookback: int = 0,
+                  hedge: str = "equal"):
+    """
+    Backtests the pairs strategy on a prepared pair with the given trade settings
+    """
+    with span("hedge ratio"):
+        hedge_ratio, spread = hedged_spread(prepared, hedge, lookback)
+    with span("spread statistics"):
+        mean_spread, spread_stdev = spread_window_stats(prepared, window, lookback, hedge)
+        upper_threshold = mean_spread + (num_stdevs * spread_stdev)
+        lower_threshold = mean_spread - (num_stdevs * spread_stdev)
+
+    prices = prepared.df
+    with span("simulate trades"):
+        result = simulate_trades(prices[prepared.stock1_price_col].to_numpy(), prices[prepared.stock2_price_col].to_numpy(),
+                                 upper_threshold, lower_threshold, capital, order_size, spread=spread, hedge_ratio=hedge_ratio)
+
+    with span("results table"):
+        df = prices.copy(deep=False) # new columns don't touch the cached prepared df
+        df["Spread"] = spread
+        df["Hedge Ratio"] = hedge_ratio
+        df["Z-Score"] = z_score(spread, mean_spread, spread_stdev)
+        df["Entries"] = result.entries
+        df["Exits"] = result.exits
+        df["Portfolio Value"] = result.portfolio_value
+
+    with span("metrics"):
+        sharpe_ratio, return_pct = compute_metrics(result.portfolio_value, capital)
+
+    return PairAnalysis(
+        df=df,
+        stock1_name=prepared.stock1_name,
+        stock2_name=prepared.stock2_name,
+        stock1_price_col=prepared.stock1_price_col,
+        stock2_price_col=prepared.stock2_price_col,
+        correlation=prepared.correlation,
+        stock1_mean_price=prepared.stock1_mean_price,
+        stock2_mean_price=prepared.stock2_mean_price,
+        mean_spread=mean_spread,
+        upper_threshold=upper_threshold,
+        lower_threshold=lower_threshold,
+        sharpe_ratio=sharpe_ratio,
+        return_pct=return_pct,
+        num_trades=result.num_trades,
+        final_position=result.final_position,
+        hedge_ratio=hedge_ratio,
+        coint_p_value=prepared.coint_p_value,
+        half_life=prepared.half_life,
+    )
+
+
+def cached_prepare_pair(stock1_name: str, file_path1: str, stock2_name: str, file_path2: str):
+    """
+    Same as prepare_pair but reuses the result while the files are unchanged
+    """
+    pair = pair_key(stock1_name, file_path1, stock2_name, file_path2)
+    prepared = pair_cache.get(pair)
+    if prepared is None:
+        prepared = prepare_pair(stock1_name, file_path1, stock2_name, file_path2)
+        pair_cache.put(pair, prepared)
+    return prepared
+
+
+def cached_analysis(stock1_name: str, file_path1: str, stock2_name: str, file_path2: str, num_stdevs: float, capital: float,
+                    order_size: int, window: str = "full", lookback: int = 0, hedge: str = "equal"):
+    """
+    Returns the cached results of testing a pair with these settings, or None if they haven't been calculated.
+    Runs on the Tk thread, so a missing file also returns None and the test that follows reports it
+    """
+    try:
+        key = result_key(stock1_name, file_path1, stock2_name, file_path2, num_stdevs, capital, order_size, window, lookback, hedge)
+    except OSError:
+        return None
+    return result_cache.get(key)
+
+
+def analyze_pair(stock1_name: str, file_path1: str, stock2_name: str, file_path2: str, num_stdevs: float, capital: float,
+                 order_size: int, window: str = "full", lookback: int = 0, hedge: str = "equal", progress=None):
+    """
+    Takes the two stocks file locations and backtests the pairs strategy on them. Uses format from NASDAQ
+    Results are cached, and if only the trade settings changed the merged prices and spread statistics are reused
+    Doesn't touch any Tk widgets so it can run on a background thread
+    Parameters:
+        stock1_name, stock2_name (str): tickers used to name the price columns
+        file_path1, file_path2 (str): NASDAQ quote files
+        num_stdevs (float): number of standard deviations for trade entry/exit threshold
+        capital (float): starting capital amount
+        order_size (int): number of stocks of stock1 to buy/sell for each trade, stock2 is traded in proportion to the hedge ratio
+        window (str): "full" to use the whole history for the spread mean and standard deviation, "rolling" or "expanding" to only use past bars
+        lookback (int): bars in the rolling window, or bars before the expanding window starts trading. Also the rolling OLS hedge window
+        hedge (str): hedge ratio model, "equal", "ols", "rolling" or "kalman", see hedge.hedge_ratios
+        progress (function): called with (fraction, message) between stages, may raise to cancel
+    """
+    progress = progress or _no_progress
+
+    key = result_key(stock1_name, file_path1, stock2_name, file_path2, num_stdevs, capital, order_size, window, lookback, hedge)
+    analysis = result_cache.get(key)
+    if analysis is not None:
+        return analysis
+
+    # Read, clean and merge stock data unless this pair is already prepared
+    progress(0.0, "Loading prices")
+    with span("prepare pair"):
+        prepared = cached_prepare_pair(stock1_name, file_path1, stock2_name, file_path2)
+
+    # Simulate trades
+    progress(0.6, "Simulating trades")
+    with span("backtest"):
+        analysis = simulate_pair(prepared, num_stdevs, capital, order_size, window, lookback, hedge)
+    result_cache.put(key, analysis)
+    return analysis
@@ -0,0 +1,333 @@
+import numpy as np
+from dataclasses import dataclass
+
+# Trade states are stored as small integer codes so the whole simulation can run on arrays
+FLAT = 0 # not in a trade
+UPPER = 1 # trade on upper threshold -> short stock1, long stock2
+LOWER = 2 # trade on lower threshold -> long stock1, short stock2
+
+STATE_SIGN = np.array([0, 1, -1], dtype=np.int8) # maps state code to trade_active value used by the app
+
+
+def _build_compose_table():
+    """
+    Builds lookup table for composing two transition functions on the 3 trade states.
+    A transition function f is encoded as f(FLAT) + 3*f(UPPER) + 9*f(LOWER), so there are 27 of them.
+    COMPOSE[g, f] is the code of "apply f, then g"
+    """
+    def decode(code):
+        return (code % 3, (code // 3) % 3, code // 9)
+
+    table = np.empty((27, 27), dtype=np.uint8)
+    for g in range(27):
+        g_map = decode(g)
+        for f in range(27):
+            f_map = decode(f)
+            table[g, f] = g_map[f_map[0]] + 3 * g_map[f_map[1]] + 9 * g_map[f_map[2]]
+    return table
+
+COMPOSE = _build_compose_table()
+
+
+@dataclass
+class BacktestResult:
+    """
+    Arrays produced by simulate_trades, one value per bar
+    """
+    positions: np.ndarray # trade_active per bar: 0 = not in trade, -1 = trade on lower, 1 = trade on upper
+    entries: np.ndarray # spread value on bars where a trade was opened, NaN elsewhere
+    exits: np.ndarray # spread value on bars where a trade was closed, NaN elsewhere
+    cash: np.ndarray # cash after each bar
+    portfolio_value: np.ndarray # cash + long holdings
+    trade_hedge_ratio: np.ndarray # hedge ratio locked in when the open trade was entered, NaN when not in a trade
+    num_trades: int # number of closed trades
+    final_position: int # trade_active after the last bar
+
+
+def compute_spread(price1, price2, hedge_ratio=1.0):
+    """
+    Returns the spread price1 - hedge_ratio * price2 between two price arrays
+    hedge_ratio (float or array): shares of stock2 per share of stock1, see hedge.hedge_ratios
+    """
+    return np.asarray(price1, dtype=float) - hedge_ratio * np.asarray(price2, dtype=float)
+
+
+def spread_thresholds(spread, num_stdevs: float):
+    """
+    Calculates historical mean of the spread and entry/exit thresholds
+    Returns (mean_spread, spread_stdev, upper_threshold, lower_threshold)
+    """
+    mean_spread = np.nanmean(spread)
+    spread_stdev = np.nanstd(spread, ddof=1) # sample standard deviation, same as pandas
+    upper_threshold = mean_spread + (num_stdevs * spread_stdev)
+    lower_threshold = mean_spread - (num_stdevs * spread_stdev)
+    return mean_spread, spread_stdev, upper_threshold, lower_threshold
+
+
+def _rolling_moments(spread, lookback: int):
+    """
+    Count, sum and sum of squares of the valid spread values in the last lookback bars at each bar, in O(n).
+    The history is split into blocks of lookback bars with sums measured from each block's mean, so a window covers
+    the end of one block and the start of the next and the sums never grow large enough to lose precision.
+    Bars are along axis 0, any further axes are separate series (eg bars x paths)
+    Returns (count, total, total_squares, reference) where total and total_squares are measured from reference
+    """
+    n = len(spread)
+    num_blocks = -(-n // lookback)
+    series_shape = spread.shape[1:]
+    column = (-1,) + (1,) * len(series_shape) # shape that broadcasts a per bar or per block index across the series
+
+    padded = np.full((num_blocks * lookback,) + series_shape, np.nan)
+    padded[:n] = spread
+    blocks = padded.reshape((num_blocks, lookback) + series_shape)
+    valid = ~np.isnan(blocks)
+
+    # Mean of each block, blocks without values take the previous block's mean
+    block_count = valid.sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        block_means = np.where(valid, blocks, 0.0).sum(axis=1) / block_count
+    has_mean = block_count > 0
+    last_mean = np.maximum.accumulate(np.where(has_mean, np.arange(num_blocks).reshape(column), 0), axis=0)
+    block_means = np.take_along_axis(block_means, last_mean, axis=0)
+    block_means = np.where(np.isnan(block_means), 0.0, block_means)
+
+    deviation = np.where(valid, blocks - block_means[:, None], 0.0)
+    running = [np.cumsum(values, axis=1).reshape((-1,) + series_shape) for values in [valid, deviation, deviation ** 2]]
+    block_totals = [values.reshape((num_blocks, lookback) + series_shape)[:, -1] for values in running]
+
+    end = np.arange(n)
+    end_block = end // lookback
+    reference = block_means[np.maximum(end_block - 1, 0)] # windows are measured from the mean of the block they start in
+
+    # Start of the current block up to this bar, moved onto the reference
+    head_count, head_total, head_squares = (values[end] for values in running)
+    shift = block_means[end_block] - reference
+    head_squares = head_squares + 2 * shift * head_total + head_count * shift ** 2
+    head_total = head_total + head_count * shift
+
+    # End of the previous block, after the bar lookback bars back
+    before = end - lookback
+    has_tail = before >= 0
+    tail_block = np.maximum(end_block - 1, 0)
+    tail_start = np.maximum(before, 0)
+    tail_count, tail_total, tail_squares = (np.where(has_tail.reshape(column), totals[tail_block] - values[tail_start], 0)
+                                            for values, totals in zip(running, block_totals))
+
+    return head_count + tail_count, head_total + tail_total, head_squares + tail_squares, reference
+
+
+def rolling_spread_stats(spread, lookback: int, expanding: bool = False):
+    """
+    Calculates the mean and standard deviation of the spread at each bar using only that bar and the ones before it, so signals never use future data.
+    Uses running sums so the whole history takes O(n) no matter how long the lookback is
+    Parameters:
+        spread (array): spread values, oldest to newest. NaN values are skipped. A bars x paths array gives the stats of each column
+        lookback (int): number of bars in the rolling window. When expanding, the minimum number of bars before stats are given
+        expanding (bool): use every bar up to now instead of a fixed window
+    Returns (mean_spread, spread_stdev) arrays, NaN until the window has enough bars
+    """
+    spread = np.asarray(spread, dtype=float)
+    valid = ~np.isnan(spread)
+    if not valid.any():
+        return np.full(spread.shape, np.nan), np.full(spread.shape, np.nan)
+
+    if expanding:
+        return expanding_spread_stats(spread, lookback)[:2]
+    window_count, window_total, window_squares, reference = _rolling_moments(spread, lookback)
+    return _window_stats(window_count, window_total, window_squares, reference, max(lookback, 2))
+
+
+def expanding_spread_stats(spread, lookback: int, carry=None):
+    """
+    Expanding window version of rolling_spread_stats that can continue from an earlier part of the history,
+    so a long history can be processed in chunks
+    Parameters:
+        spread (array): spread values of this chunk, oldest to newest, or a bars x paths array
+        lookback (int): minimum number of bars before stats are given
+        carry (tuple): carry returned for the previous chunk, None for the first
+    Returns (mean_spread, spread_stdev, carry)
+    """
+    spread = np.asarray(spread, dtype=float)
+    count, total, squares, reference = carry or (0, 0.0, 0.0, None)
+    valid = ~np.isnan(spread)
+    if reference is None:
+        if not valid.any():
+            return np.full(spread.shape, np.nan), np.full(spread.shape, np.nan), carry
+        reference = np.take_along_axis(spread, valid.argmax(axis=0)[None], axis=0)[0] # measuring from the first value keeps the running sums small
+
+    deviation = np.where(valid, spread - reference, 0.0)
+    window_count = count + np.cumsum(valid, axis=0)
+    window_total = total + np.cumsum(deviation, axis=0)
+    window_squares = squares + np.cumsum(deviation ** 2, axis=0)
+    mean_spread, spread_stdev = _window_stats(window_count, window_total, window_squares, reference, max(lookback, 2))
+    if len(spread):
+        carry = (window_count[-1], window_total[-1], window_squares[-1], reference)
+    return mean_spread, spread_stdev, carry
+
+
+def _window_stats(window_count, window_total, window_squares, reference, min_periods: int):
+    """
+    Mean and sample standard deviation from window sums measured from reference, NaN where the window has fewer than min_periods values
+    """
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_spread = reference + window_total / window_count
+        variance = (window_squares - window_total ** 2 / window_count) / (window_count - 1) # sample variance, same as pandas
+    spread_stdev = np.sqrt(np.maximum(variance, 0.0))
+
+    enough = window_count >= min_periods
+    return np.where(enough, mean_spread, np.nan), np.where(enough, spread_stdev, np.nan)
+
+
+def window_thresholds(spread, num_stdevs: float, window: str = "full", lookback: int = 0):
+    """
+    Calculates the spread mean and entry/exit thresholds for a window mode
+        - "full": one mean and standard deviation over the whole history, as floats
+        - "rolling": over the last lookback bars at each bar, as arrays
+        - "expanding": over every bar so far at each bar, as arrays
+    Returns (mean_spread, spread_stdev, upper_threshold, lower_threshold)
+    """
+    if window == "full":
+        return spread_thresholds(spread, num_stdevs)
+    if window not in ("rolling", "expanding"):
+        raise ValueError(f"Unknown window mode: {window}")
+    if lookback < 2:
+        raise ValueError("Lookback must be at least 2 bars")
+
+    mean_spread, spread_stdev = rolling_spread_stats(spread, lookback, expanding=(window == "expanding"))
+    upper_threshold = mean_spread + (num_stdevs * spread_stdev)
+    lower_threshold = mean_spread - (num_stdevs * spread_stdev)
+    return mean_spread, spread_stdev, upper_threshold, lower_threshold
+
+
+def z_score(spread, mean_spread, spread_stdev):
+    """
+    Number of standard deviations the spread is from its mean at each bar
+    """
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (np.asarray(spread, dtype=float) - mean_spread) / spread_stdev
+
+
+def transition_codes(spread, upper_threshold, lower_threshold):
+    """
+    Encodes the trade state machine for each bar as a transition function code (see COMPOSE).
+    Thresholds may be scalars or arrays broadcastable against spread
+        - FLAT opens on UPPER if spread > upper, on LOWER if spread < lower
+        - UPPER closes if spread < upper
+        - LOWER closes if spread > lower
+    """
+    above = spread > upper_threshold
+    below = spread < lower_threshold
+
+    from_flat = np.where(above, UPPER, np.where(below, LOWER, FLAT))
+    from_upper = np.where(spread < upper_threshold, FLAT, UPPER)
+    from_lower = np.where(spread > lower_threshold, FLAT, LOWER)
+
+    return (from_flat + 3 * from_upper + 9 * from_lower).astype(np.uint8)
+
+
+def run_states(codes, initial_state: int = FLAT):
+    """
+    Resolves per-bar transition codes into the state after each bar.
+    Uses a prefix scan over composed transition functions, so it takes log2(n) whole-array passes instead of a python loop.
+    Works along axis 0, any trailing axes are treated as independent paths
+    """
+    prefix = np.array(codes, dtype=np.uint8, copy=True)
+    n = prefix.shape[0]
+    step = 1
+    while step < n:
+        prefix[step:] = COMPOSE[prefix[step:], prefix[:-step]] # right hand side is evaluated before assignment
+        step *= 2
+
+    # Apply composed function to the initial state
+    if initial_state == FLAT:
+        return prefix % 3
+    elif initial_state == UPPER:
+        return (prefix // 3) % 3
+    return prefix // 9
+
+
+def simulate_trades(price1, price2, upper_threshold, lower_threshold, capital: float, order_size, spread=None,
+                    initial_state: int = FLAT, hedge_ratio=1.0, entry_hedge_ratio=None):
+    """
+    Simulates the pairs trading strategy with whole-array operations.
+    Gives the same results as stepping through each day: trades open when the spread leaves the threshold band and close when it returns.
+    Parameters:
+        price1, price2 (array): prices of stock1 and stock2, oldest to newest
+        upper_threshold, lower_threshold (float or array): entry/exit thresholds for the spread
+        capital (float): starting cash
+        order_size (int): number of stocks of stock1 to buy/sell for each trade
+        spread (array): spread to trade on, defaults to compute_spread(price1, price2, hedge_ratio)
+        initial_state (int): trade state before the first bar
+        hedge_ratio (float or array): shares of stock2 traded per share of stock1, kept from a trade's entry until its exit
+        entry_hedge_ratio (float): hedge ratio of a trade already open before the first bar, defaults to the first bar's
+    """
+    price1 = np.asarray(price1, dtype=float)
+    price2 = np.asarray(price2, dtype=float)
+    if spread is None:
+        spread = compute_spread(price1, price2, hedge_ratio)
+
+    states = run_states(transition_codes(spread, upper_threshold, lower_threshold), initial_state)
+    positions = STATE_SIGN[states]
+
+    # Change in trade_active each bar: +-1 when opening, -+1 when closing
+    previous = np.empty_like(positions)
+    previous[0] = STATE_SIGN[initial_state]
+    previous[1:] = positions[:-1]
+    delta = positions - previous
+
+    opened = (positions != 0) & (previous == 0)
+    closed = (positions == 0) & (previous != 0)
+    entries = np.where(opened, spread, np.nan)
+    exits = np.where(closed, spread, np.nan)
+
+    # Hedge ratio of each bar's trade, from the bar it was entered on (or before the first bar) up to the bar it exits on
+    hedge_ratio = np.broadcast_to(np.asarray(hedge_ratio, dtype=float), positions.shape)
+    bar = np.arange(len(positions)).reshape((-1,) + (1,) * (positions.ndim - 1))
+    entry_bar = np.maximum.accumulate(np.where(opened, bar, -1), axis=0)
+    locked = np.take_along_axis(hedge_ratio, np.maximum(entry_bar, 0), axis=0)
+    if len(positions):
+        locked = np.where(entry_bar >= 0, locked, hedge_ratio[0] if entry_hedge_ratio is None else entry_hedge_ratio)
+
+    # Cash flows in the same order as trading each leg: stock1 first, then stock2.
+    # Interleaving the legs keeps the running total identical to adding them one at a time
+    leg1_value = price1 * order_size
+    leg2_value = price2 * (order_size * locked)
+    traded = delta != 0
+    flows = np.empty((2 * len(positions) + 1,) + positions.shape[1:])
+    flows[0] = capital
+    flows[1::2] = np.where(traded, delta * leg1_value, 0.0)
+    flows[2::2] = np.where(traded, -delta * leg2_value, 0.0)
+    cash = np.add.accumulate(flows, axis=0)[2::2]
+
+    # Portfolio value --> cash + value of the long legs. Stock2 is long in an upper trade, or in a lower trade with a negative hedge ratio
+    # where leg2_value is negative, so its holding is worth the absolute value
+    with np.errstate(invalid="ignore"):
+        leg2_long = positions * locked > 0
+    holdings_value = np.where(positions == -1, leg1_value, 0.0) + np.where(leg2_long, np.abs(leg2_value), 0.0)
+    portfolio_value = cash + holdings_value
+
+    return BacktestResult(
+        positions=positions,
+        entries=entries,
+        exits=exits,
+        cash=cash,
+        portfolio_value=portfolio_value,
+        trade_hedge_ratio=np.where(positions != 0, locked, np.nan),
+        num_trades=int(np.count_nonzero(closed)),
+        final_position=int(positions[-1]) if positions.ndim == 1 and len(positions) else 0,
+    )
+
+
+def compute_metrics(portfolio_value, capital: float):
+    """
+    Calculates performance of a simulated portfolio
+    Returns (sharpe_ratio, return_pct) where sharpe_ratio is the mean over standard deviation of the per bar returns
+    Works along axis 0 so multiple portfolios can be passed as columns
+    """
+    portfolio_value = np.asarray(portfolio_value, dtype=float)
+    returns = portfolio_value[1:] / portfolio_value[:-1] - 1 # same as pct_change
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        sharpe_ratio = np.nanmean(returns, axis=0) / np.nanstd(returns, axis=0, ddof=1)
+    return_pct = (portfolio_value[-1] - capital) / capital * 100
+    return sharpe_ratio, return_pct
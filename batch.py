@@ -0,0 +1,260 @@
+"""
+Headless entry point for backtesting pairs without the GUI
+
+Examples:
+    python batch.py --pair KO "KO historical quotes.csv" PEP "PEP historical quotes.csv" --num-stdevs 1 1.5 2
+    python batch.py --jobs jobs.csv --format csv --output results.csv
+    python batch.py --jobs pairs.csv --portfolio --capital 100000 --equity equity.csv
+    python batch.py --gui
+
+Tk and matplotlib are only imported for --gui or --charts so batch runs start quickly
+"""
+import argparse
+import csv
+import itertools
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from analysis import analyze_pair
+from portfolio import backtest_portfolio, portfolio_table, equity_table, read_pairs
+from sweep import collect_results
+
+JOB_FIELDS = ["stock1", "file1", "stock2", "file2", "num_stdevs", "capital", "order_size", "window", "lookback", "hedge"]
+RESULT_FIELDS = JOB_FIELDS + ["correlation", "hedge_ratio", "sharpe_ratio", "return_pct", "num_trades", "final_position", "chart", "error"]
+JOB_TYPES = {"num_stdevs": float, "capital": float, "order_size": int, "lookback": int}
+
+# Output folder for charts in each worker process, set once by _init_worker
+_worker_data = {}
+
+
+def read_jobs(file_path: str, defaults: dict):
+    """
+    Reads jobs from a JSON list of objects or a CSV with a header row, using JOB_FIELDS as keys.
+    Settings missing from a job are taken from defaults
+    """
+    with open(file_path, "r", newline="") as f:
+        if file_path.lower().endswith(".json"):
+            rows = json.load(f)
+        else:
+            rows = list(csv.DictReader(f))
+
+    jobs = []
+    for row in rows:
+        job = dict(defaults)
+        job.update({key: value for key, value in row.items() if key in JOB_FIELDS and value not in ("", None)})
+        missing = [key for key in JOB_FIELDS if key not in job]
+        if missing:
+            raise ValueError(f"Job {len(jobs) + 1} in {file_path} is missing {', '.join(missing)}")
+        for key, value_type in JOB_TYPES.items():
+            job[key] = value_type(job[key])
+        jobs.append(job)
+    return jobs
+
+
+def expand_jobs(pairs, num_stdevs_values, capitals, order_sizes, window: str, lookback: int, hedge: str = "equal"):
+    """
+    Returns a job for every combination of pair and settings
+    Parameters:
+        pairs (list): (stock1, file1, stock2, file2) tuples
+        num_stdevs_values, capitals, order_sizes (list): values to cross
+        window, lookback: spread window mode, see backtest.window_thresholds
+        hedge (str): hedge ratio model, see hedge.hedge_ratios
+    """
+    return [
+        {"stock1": stock1, "file1": file1, "stock2": stock2, "file2": file2, "num_stdevs": num_stdevs, "capital": capital,
+         "order_size": order_size, "window": window, "lookback": lookback, "hedge": hedge}
+        for (stock1, file1, stock2, file2), num_stdevs, capital, order_size in itertools.product(pairs, num_stdevs_values, capitals, order_sizes)
+    ]
+
+
+def _init_worker(chart_dir):
+    """
+    Stores the chart folder in the worker
+    """
+    _worker_data["chart_dir"] = chart_dir
+
+
+def _run_job(job):
+    """
+    Backtests one job, errors are reported in the result so one bad file doesn't stop the batch
+    """
+    result = {key: job[key] for key in JOB_FIELDS}
+    try:
+        analysis = analyze_pair(job["stock1"], job["file1"], job["stock2"], job["file2"], job["num_stdevs"], job["capital"],
+                                job["order_size"], job["window"], job["lookback"], job["hedge"])
+        result.update({
+            "correlation": float(analysis.correlation),
+            "hedge_ratio": float(analysis.df["Hedge Ratio"].iloc[-1]), # latest for rolling OLS and Kalman
+            "sharpe_ratio": float(analysis.sharpe_ratio),
+            "return_pct": float(analysis.return_pct),
+            "num_trades": analysis.num_trades,
+            "final_position": analysis.final_position,
+        })
+        if _worker_data.get("chart_dir"):
+            result["chart"] = save_charts(analysis, job, _worker_data["chart_dir"])
+    except Exception as error:
+        result["error"] = f"{type(error).__name__}: {error}"
+    return result
+
+
+def save_charts(analysis, job, chart_dir: str):
+    """
+    Saves the price/spread and portfolio charts of a job as PNGs, returns the price chart's path
+    The figures are built once per process and reused, see report.chart_template
+    """
+    from report import chart_template
+
+    name = f"{job['stock1']}_{job['stock2']}_sd{job['num_stdevs']}_cap{job['capital']:g}_size{job['order_size']}_{job['window']}_{job['hedge']}"
+    charts = chart_template()
+    charts.update(analysis, show_thresholds=True, show_means=False, show_signals=True, draw=False)
+    prices_path = os.path.join(chart_dir, f"{name}_prices.png")
+    charts.fig1.savefig(prices_path)
+    charts.fig2.savefig(os.path.join(chart_dir, f"{name}_portfolio.png"))
+    return prices_path
+
+
+def run_jobs(jobs, chart_dir=None, max_workers=None, progress=None):
+    """
+    Runs jobs across a process pool, returns one result dict per job in the same order
+    Jobs on the same pair are sent to workers together so each process reads a pair's files once
+    Parameters:
+        jobs (list): dicts with JOB_FIELDS keys
+        chart_dir (str): folder to save charts in, None for no charts
+        max_workers (int): number of processes, defaults to the number of cores. 1 runs in this process
+        progress (function): called with (fraction, message) as jobs finish
+    """
+    if chart_dir:
+        os.makedirs(chart_dir, exist_ok=True)
+    order = sorted(range(len(jobs)), key=lambda i: (jobs[i]["file1"], jobs[i]["file2"], jobs[i]["stock1"], jobs[i]["stock2"]))
+    grouped = [jobs[i] for i in order]
+    if max_workers is None:
+        max_workers = min(os.cpu_count() or 1, len(jobs))
+
+    if max_workers <= 1:
+        _init_worker(chart_dir)
+        results = collect_results(map(_run_job, grouped), len(grouped), progress)
+    else:
+        chunksize = max(1, len(grouped) // (max_workers * 4)) # consecutive jobs share a pair, keep them in one chunk
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, initargs=(chart_dir,)) as executor:
+            results = collect_results(executor.map(_run_job, grouped, chunksize=chunksize), len(grouped), progress, executor)
+
+    ordered = [None] * len(jobs)
+    for i, result in zip(order, results):
+        ordered[i] = result
+    return ordered
+
+
+def write_results(results, output, output_format: str, fields=RESULT_FIELDS):
+    """
+    Writes results as a JSON list or CSV rows with fields as columns to an open text file
+    """
+    if output_format == "json":
+        # NaN isn't valid JSON, eg the Sharpe ratio of a pair that never traded
+        results = [{key: None if isinstance(value, float) and value != value else value for key, value in result.items()} for result in results]
+        json.dump(results, output, indent=2, default=str)
+        output.write("\n")
+    else:
+        writer = csv.DictWriter(output, fieldnames=fields, extrasaction="ignore", lineterminator="\n")
+        writer.writeheader()
+        writer.writerows(results)
+
+
+def launch_gui():
+    """
+    Starts the desktop app
+    """
+    import runpy
+    runpy.run_path(os.path.join(os.path.dirname(os.path.abspath(__file__)), "Main Application.py"), run_name="__main__")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Backtest pairs from NASDAQ quote files without the GUI")
+    parser.add_argument("--pair", nargs=4, action="append", default=[], metavar=("TICKER1", "FILE1", "TICKER2", "FILE2"),
+                        help="pair to test, can be given more than once")
+    parser.add_argument("--jobs", help="JSON or CSV file of jobs with columns " + ", ".join(JOB_FIELDS) + ", settings left out use the options below")
+    parser.add_argument("--num-stdevs", nargs="+", type=float, default=[1.5], help="SD thresholds to test")
+    parser.add_argument("--capital", nargs="+", type=float, default=[10000], help="starting capitals to test")
+    parser.add_argument("--order-size", nargs="+", type=int, default=[10], help="order sizes to test")
+    parser.add_argument("--window", choices=["full", "rolling", "expanding"], default="full", help="bars used for the spread mean and stdev")
+    parser.add_argument("--lookback", type=int, default=60, help="bars in the rolling window and the rolling OLS hedge")
+    parser.add_argument("--hedge", choices=["equal", "ols", "rolling", "kalman"], default="equal", help="hedge ratio model for the stock2 leg")
+    parser.add_argument("--workers", type=int, default=None, help="number of processes, defaults to the number of cores")
+    parser.add_argument("--format", choices=["json", "csv"], default="json", help="output format")
+    parser.add_argument("--output", help="file to write results to, defaults to stdout")
+    parser.add_argument("--charts", help="folder to save price/spread and portfolio charts in")
+    parser.add_argument("--portfolio", action="store_true",
+                        help="backtest every pair together from one pool of the first --capital, and output each pair's and the whole book's results")
+    parser.add_argument("--equity", help="with --portfolio, CSV file to save each pair's and the whole book's equity by date in")
+    parser.add_argument("--quiet", action="store_true", help="don't report progress on stderr")
+    parser.add_argument("--gui", action="store_true", help="start the desktop app instead")
+    return parser, parser.parse_args(argv)
+
+
+def run_portfolio(parser, args):
+    """
+    Runs --portfolio: the pairs of --pair and --jobs are backtested together with the first of each setting
+    """
+    pairs = [tuple(pair) for pair in args.pair]
+    if args.jobs:
+        pairs += read_pairs(args.jobs, args.order_size[0])
+    if not pairs:
+        parser.error("nothing to test, give --pair or --jobs")
+
+    def report(fraction, message):
+        print(f"\r{message}", end="", file=sys.stderr, flush=True)
+
+    result = backtest_portfolio(pairs, args.num_stdevs[0], args.capital[0], args.order_size[0], args.window, args.lookback, args.hedge,
+                                progress=None if args.quiet else report)
+    if not args.quiet:
+        print(file=sys.stderr)
+
+    table = portfolio_table(result)
+    rows = [{key: None if value is pd.NA else value for key, value in row.items()} for row in table.to_dict("records")]
+    if args.output:
+        with open(args.output, "w", newline="") as output:
+            write_results(rows, output, args.format, list(table.columns))
+    else:
+        write_results(rows, sys.stdout, args.format, list(table.columns))
+    if args.equity:
+        equity_table(result).to_csv(args.equity, index=False)
+    return 0
+
+
+def main(argv=None):
+    parser, args = parse_args(argv)
+    if args.gui:
+        launch_gui()
+        return 0
+
+    if args.portfolio:
+        return run_portfolio(parser, args)
+
+    jobs = expand_jobs(args.pair, args.num_stdevs, args.capital, args.order_size, args.window, args.lookback, args.hedge)
+    if args.jobs:
+        defaults = {"num_stdevs": args.num_stdevs[0], "capital": args.capital[0], "order_size": args.order_size[0],
+                    "window": args.window, "lookback": args.lookback, "hedge": args.hedge}
+        jobs += read_jobs(args.jobs, defaults)
+    if not jobs:
+        parser.error("nothing to test, give --pair or --jobs")
+
+    def report(fraction, message):
+        print(f"\r{message}", end="", file=sys.stderr, flush=True)
+
+    results = run_jobs(jobs, chart_dir=args.charts, max_workers=args.workers, progress=None if args.quiet else report)
+    if not args.quiet:
+        print(file=sys.stderr)
+
+    if args.output:
+        with open(args.output, "w", newline="") as output:
+            write_results(results, output, args.format)
+    else:
+        write_results(results, sys.stdout, args.format)
+    return 1 if any("error" in result for result in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,359 @@
+"""
+Benchmarks each stage of a pair test on synthetic cointegrated pairs, with baselines to catch slow-downs
+
+Examples:
+    python benchmark.py --sizes 2500 100000 --output baseline.json
+    python benchmark.py --sizes 2500 100000 --baseline baseline.json --tolerance 20
+
+Stages are timed on the best of --repeats runs, then run once more under tracemalloc for their peak memory.
+Synthetic quote files are written once per size and seed in --data-dir and reused
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from backtest import compute_spread, window_thresholds, simulate_trades, compute_metrics, z_score
+from cointegration import engle_granger
+from hedge import hedge_ratios
+from ingest import CACHE_DIR, parse_quotes, merge_quotes
+
+BENCHMARK_SIZES = [2_500, 100_000, 1_000_000, 10_000_000] # about 10 years of daily bars up to 70 years of minute bars
+STAGES = ["ingest", "merge", "spread", "cointegration", "simulate", "metrics", "render"]
+DAILY_LIMIT = 20_000 # sizes above this are written as minute bars so the dates stay in range
+
+
+def synthetic_pair(num_bars: int, seed: int = 0, hedge_ratio: float = 1.5, half_life: float = 20.0):
+    """
+    Generates a cointegrated pair: stock2 follows a geometric random walk and stock1 is hedge_ratio * stock2
+    plus a mean reverting AR(1) spread that decays half way in half_life bars. Prices are rounded to cents
+    Returns a df with Date, Price1 and Price2 columns, oldest to newest. Daily bars up to DAILY_LIMIT bars, minute bars above
+    """
+    rng = np.random.default_rng(seed)
+    intraday = num_bars > DAILY_LIMIT
+    bar_volatility = 0.01 / np.sqrt(390) if intraday else 0.01 # 390 minutes in a trading day
+    price2 = 50 * np.exp(np.cumsum(rng.normal(0, bar_volatility, num_bars)))
+
+    # AR(1) spread as a linear filter: spread[t] = decay * spread[t - 1] + noise[t], summed in blocks so the powers of decay stay in range
+    decay = 0.5 ** (1 / half_life)
+    noise = rng.normal(0, 0.5 * np.sqrt(1 - decay ** 2), num_bars) # stationary stdev 0.5
+    spread = np.empty(num_bars)
+    carry = 0.0
+    block = 256
+    for start in range(0, num_bars, block):
+        chunk = noise[start:start + block]
+        powers = decay ** np.arange(len(chunk))
+        spread[start:start + block] = powers * (carry + np.cumsum(chunk / powers))
+        carry = spread[start + len(chunk) - 1] * decay
+    price1 = hedge_ratio * price2 + 10 + spread
+
+    start_date = np.datetime64("2000-01-03T09:30" if intraday else "1990-01-02")
+    dates = start_date + np.arange(num_bars).astype("timedelta64[m]" if intraday else "timedelta64[D]")
+    return pd.DataFrame({"Date": dates, "Price1": np.round(price1, 2), "Price2": np.round(price2, 2)})
+
+
+def _dollar_strings(prices):
+    """
+    Formats prices as NASDAQ "$71.65" strings with numpy string ufuncs, much faster than a python format per value
+    """
+    cents = np.round(np.asarray(prices) * 100).astype(np.int64)
+    dollars = (cents // 100).astype(str)
+    fraction = np.strings.zfill((cents % 100).astype(str), 2)
+    return np.strings.add(np.strings.add(np.strings.add("$", dollars), "."), fraction)
+
+
+def write_quotes(file_path: str, dates, prices, seed: int = 0):
+    """
+    Writes prices as a NASDAQ historical quotes CSV, newest first with "MM/DD/YYYY" dates (or "MM/DD/YYYY HH:MM" for minute bars)
+    Open, High and Low repeat the close, only Date and Close/Last are read
+    """
+    dates = pd.DatetimeIndex(dates)
+    intraday = bool((dates != dates.normalize()).any())
+    date_strings = dates.strftime("%m/%d/%Y %H:%M" if intraday else "%m/%d/%Y")
+    price_strings = _dollar_strings(prices)
+    volume = np.random.default_rng(seed).integers(1_000, 20_000_000, len(dates))
+    df = pd.DataFrame({"Date": date_strings, "Close/Last": price_strings, "Volume": volume,
+                       "Open": price_strings, "High": price_strings, "Low": price_strings})
+    df.iloc[::-1].to_csv(file_path, index=False)
+
+
+def synthetic_files(num_bars: int, data_dir: str, seed: int = 0):
+    """
+    Returns the two quote files of a synthetic pair, writing them the first time
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    file_paths = [os.path.join(data_dir, f"SYN{i} {num_bars} seed{seed} historical quotes.csv") for i in (1, 2)]
+    if not all(os.path.exists(file_path) for file_path in file_paths):
+        df = synthetic_pair(num_bars, seed)
+        for i, file_path in enumerate(file_paths, start=1):
+            temp_file = f"{file_path}.{os.getpid()}.tmp"
+            write_quotes(temp_file, df["Date"], df[f"Price{i}"], seed + i)
+            os.replace(temp_file, file_path) # a cancelled run never leaves a partial file behind
+    return file_paths
+
+
+def _chart_modules():
+    """
+    Imports matplotlib with the Agg backend, done before timing so the render stage doesn't include the import
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from analysis import PairAnalysis
+    from charts import PairCharts
+    return FigureCanvasAgg, PairAnalysis, PairCharts
+
+
+def _render(state):
+    """
+    Hands the results to a fresh PairCharts and draws both figures with the Agg backend
+    """
+    FigureCanvasAgg, PairAnalysis, PairCharts = _chart_modules()
+    df = state["df"].copy(deep=False)
+    result = state["result"]
+    mean_spread, spread_stdev, upper_threshold, lower_threshold = state["thresholds"]
+    df["Spread"] = state["spread"]
+    df["Hedge Ratio"] = state["hedge_ratio"]
+    df["Z-Score"] = z_score(state["spread"], mean_spread, spread_stdev)
+    df["Entries"] = result.entries
+    df["Exits"] = result.exits
+    df["Portfolio Value"] = result.portfolio_value
+    analysis = PairAnalysis(
+        df=df, stock1_name="SYN1", stock2_name="SYN2", stock1_price_col="SYN1 Price", stock2_price_col="SYN2 Price",
+        correlation=np.nan, stock1_mean_price=float(np.mean(state["price1"])), stock2_mean_price=float(np.mean(state["price2"])),
+        mean_spread=mean_spread, upper_threshold=upper_threshold, lower_threshold=lower_threshold,
+        sharpe_ratio=state["metrics"][0], return_pct=state["metrics"][1], num_trades=result.num_trades,
+        final_position=result.final_position, hedge_ratio=state["hedge_ratio"],
+    )
+
+    charts = PairCharts()
+    for fig in [charts.fig1, charts.fig2]:
+        FigureCanvasAgg(fig)
+    charts.update(analysis, show_thresholds=True, show_means=False, show_signals=True)
+    charts.fig1.canvas.draw()
+    charts.fig2.canvas.draw()
+
+
+def _run_stage(stage: str, state: dict, settings: dict):
+    """
+    Runs one stage of the pipeline, reading the earlier stages' outputs from state and adding its own
+    """
+    if stage == "ingest":
+        state["quotes"] = [parse_quotes(file_path) for file_path in state["files"]]
+    elif stage == "merge":
+        state["df"] = merge_quotes(*state["quotes"], "SYN1 Price", "SYN2 Price")
+    elif stage == "spread":
+        state["price1"] = state["df"]["SYN1 Price"].to_numpy()
+        state["price2"] = state["df"]["SYN2 Price"].to_numpy()
+        state["hedge_ratio"] = hedge_ratios(state["price1"], state["price2"], settings["hedge"], settings["lookback"])
+        state["spread"] = compute_spread(state["price1"], state["price2"], state["hedge_ratio"])
+        state["thresholds"] = window_thresholds(state["spread"], settings["num_stdevs"], settings["window"], settings["lookback"])
+    elif stage == "cointegration":
+        state["cointegration"] = engle_granger(state["price1"], state["price2"])[0]
+    elif stage == "simulate":
+        upper_threshold, lower_threshold = state["thresholds"][2:]
+        state["result"] = simulate_trades(state["price1"], state["price2"], upper_threshold, lower_threshold, settings["capital"],
+                                          settings["order_size"], spread=state["spread"], hedge_ratio=state["hedge_ratio"])
+    elif stage == "metrics":
+        state["metrics"] = compute_metrics(state["result"].portfolio_value, settings["capital"])
+    elif stage == "render":
+        _render(state)
+    else:
+        raise ValueError(f"Unknown stage: {stage}")
+
+
+def benchmark_size(num_bars: int, settings: dict, data_dir: str, stages=STAGES, repeats: int = 3, measure_memory: bool = True,
+                   seed: int = 0, progress=None):
+    """
+    Times each stage of a pair test on a synthetic pair of num_bars bars
+    Parameters:
+        settings (dict): num_stdevs, capital, order_size, window, lookback and hedge, same as the single test
+        data_dir (str): folder for the synthetic quote files
+        stages (list): stages to run, in pipeline order. Later stages need the earlier ones
+        repeats (int): runs of the whole pipeline, each stage's fastest run is kept
+        measure_memory (bool): run once more under tracemalloc for each stage's peak memory, slow for the largest sizes
+        progress (function): called with (fraction, message) as runs start
+    Returns a list of dicts with rows, stage, seconds and peak_mb (None when not measured)
+    """
+    files = synthetic_files(num_bars, data_dir, seed)
+    if "render" in stages:
+        _chart_modules()
+    best = {stage: np.inf for stage in stages}
+    peaks = {stage: None for stage in stages}
+    num_runs = repeats + measure_memory
+    for run in range(num_runs):
+        if progress:
+            progress(run / num_runs, f"{num_bars:,} bars: run {run + 1} of {num_runs}")
+        traced = run == repeats
+        state = {"files": files}
+        if traced:
+            tracemalloc.start()
+        try:
+            for stage in stages:
+                if traced:
+                    tracemalloc.reset_peak()
+                    before = tracemalloc.get_traced_memory()[0]
+                    _run_stage(stage, state, settings)
+                    peaks[stage] = (tracemalloc.get_traced_memory()[1] - before) / 1024 ** 2
+                else:
+                    start = time.perf_counter()
+                    _run_stage(stage, state, settings)
+                    best[stage] = min(best[stage], time.perf_counter() - start)
+        finally:
+            if traced:
+                tracemalloc.stop()
+
+    return [{"rows": num_bars, "stage": stage, "seconds": best[stage] if repeats else None, "peak_mb": peaks[stage]} for stage in stages]
+
+
+def environment():
+    """
+    Machine and library versions, saved with results since timings only compare on the same setup
+    """
+    import matplotlib
+    return {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "system": platform.platform(),
+        "cpus": os.cpu_count(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "matplotlib": matplotlib.__version__,
+    }
+
+
+def run_mismatches(baseline: dict, run: dict):
+    """
+    Compares the run settings saved with a baseline to this run's, see main.
+    Different trade settings or seed time different work so the stages can't be compared, different sizes, stages or
+    repeats only change which rows are compared and how noisy they are
+    Returns (errors, warnings) as lists of messages
+    """
+    errors, warnings = [], []
+    for key in ["settings", "seed"]:
+        if key not in baseline:
+            warnings.append(f"baseline doesn't record its {key}, make sure it matches this run")
+        elif key == "settings":
+            errors += [f"{name} is {baseline[key].get(name)} in the baseline and {value} in this run"
+                       for name, value in run[key].items() if baseline[key].get(name) != value]
+        elif baseline[key] != run[key]:
+            errors.append(f"{key} is {baseline[key]} in the baseline and {run[key]} in this run")
+
+    for key in ["sizes", "stages"]:
+        missing = [value for value in run[key] if value not in baseline.get(key, run[key])]
+        if missing:
+            warnings.append(f"{key} {', '.join(str(value) for value in missing)} aren't in the baseline and aren't compared")
+    if baseline.get("repeats", run["repeats"]) != run["repeats"]:
+        warnings.append(f"repeats is {baseline['repeats']} in the baseline and {run['repeats']} in this run, best times of fewer runs are slower")
+    return errors, warnings
+
+
+def compare_results(baseline: dict, results, tolerance_pct: float, min_seconds: float = 0.005):
+    """
+    Finds stages that got more than tolerance_pct slower than the baseline. Differences under min_seconds are timer noise and ignored
+    Returns a list of dicts with rows, stage, baseline_seconds, seconds and change_pct
+    """
+    baseline_seconds = {(row["rows"], row["stage"]): row["seconds"] for row in baseline["results"]}
+    regressions = []
+    for row in results:
+        before = baseline_seconds.get((row["rows"], row["stage"]))
+        if before is None or row["seconds"] is None:
+            continue
+        if row["seconds"] > before * (1 + tolerance_pct / 100) and row["seconds"] - before > min_seconds:
+            regressions.append({"rows": row["rows"], "stage": row["stage"], "baseline_seconds": before, "seconds": row["seconds"],
+                                "change_pct": (row["seconds"] / before - 1) * 100})
+    return regressions
+
+
+def format_table(results, baseline=None):
+    """
+    Formats results as a text table, with the change from the baseline when there is one
+    """
+    baseline_seconds = {(row["rows"], row["stage"]): row["seconds"] for row in baseline["results"]} if baseline else {}
+    lines = [f"{'Rows':>12} {'Stage':<14} {'Seconds':>10} {'Peak MB':>10} {'Change':>9}"]
+    for row in results:
+        seconds = "" if row["seconds"] is None else f"{row['seconds']:.4f}"
+        peak_mb = "" if row["peak_mb"] is None else f"{row['peak_mb']:.1f}"
+        before = baseline_seconds.get((row["rows"], row["stage"]))
+        change = f"{(row['seconds'] / before - 1) * 100:+.1f}%" if before and row["seconds"] is not None else ""
+        lines.append(f"{row['rows']:>12,} {row['stage']:<14} {seconds:>10} {peak_mb:>10} {change:>9}")
+    return "\n".join(lines)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark each stage of a pair test on synthetic cointegrated pairs")
+    parser.add_argument("--sizes", nargs="+", type=int, default=BENCHMARK_SIZES, help="bars in each synthetic pair")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES, help="stages to run, later stages need the earlier ones")
+    parser.add_argument("--repeats", type=int, default=3, help="timed runs per size, the fastest is kept")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc run that measures peak memory")
+    parser.add_argument("--seed", type=int, default=0, help="random seed of the synthetic pairs")
+    parser.add_argument("--data-dir", default=os.path.join(CACHE_DIR, "benchmark"), help="folder for the synthetic quote files")
+    parser.add_argument("--num-stdevs", type=float, default=1.5, help="SD threshold")
+    parser.add_argument("--capital", type=float, default=10000, help="starting capital")
+    parser.add_argument("--order-size", type=int, default=10, help="order size")
+    parser.add_argument("--window", choices=["full", "rolling", "expanding"], default="full", help="bars used for the spread mean and stdev")
+    parser.add_argument("--lookback", type=int, default=60, help="bars in the rolling window and the rolling OLS hedge")
+    parser.add_argument("--hedge", choices=["equal", "ols", "rolling", "kalman"], default="equal", help="hedge ratio model for the stock2 leg")
+    parser.add_argument("--output", help="JSON file to save the results in, use it as a later --baseline")
+    parser.add_argument("--baseline", help="JSON results to compare against, exits with 1 if a stage got slower than --tolerance. "
+                                           "Refuses to run if it was saved with different trade settings or seed")
+    parser.add_argument("--tolerance", type=float, default=20, help="percent a stage may slow down before it counts as a regression")
+    parser.add_argument("--quiet", action="store_true", help="don't report progress on stderr")
+    return parser, parser.parse_args(argv)
+
+
+def main(argv=None):
+    parser, args = parse_args(argv)
+    stages = [stage for stage in STAGES if stage in args.stages] # pipeline order
+    settings = {"num_stdevs": args.num_stdevs, "capital": args.capital, "order_size": args.order_size,
+                "window": args.window, "lookback": args.lookback, "hedge": args.hedge}
+    run = {"settings": settings, "seed": args.seed, "sizes": args.sizes, "stages": stages, "repeats": args.repeats}
+
+    # Checked before running so a mismatched baseline fails fast
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        errors, warnings = run_mismatches(baseline, run)
+        if errors:
+            parser.error(f"{args.baseline} was run with different settings: {'; '.join(errors)}")
+        for warning in warnings:
+            print(f"Warning: {warning}", file=sys.stderr)
+
+    def report(fraction, message):
+        print(f"\r{message}", end="", file=sys.stderr, flush=True)
+
+    results = []
+    for num_bars in args.sizes:
+        results += benchmark_size(num_bars, settings, args.data_dir, stages, args.repeats, not args.no_memory, args.seed,
+                                  progress=None if args.quiet else report)
+    if not args.quiet:
+        print(file=sys.stderr)
+
+    print(format_table(results, baseline))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"environment": environment(), **run, "results": results}, f, indent=2)
+            f.write("\n")
+
+    if baseline:
+        regressions = compare_results(baseline, results, args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression['stage']} on {regression['rows']:,} rows took {regression['seconds']:.4f}s, "
+                  f"{regression['change_pct']:+.1f}% from {regression['baseline_seconds']:.4f}s", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
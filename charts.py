@@ -0,0 +1,425 @@
+import numpy as np
+import matplotlib.pyplot as plt
+import matplotlib.dates as mdates
+from matplotlib.figure import Figure
+
+from instrument import span
+
+MAX_POINTS = 1400 # points drawn per line, about two per horizontal pixel of a 7 inch figure
+
+
+def apply_plot_style():
+    """
+    Update rcParams to set all text colours to white
+    """
+    plt.rcParams.update({
+        "figure.facecolor": "#190831",
+        "axes.facecolor": "#190831",
+        "legend.facecolor": "#190831",
+        "text.color": "white",
+        "axes.labelcolor": "white",
+        "xtick.color": "white",
+        "ytick.color": "white",
+        "axes.titlecolor": "white",
+        "legend.edgecolor": "white",
+        "font.size": 8
+    })
+
+
+def lttb(x, y, max_points: int):
+    """
+    Largest-Triangle-Three-Buckets downsampling. Returns the indices of at most max_points points that keep the visual shape of the line
+    The first and last points are always kept, every bucket in between keeps the point forming the largest triangle
+    with the previously kept point and the average of the next bucket
+    """
+    n = len(x)
+    if max_points >= n or max_points < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    edges = np.linspace(1, n - 1, max_points - 1).astype(np.int64) # max_points - 2 buckets between the first and last point
+    next_ends = np.append(edges[2:], n)
+
+    # Average of the bucket after each bucket, found for every bucket at once so the loop below only picks points
+    valid = ~np.isnan(y)
+    has_gaps = not valid.all()
+    next_counts = np.add.reduceat(valid, edges[1:])
+    next_x = np.add.reduceat(x, edges[1:]) / (next_ends - edges[1:])
+    with np.errstate(invalid="ignore", divide="ignore"):
+        next_y = np.add.reduceat(np.where(valid, y, 0.0), edges[1:]) / next_counts
+
+    selected = np.empty(max_points, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    previous = 0
+    for i in range(max_points - 2):
+        start, end = edges[i], edges[i + 1]
+        x_previous, y_previous = x[previous], y[previous]
+        bucket_next_y = next_y[i] if next_counts[i] else y_previous
+
+        area = np.abs((x_previous - next_x[i]) * (y[start:end] - y_previous) - (x_previous - x[start:end]) * (bucket_next_y - y_previous))
+        if has_gaps:
+            area = np.where(np.isnan(area), -1.0, area)
+        previous = start + int(np.argmax(area))
+        selected[i + 1] = previous
+    return selected
+
+
+def portfolio_figure(result, max_legend: int = 12):
+    """
+    Draws the whole book's value over a portfolio test's equity curve of each pair, see portfolio.backtest_portfolio
+    Pairs are only named in the legend when there are at most max_legend of them
+    """
+    apply_plot_style()
+    fig = Figure(figsize=(7, 6.5))
+    ax_total, ax_pairs = fig.subplots(2, 1, sharex=True)
+    dates = mdates.date2num(result.dates)
+
+    ax_total.plot(dates, result.portfolio_value, label="Portfolio Value")
+    ax_total.set_ylabel("Value (USD)")
+    ax_total.set_title(f"Portfolio of {len(result.pair_names)} Pairs")
+    ax_total.legend()
+    ax_total.grid()
+
+    for name, equity in zip(result.pair_names, result.equity.T):
+        ax_pairs.plot(dates, equity, linewidth=1, label=name)
+    ax_pairs.set_xlabel("Date")
+    ax_pairs.set_ylabel("Pair Equity (USD)")
+    ax_pairs.set_title("Equity of Each Pair")
+    if len(result.pair_names) <= max_legend:
+        ax_pairs.legend(fontsize=6, ncol=2)
+    ax_pairs.grid()
+
+    ax_pairs.xaxis_date()
+    fig.autofmt_xdate()
+    fig.tight_layout()
+    return fig
+
+
+class PairCharts:
+    """
+    The price/spread and portfolio figures. They are created once and their artists are updated in place for each test,
+    long series are downsampled to the visible range whenever the view changes
+    """
+    def __init__(self, max_points: int = MAX_POINTS):
+        apply_plot_style()
+        self.max_points = max_points
+        self.full_data = {} # line -> (x, y) at full resolution
+        self.buffers = {} # line -> (x, y) arrays with spare room for live bars, full_data holds the filled part
+        self.canvases = []
+        self.widgets = [] # (widget, grid options) shown/hidden together
+        self.visible = False
+        self.appending = False # set while live bars are added, so moving the view doesn't resample everything
+
+        # Graph historical prices and spread
+        self.fig1 = Figure(figsize=(7, 4))
+        self.ax1 = self.fig1.add_subplot()
+        self.price1_line, = self.ax1.plot([], [], linestyle = "-", color="darkorange", marker=None)
+        self.price2_line, = self.ax1.plot([], [], linestyle = "--", color="dodgerblue", marker=None)
+        self.spread_line, = self.ax1.plot([], [], linestyle = "-", label="Spread", color="violet", marker=None)
+
+        self.threshold_lines = [self.ax1.plot([], [], color = 'm', linestyle = '-')[0] for _ in range(3)] # mean, + num_stdev, - num_stdev spread, can vary over time
+        self.mean_lines = [
+            self.ax1.axhline(y = 0, color = 'darkorange', linestyle = '-'), # mean price stock1
+            self.ax1.axhline(y = 0, color = 'dodgerblue', linestyle = '-'), # mean price stock2
+        ]
+        self.entries_scatter = self.ax1.scatter([], [], color="green", label="Entry Signal", marker="^", s=100)
+        self.exits_scatter = self.ax1.scatter([], [], color="red", label="Exit Signal", marker="v", s=100)
+
+        self.ax1.set_xlabel("Date")
+        self.ax1.set_ylabel("Stock Price (USD)")
+        self.ax1.grid()
+
+        # Graph portfolio value over time
+        self.fig2 = Figure(figsize=(7, 4))
+        self.ax2 = self.fig2.add_subplot()
+        self.portfolio_line, = self.ax2.plot([], [], linestyle = "-", label="Portfolio Value", marker=None)
+        self.walk_forward_line, = self.ax2.plot([], [], linestyle = "-", label="Out-of-Sample Value", color="limegreen", marker=None, visible=False)
+        self.ax2.set_xlabel("Date")
+        self.ax2.set_ylabel("Value (USD)")
+        self.ax2.set_title("Portfolio Value Over Time")
+        self.ax2.legend(handles=[self.portfolio_line])
+        self.ax2.grid()
+        self.significance_ax = None # significance histogram under the portfolio graph, created the first time it's shown
+        self.portfolio_position = None # where ax2 sits without the histogram
+
+        for fig, ax in [(self.fig1, self.ax1), (self.fig2, self.ax2)]:
+            ax.xaxis_date()
+            ax.xaxis.set_major_locator(mdates.YearLocator()) # Automatically sets yearly
+            fig.autofmt_xdate()
+            ax.callbacks.connect("xlim_changed", self.resample) # zooming or panning re-downsamples the visible range
+
+    def attach(self, master):
+        """
+        Embeds both figures and their toolbars in a Tk frame, done once
+        """
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
+        import ttkbootstrap as ttk
+
+        for row, fig in [(0, self.fig1), (2, self.fig2)]:
+            canvas = FigureCanvasTkAgg(fig, master=master)
+            self.canvases.append(canvas)
+            self.widgets.append((canvas.get_tk_widget(), {"row": row, "column": 0, "padx": 5, "pady": 5}))
+
+            toolbar_frame = ttk.Frame(master)
+            toolbar = NavigationToolbar2Tk(canvas, toolbar_frame, pack_toolbar=False)
+            toolbar.update()
+            toolbar.pack(side="right", fill="y", expand=True)
+            self.widgets.append((toolbar_frame, {"row": row + 1, "column": 0}))
+
+    def show(self):
+        for widget, grid_options in self.widgets:
+            widget.grid(**grid_options)
+        self.visible = True
+
+    def hide(self):
+        for widget, grid_options in self.widgets:
+            widget.grid_remove() # keeps the widget so it can be shown again without rebuilding
+        self.visible = False
+
+    def update(self, analysis, show_thresholds: bool, show_means: bool, show_signals: bool, draw: bool = True):
+        """
+        Replaces the plotted data with the results of a new test
+        """
+        with span("update charts"):
+            self._set_data(analysis, show_thresholds, show_means, show_signals)
+        if draw:
+            self.draw()
+
+    def _set_data(self, analysis, show_thresholds: bool, show_means: bool, show_signals: bool):
+        """
+        Sets every artist's data, limits and overlays from a test without drawing
+        """
+        df = analysis.df
+        dates = mdates.date2num(df["Date"].to_numpy())
+
+        self.price1_line.set_label(analysis.stock1_price_col)
+        self.price2_line.set_label(analysis.stock2_price_col)
+        self.ax1.set_title(f"Historical Prices of {analysis.stock1_name} & {analysis.stock2_name}")
+
+        series = [
+            (self.price1_line, df[analysis.stock1_price_col]),
+            (self.price2_line, df[analysis.stock2_price_col]),
+            (self.spread_line, df["Spread"]),
+            (self.portfolio_line, df["Portfolio Value"]),
+        ]
+        for line, threshold in zip(self.threshold_lines, [analysis.mean_spread, analysis.upper_threshold, analysis.lower_threshold]):
+            series.append((line, np.broadcast_to(np.asarray(threshold, dtype=float), dates.shape))) # full history thresholds are one value
+
+        self.buffers = {}
+        for line, values in series:
+            values = np.asarray(values, dtype=float)
+            self.full_data[line] = (dates, values)
+            line.set_data(dates, values) # full data so autoscaling sees every point
+        for line, y in zip(self.mean_lines, [analysis.stock1_mean_price, analysis.stock2_mean_price]):
+            line.set_ydata([y, y])
+
+        for scatter, col in [(self.entries_scatter, "Entries"), (self.exits_scatter, "Exits")]:
+            signals = df[col].to_numpy(dtype=float)
+            signalled = ~np.isnan(signals)
+            scatter.set_offsets(np.column_stack([dates[signalled], signals[signalled]]))
+
+        self.set_overlays(show_thresholds, show_means, show_signals, draw=False)
+        self.set_walk_forward(draw=False) # a new test replaces any walk-forward results
+        self.set_significance(draw=False) # and any significance test
+        for ax in [self.ax1, self.ax2]:
+            ax.relim(visible_only=True)
+            ax.autoscale_view()
+            self.resample(ax)
+
+    def set_walk_forward(self, dates=None, portfolio_value=None, draw: bool = True):
+        """
+        Shows the stitched out-of-sample portfolio value of a walk-forward test next to the in-sample one, or hides it if not given
+        """
+        self.full_data.pop(self.walk_forward_line, None)
+        self.walk_forward_line.set_visible(portfolio_value is not None)
+        handles = [self.portfolio_line]
+        if portfolio_value is not None:
+            dates = mdates.date2num(np.asarray(dates))
+            self.full_data[self.walk_forward_line] = (dates, np.asarray(portfolio_value, dtype=float))
+            self.walk_forward_line.set_data(*self.full_data[self.walk_forward_line])
+            handles.append(self.walk_forward_line)
+        self.ax2.legend(handles=handles)
+
+        if draw:
+            self.ax2.relim(visible_only=True)
+            self.ax2.autoscale_view()
+            self.resample(self.ax2)
+            self.draw()
+
+    def set_significance(self, result=None, draw: bool = True):
+        """
+        Shows a histogram of the Sharpe ratios of a significance test's random paths under the portfolio graph,
+        marking the tested strategy's Sharpe ratio, confidence interval and p-values, or hides it if not given
+        """
+        if self.significance_ax is None:
+            if result is None:
+                return
+            self.portfolio_position = self.ax2.get_position()
+            self.significance_ax = self.fig2.add_axes(self.portfolio_position)
+
+        ax = self.significance_ax
+        ax.clear()
+        ax.set_visible(result is not None)
+        self.ax2.xaxis.label.set_visible(result is None) # the dates are clear enough without the label, and it makes room
+        if result is None:
+            self.ax2.set_position(self.portfolio_position)
+        else:
+            x0, y0, width, height = self.portfolio_position.bounds
+            self.ax2.set_position([x0, y0 + 0.5 * height, width, 0.5 * height])
+            ax.set_position([x0, y0, width, 0.3 * height])
+            null_sharpe = result.null_sharpe[~np.isnan(result.null_sharpe)] # paths that never traded have no Sharpe ratio
+            label = f"Random Paths ({result.method}, {result.block_size} bar blocks)"
+            if result.untraded_paths:
+                label += f", {result.untraded_paths} without trades left out"
+            ax.hist(null_sharpe, bins=50, color="slategray", label=label)
+            ax.axvspan(*result.sharpe_interval, color="limegreen", alpha=0.2, label=f"{result.confidence:.0%} Interval")
+            ax.axvline(result.sharpe_ratio, color="limegreen",
+                       label=f"Strategy: p = {result.sharpe_p_value:.3f}, return p = {result.return_p_value:.3f}")
+            ax.set_xlabel("Sharpe Ratio")
+            ax.set_ylabel("Paths")
+            ax.legend(fontsize=6)
+            ax.grid()
+
+        if draw:
+            self.draw()
+
+    def append(self, bars):
+        """
+        Adds live bars (stream.LiveBar) to the end of the plotted data without redrawing the history.
+        If the view reaches the last bar it scrolls to keep following new bars
+        """
+        dates = mdates.date2num([bar.timestamp for bar in bars])
+        following = {ax: ax.get_xlim()[1] >= self.full_data[self.portfolio_line][0][-1] for ax in [self.ax1, self.ax2]}
+        previous_end = self.full_data[self.portfolio_line][0][-1]
+
+        columns = [
+            (self.price1_line, [bar.price1 for bar in bars]),
+            (self.price2_line, [bar.price2 for bar in bars]),
+            (self.spread_line, [bar.spread for bar in bars]),
+            (self.threshold_lines[0], [bar.mean_spread for bar in bars]),
+            (self.threshold_lines[1], [bar.upper_threshold for bar in bars]),
+            (self.threshold_lines[2], [bar.lower_threshold for bar in bars]),
+            (self.portfolio_line, [bar.portfolio_value for bar in bars]),
+        ]
+        for line, values in columns:
+            self._extend(line, dates, np.array(values, dtype=float))
+
+        for scatter, values in [(self.entries_scatter, [bar.entry for bar in bars]), (self.exits_scatter, [bar.exit for bar in bars])]:
+            values = np.array(values, dtype=float)
+            signalled = ~np.isnan(values)
+            if signalled.any():
+                scatter.set_offsets(np.concatenate([scatter.get_offsets(), np.column_stack([dates[signalled], values[signalled]])]))
+
+        for ax in [self.ax1, self.ax2]:
+            self._fit_new_values(ax, dates)
+            x_min, x_max = ax.get_xlim()
+            if following[ax]:
+                self.appending = True
+                ax.set_xlim(x_min + dates[-1] - previous_end, x_max + dates[-1] - previous_end)
+                self.appending = False
+            self._append_drawn(ax, len(dates))
+        self.draw()
+
+    def _append_drawn(self, ax, num_new: int):
+        """
+        Adds the newest points to the downsampled lines on ax, only downsampling again once they hold twice max_points
+        """
+        x_min, x_max = ax.get_xlim()
+        for line, (x, y) in self.full_data.items():
+            if line.axes is not ax or line not in self.buffers: # only lines that live bars were added to
+                continue
+            x_drawn = np.asarray(line.get_xdata(), dtype=float)
+            y_drawn = np.asarray(line.get_ydata(), dtype=float)
+            kept = x_drawn >= x_min # drop points that scrolled out of view
+            x_new, y_new = x[-num_new:], y[-num_new:]
+            in_view = (x_new >= x_min) & (x_new <= x_max)
+            x_drawn = np.concatenate([x_drawn[kept], x_new[in_view]])
+            y_drawn = np.concatenate([y_drawn[kept], y_new[in_view]])
+            line.set_data(x_drawn, y_drawn)
+            if len(x_drawn) > 2 * self.max_points:
+                self.resample(ax)
+                return
+
+    def _extend(self, line, x_new, y_new):
+        """
+        Appends to a line's full resolution data, growing its buffers by doubling so appends are amortised O(1) per bar
+        """
+        x, y = self.full_data[line]
+        length = len(x)
+        x_buffer, y_buffer = self.buffers.get(line, (x, y))
+        if x_buffer is not x.base or length + len(x_new) > len(x_buffer):
+            capacity = max(2 * (length + len(x_new)), 1024)
+            x_buffer, y_buffer = np.empty(capacity), np.empty(capacity)
+            x_buffer[:length], y_buffer[:length] = x, y
+            self.buffers[line] = (x_buffer, y_buffer)
+        x_buffer[length:length + len(x_new)] = x_new
+        y_buffer[length:length + len(y_new)] = y_new
+        self.full_data[line] = (x_buffer[:length + len(x_new)], y_buffer[:length + len(y_new)])
+
+    def _fit_new_values(self, ax, dates):
+        """
+        Widens the y axis if new values on ax fall outside it
+        """
+        new_values = [self.full_data[line][1][-len(dates):] for line in self.buffers if line.axes is ax and line.get_visible()]
+        new_values = np.concatenate(new_values)
+        new_values = new_values[~np.isnan(new_values)]
+        if not len(new_values):
+            return
+        y_min, y_max = ax.get_ylim()
+        low, high = min(y_min, new_values.min()), max(y_max, new_values.max())
+        if (low, high) != (y_min, y_max):
+            margin = (high - low) * 0.05
+            ax.set_ylim(low - margin if low < y_min else y_min, high + margin if high > y_max else y_max)
+
+    def set_overlays(self, show_thresholds: bool, show_means: bool, show_signals: bool, draw: bool = True):
+        """
+        Shows or hides the optional overlays without touching the plotted data
+        """
+        for line in self.threshold_lines:
+            line.set_visible(show_thresholds)
+        for line in self.mean_lines:
+            line.set_visible(show_means)
+        self.entries_scatter.set_visible(show_signals)
+        self.exits_scatter.set_visible(show_signals)
+
+        handles = [self.price1_line, self.price2_line, self.spread_line]
+        if show_signals:
+            handles += [self.entries_scatter, self.exits_scatter]
+        self.ax1.legend(handles=handles)
+
+        if draw:
+            self.draw()
+
+    def resample(self, ax):
+        """
+        Downsamples each line on ax to max_points over the visible x range
+        """
+        if self.appending:
+            return
+        x_min, x_max = ax.get_xlim()
+        for line, (x, y) in self.full_data.items():
+            if line.axes is not ax:
+                continue
+            start = max(np.searchsorted(x, x_min) - 1, 0)
+            end = min(np.searchsorted(x, x_max) + 1, len(x))
+            x_visible, y_visible = x[start:end], y[start:end]
+            kept = lttb(x_visible, y_visible, self.max_points)
+            line.set_data(x_visible[kept], y_visible[kept])
+
+    def draw(self):
+        """
+        Schedules a redraw of both figures
+        """
+        self.fig1.canvas.draw_idle()
+        self.fig2.canvas.draw_idle()
+
+    def render(self):
+        """
+        Draws both figures straight away instead of when Tk is next idle, so the drawing time is measured
+        """
+        with span("draw price chart"):
+            self.fig1.canvas.draw()
+        with span("draw portfolio chart"):
+            self.fig2.canvas.draw()
@@ -0,0 +1,305 @@
+import hashlib
+import math
+import os
+import sqlite3
+from dataclasses import dataclass, astuple, fields
+
+import numpy as np
+import pandas as pd
+
+from ingest import CACHE_DIR
+
+# MacKinnon (1994) approximate p-value surface for the Engle-Granger test of 2 series with a constant, the same values as statsmodels' coint
+TAU_MAX = 0.92 # statistics above this have a p-value of 1
+TAU_MIN = -18.86 # statistics below this have a p-value of 0
+TAU_STAR = -2.62 # below this the small p-value polynomial is used
+TAU_SMALL_P = np.array([2.92, 1.5012, 0.039796]) # polynomial coefficients, lowest power first
+TAU_LARGE_P = np.array([2.1945, 0.64695, -0.29198, -0.042377])
+
+# Cap on the default lag search, the ADF regressions cost bars x lags^2. Schwert's rule only asks for more above ~12k bars
+MAX_LAGS = 40
+
+STORE_PATH = os.path.join(CACHE_DIR, "cointegration.sqlite")
+
+_normal_cdf = np.vectorize(lambda value: 0.5 * math.erfc(-value / math.sqrt(2)), otypes=[float])
+
+
+@dataclass
+class CointegrationResult:
+    """
+    Engle-Granger cointegration test of one pair
+    """
+    adf_stat: float # ADF t statistic of the residuals, more negative is more likely cointegrated
+    p_value: float # MacKinnon approximate p-value, small values reject "not cointegrated"
+    hedge_ratio: float # slope of the cointegrating regression of price1 on price2
+    half_life: float # bars the residual takes to revert half way to its mean, inf if it doesn't revert
+    lags: int # lagged differences in the ADF regression, picked by AIC
+    num_obs: int # bars in the test
+
+
+def mackinnon_p_value(adf_stat):
+    """
+    Approximate p-value of Engle-Granger ADF statistics (2 series, constant), elementwise
+    """
+    adf_stat = np.asarray(adf_stat, dtype=float)
+    small = np.polynomial.polynomial.polyval(adf_stat, TAU_SMALL_P)
+    large = np.polynomial.polynomial.polyval(adf_stat, TAU_LARGE_P)
+    p_value = _normal_cdf(np.where(adf_stat <= TAU_STAR, small, large))
+    return np.where(adf_stat > TAU_MAX, 1.0, np.where(adf_stat < TAU_MIN, 0.0, p_value))
+
+
+def default_max_lag(num_obs: int):
+    """
+    Most lagged differences tried in the ADF regression, Schwert's rule as used by statsmodels, capped at MAX_LAGS
+    """
+    return max(min(num_obs // 2 - 1, int(math.ceil(12 * (num_obs / 100) ** 0.25)), MAX_LAGS), 0)
+
+
+def spread_half_life(spread):
+    """
+    Estimates how many bars the spread takes to revert half way to its mean,
+    from the AR(1) regression change = a + b * previous spread. Returns inf if the spread doesn't revert
+    Works along axis 0 so many spreads can be passed as columns, NaN values aren't allowed
+    """
+    spread = np.asarray(spread, dtype=float)
+    previous = spread[:-1]
+    change = np.diff(spread, axis=0)
+    previous_centered = previous - previous.mean(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        slope = (previous_centered * (change - change.mean(axis=0))).sum(axis=0) / (previous_centered ** 2).sum(axis=0)
+        return np.where(slope < 0, -np.log(2) / slope, np.inf)
+
+
+def _lag_design(residuals, change, start: int, stop: int, lags: int):
+    """
+    Rows start to stop of the ADF regression on residual columns (bars x pairs): the change in residual
+    on the previous level and the last lags changes. Returns (design, target) shaped (pairs, lags + 1, rows) and (pairs, rows),
+    regressors along the middle axis so each is written as one contiguous row
+    """
+    design = np.empty((residuals.shape[1], lags + 1, stop - start))
+    design[:, 0] = residuals[start:stop].T
+    for lag in range(1, lags + 1):
+        design[:, lag] = change[start - lag:stop - lag].T
+    return design, change[start:stop].T
+
+
+def _normal_equations(residuals, change, start: int, stop: int, lags: int, max_rows: int):
+    """
+    Sums of the ADF regression's normal equations (gram, moments, target squares) over rows start to stop,
+    built max_rows rows at a time so the design matrix never has to fit in memory at once
+    """
+    num_pairs = residuals.shape[1]
+    gram = np.zeros((num_pairs, lags + 1, lags + 1))
+    moments = np.zeros((num_pairs, lags + 1))
+    target_squares = np.zeros(num_pairs)
+    for chunk_start in range(start, stop, max_rows):
+        design, target = _lag_design(residuals, change, chunk_start, min(chunk_start + max_rows, stop), lags)
+        gram += design @ design.transpose(0, 2, 1)
+        moments += (design @ target[..., None])[..., 0]
+        target_squares += np.einsum("pr,pr->p", target, target)
+    return gram, moments, target_squares
+
+
+def _adf_stats(residuals, max_lag: int, max_rows: int):
+    """
+    ADF t statistics of residual columns (bars x pairs) without a constant, with the number of lags picked per column by AIC
+    on a common sample, then re-estimated on every bar that lag allows, the same as statsmodels' adfuller(autolag="aic").
+    Every column's regressions are solved together from batched normal equations, each lag's equations are the leading
+    block of the largest one's, and the longer re-estimation sample only adds the first few rows
+    Returns (adf_stat, lags) arrays
+    """
+    change = np.diff(residuals, axis=0)
+    num_rows = len(change) - max_lag
+    gram, moments, target_squares = _normal_equations(residuals, change, max_lag, len(change), max_lag, max_rows)
+
+    aic = np.empty((max_lag + 1, residuals.shape[1]))
+    for lags in range(max_lag + 1):
+        size = lags + 1
+        coefficients = np.linalg.solve(gram[:, :size, :size], moments[:, :size, None])[..., 0]
+        residual_squares = np.maximum(target_squares - (coefficients * moments[:, :size]).sum(axis=1), 1e-300)
+        aic[lags] = num_rows * np.log(residual_squares / num_rows) + 2 * size
+    best_lags = np.argmin(aic, axis=0) # ties go to fewer lags
+
+    adf_stat = np.empty(residuals.shape[1])
+    for lags in np.unique(best_lags):
+        columns = best_lags == lags
+        size = lags + 1
+        extra_gram, extra_moments, extra_squares = _normal_equations(residuals[:, columns], change[:, columns], lags, max_lag, lags, max_rows)
+        lag_gram = gram[columns, :size, :size] + extra_gram
+        lag_moments = moments[columns, :size] + extra_moments
+        gram_inverse = np.linalg.inv(lag_gram)
+        coefficients = (gram_inverse @ lag_moments[..., None])[..., 0]
+        residual_squares = np.maximum(target_squares[columns] + extra_squares - (coefficients * lag_moments).sum(axis=1), 1e-300)
+        variance = residual_squares / (len(change) - lags - size)
+        adf_stat[columns] = coefficients[:, 0] / np.sqrt(variance * gram_inverse[:, 0, 0])
+    return adf_stat, best_lags
+
+
+def engle_granger(price1, price2, max_lag=None, batch_size: int = 64, max_memory_mb: float = 64):
+    """
+    Engle-Granger cointegration test of many pairs at once: price1 is regressed on price2 with a constant,
+    then the residuals get an ADF test. Columns are independent pairs and every step is batched linear algebra across them
+    Parameters:
+        price1, price2 (array): bars x pairs prices (or 1-D for one pair), oldest to newest, without NaN
+        max_lag (int): most lagged differences tried in the ADF regression, defaults to default_max_lag
+        batch_size (int): pairs solved together
+        max_memory_mb (float): rough limit on the memory of each slice of the ADF design matrices
+    Returns a list of CointegrationResult, one per pair
+    """
+    price1 = np.asarray(price1, dtype=float)
+    price2 = np.asarray(price2, dtype=float)
+    if price1.ndim == 1:
+        price1, price2 = price1[:, None], price2[:, None]
+    num_obs = len(price1)
+    if num_obs < 4:
+        raise ValueError(f"Cointegration test needs at least 4 bars, there are {num_obs}")
+    max_lag = default_max_lag(num_obs) if max_lag is None else max(min(max_lag, num_obs // 2 - 1), 0)
+
+    # Cointegrating regression, centred so the sums are well conditioned
+    centered1 = price1 - price1.mean(axis=0)
+    centered2 = price2 - price2.mean(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        hedge_ratio = (centered1 * centered2).sum(axis=0) / (centered2 ** 2).sum(axis=0)
+    residuals = centered1 - hedge_ratio * centered2
+    residual_squares = (residuals ** 2).sum(axis=0)
+    perfect_fit = residual_squares <= 1e-14 * (centered1 ** 2).sum(axis=0) # a residual of zero can't have a unit root
+
+    adf_stat = np.full(price1.shape[1], -np.inf)
+    lags = np.zeros(price1.shape[1], dtype=int)
+    testable = np.flatnonzero(~perfect_fit)
+    max_rows = max(int(max_memory_mb * 1024 ** 2 / (8 * (max_lag + 1) * min(batch_size, max(len(testable), 1)))), 1)
+    for start in range(0, len(testable), batch_size):
+        columns = testable[start:start + batch_size]
+        adf_stat[columns], lags[columns] = _adf_stats(residuals[:, columns], max_lag, max_rows)
+
+    p_value = mackinnon_p_value(adf_stat)
+    half_life = spread_half_life(residuals)
+    return [CointegrationResult(float(adf_stat[i]), float(p_value[i]), float(hedge_ratio[i]), float(half_life[i]), int(lags[i]), num_obs)
+            for i in range(price1.shape[1])]
+
+
+def pair_fingerprint(dates, price1, price2, max_lag=None):
+    """
+    Hash of a pair's shared dates, prices and test settings, changes whenever the data the test runs on does
+    """
+    digest = hashlib.sha1(np.ascontiguousarray(np.asarray(dates).astype("datetime64[ns]").view(np.int64)).tobytes())
+    digest.update(np.ascontiguousarray(np.asarray(price1, dtype=float)).tobytes())
+    digest.update(np.ascontiguousarray(np.asarray(price2, dtype=float)).tobytes())
+    digest.update(str(max_lag).encode())
+    return digest.hexdigest()
+
+
+class CointegrationStore:
+    """
+    Cointegration results saved in a SQLite file, keyed by ticker pair and checked against the fingerprint of the data they were
+    calculated from, so only pairs whose prices changed are tested again. Safe to use from any thread, each call opens its own connection.
+    Caching is only an optimisation, database errors are ignored
+    """
+    def __init__(self, path: str = STORE_PATH):
+        self.path = path
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=10)
+        connection.execute("CREATE TABLE IF NOT EXISTS cointegration (stock1 TEXT, stock2 TEXT, fingerprint TEXT, adf_stat REAL, "
+                           "p_value REAL, hedge_ratio REAL, half_life REAL, lags INTEGER, num_obs INTEGER, PRIMARY KEY (stock1, stock2))")
+        return connection
+
+    def get_many(self, keys):
+        """
+        Returns {(stock1, stock2): CointegrationResult} for the keys, (stock1, stock2, fingerprint), whose stored fingerprint matches
+        """
+        found = {}
+        try:
+            with self._connect() as connection:
+                for stock1, stock2, fingerprint in keys:
+                    row = connection.execute("SELECT adf_stat, p_value, hedge_ratio, half_life, lags, num_obs FROM cointegration "
+                                             "WHERE stock1 = ? AND stock2 = ? AND fingerprint = ?", (stock1, stock2, fingerprint)).fetchone()
+                    if row:
+                        found[(stock1, stock2)] = CointegrationResult(*[math.inf if value is None else value for value in row])
+            connection.close()
+        except (sqlite3.Error, OSError):
+            pass
+        return found
+
+    def put_many(self, rows):
+        """
+        Saves (stock1, stock2, fingerprint, CointegrationResult) rows, replacing older results of the same pairs
+        """
+        try:
+            with self._connect() as connection:
+                connection.executemany("INSERT OR REPLACE INTO cointegration VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                       [(stock1, stock2, fingerprint, *[None if value == math.inf else value for value in astuple(result)])
+                                        for stock1, stock2, fingerprint, result in rows])
+            connection.close()
+        except (sqlite3.Error, OSError):
+            pass
+
+
+def cointegration_tests(prices, pairs, store=None, max_lag=None, progress=None):
+    """
+    Engle-Granger tests of many pairs of an aligned price df, reusing stored results for pairs whose data hasn't changed.
+    Each pair only uses the dates both tickers have a price for, pairs with the same number of shared dates are tested in one batch
+    Parameters:
+        prices (df): one column per ticker with a date index, NaN where a ticker has no quote (see screener.load_universe)
+        pairs (list): (stock1, stock2) tickers
+        store (CointegrationStore): saved results, None to always calculate
+        max_lag (int): most lagged differences tried in the ADF regression
+        progress (function): called with (fraction, message) between batches, may raise to cancel
+    Returns a df with a row per pair, in the same order, and the fields of CointegrationResult as columns
+    """
+    dates = prices.index.to_numpy()
+    values = prices.to_numpy(dtype=float)
+    column_index = {ticker: i for i, ticker in enumerate(prices.columns)}
+    present = ~np.isnan(values)
+    shared_dates = [present[:, column_index[stock1]] & present[:, column_index[stock2]] for stock1, stock2 in pairs]
+    keys = [(stock1, stock2, pair_fingerprint(dates[shared], values[shared, column_index[stock1]], values[shared, column_index[stock2]], max_lag))
+            for (stock1, stock2), shared in zip(pairs, shared_dates)]
+
+    results = store.get_many(keys) if store else {}
+
+    # Group the pairs left to test by how many dates they share so each group is one dense batch
+    groups = {}
+    for key, shared in zip(keys, shared_dates):
+        if key[:2] not in results:
+            groups.setdefault(int(shared.sum()), []).append((key, shared))
+    num_missing = sum(len(group) for group in groups.values())
+    tested = []
+    for num_done, (num_obs, group) in enumerate(groups.items()):
+        if progress:
+            progress(num_done / len(groups), f"Testing cointegration of {num_missing} pairs")
+        if num_obs < 4:
+            tested += [(key, CointegrationResult(math.nan, math.nan, math.nan, math.nan, 0, num_obs)) for key, shared in group]
+            continue
+        price1 = np.column_stack([values[shared, column_index[key[0]]] for key, shared in group])
+        price2 = np.column_stack([values[shared, column_index[key[1]]] for key, shared in group])
+        tested += [(key, result) for (key, shared), result in zip(group, engle_granger(price1, price2, max_lag))]
+
+    results.update({key[:2]: result for key, result in tested})
+    if store and tested:
+        store.put_many([(*key, result) for key, result in tested])
+
+    return pd.DataFrame([{"stock1": stock1, "stock2": stock2, **results[(stock1, stock2)].__dict__} for stock1, stock2 in pairs],
+                        columns=["stock1", "stock2", *(field.name for field in fields(CointegrationResult))]) # columns are kept with no pairs
+
+
+def pair_cointegration(stock1_name: str, stock2_name: str, dates, price1, price2, store=None):
+    """
+    Engle-Granger test of one merged pair (see ingest.load_pair), reusing the stored result while its data is unchanged.
+    Shares stored results with cointegration_tests
+    """
+    price1 = np.asarray(price1, dtype=float)
+    price2 = np.asarray(price2, dtype=float)
+    valid = ~(np.isnan(price1) | np.isnan(price2))
+    price1, price2 = price1[valid], price2[valid]
+    fingerprint = pair_fingerprint(np.asarray(dates)[valid], price1, price2)
+    if store:
+        stored = store.get_many([(stock1_name, stock2_name, fingerprint)])
+        if stored:
+            return stored[(stock1_name, stock2_name)]
+    if len(price1) < 4:
+        return CointegrationResult(math.nan, math.nan, math.nan, math.nan, 0, len(price1))
+    result = engle_granger(price1, price2)[0]
+    if store:
+        store.put_many([(stock1_name, stock2_name, fingerprint, result)])
+    return result
@@ -0,0 +1,176 @@
+import numpy as np
+
+from backtest import rolling_spread_stats
+
+HEDGE_MODELS = ("equal", "ols", "rolling", "kalman")
+
+# Kalman filter noise, the usual pairs trading defaults. Only their ratio changes how fast the hedge ratio adapts
+KALMAN_DELTA = 1e-4 # hedge ratio random walk variance per bar is delta / (1 - delta)
+KALMAN_OBSERVATION_VARIANCE = 1e-3 # variance of price1 around hedge ratio * price2
+KALMAN_INITIAL_VARIANCE = 1.0 # uncertainty of the hedge ratio before the first bar, large so it starts near the price ratio
+
+
+def ols_hedge_ratio(price1, price2):
+    """
+    Full history least squares slope of price1 on price2 (with an intercept), skipping bars where either price is NaN.
+    NaN if price2 never changes
+    """
+    price1 = np.asarray(price1, dtype=float)
+    price2 = np.asarray(price2, dtype=float)
+    valid = ~(np.isnan(price1) | np.isnan(price2))
+    if not valid.any() or price2[valid].min() == price2[valid].max():
+        return np.nan
+    centered1 = price1[valid] - price1[valid].mean() # centering keeps the sums well conditioned
+    centered2 = price2[valid] - price2[valid].mean()
+    return float((centered1 @ centered2) / (centered2 @ centered2))
+
+
+def _rolling_range(values, lookback: int):
+    """
+    Lowest and highest valid value in the last lookback bars at each bar, in O(n). Like backtest._rolling_moments the history
+    is split into blocks of lookback bars, and a window takes the extreme from its start to the end of its block and from
+    the start of the next block to its end. Bars are along axis 0
+    Returns (low, high) arrays, NaN where the window has no values
+    """
+    n = len(values)
+    num_blocks = -(-n // lookback)
+    series_shape = values.shape[1:]
+    padded = np.full((num_blocks * lookback,) + series_shape, np.nan)
+    padded[:n] = values
+    blocks = padded.reshape((num_blocks, lookback) + series_shape)
+
+    end = np.arange(n)
+    start = end - lookback + 1
+    has_start = (start >= 0).reshape((-1,) + (1,) * len(series_shape)) # earlier windows are all in the first block
+    extremes = []
+    for extreme in (np.fmin, np.fmax): # NaN values are skipped
+        to_end = extreme.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].reshape(padded.shape)
+        from_start = extreme.accumulate(blocks, axis=1).reshape(padded.shape)
+        extremes.append(np.where(has_start, extreme(to_end[np.maximum(start, 0)], from_start[end]), from_start[end]))
+    return tuple(extremes)
+
+
+def rolling_hedge_ratio(price1, price2, lookback: int):
+    """
+    Least squares slope of price1 on price2 over the last lookback bars at each bar, in O(n).
+    The covariance comes from the variances of the sum and difference of the prices, (var(p1 + p2) - var(p1 - p2)) / 4,
+    so it reuses the precise running sums of backtest.rolling_spread_stats
+    Returns an array, NaN until the window has lookback bars and where price2 doesn't change over the window (like ols_hedge_ratio).
+    Bars x paths prices give a hedge ratio per column
+    """
+    price1 = np.asarray(price1, dtype=float)
+    price2 = np.asarray(price2, dtype=float)
+    invalid = np.isnan(price1) | np.isnan(price2)
+    price1 = np.where(invalid, np.nan, price1)
+    price2 = np.where(invalid, np.nan, price2)
+
+    sum_stdev = rolling_spread_stats(price1 + price2, lookback)[1]
+    difference_stdev = rolling_spread_stats(price1 - price2, lookback)[1]
+    price2_stdev = rolling_spread_stats(price2, lookback)[1]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        hedge_ratio = (sum_stdev ** 2 - difference_stdev ** 2) / (4 * price2_stdev ** 2)
+    # The running sums leave rounding noise in the variance of a flat window, so flat windows are found from their range
+    low, high = _rolling_range(price2, lookback)
+    return np.where(low == high, np.nan, hedge_ratio)
+
+
+def kalman_step(hedge_ratio: float, variance: float, price1: float, price2: float, delta: float = KALMAN_DELTA,
+                observation_variance: float = KALMAN_OBSERVATION_VARIANCE):
+    """
+    One update of the Kalman filter in kalman_hedge_ratio, for live prices
+    Returns the (hedge_ratio, variance) after seeing this bar
+    """
+    predicted = variance + delta / (1 - delta)
+    denominator = price2 * price2 * predicted + observation_variance
+    gain = predicted * price2 / denominator
+    return hedge_ratio + gain * (price1 - hedge_ratio * price2), predicted * observation_variance / denominator
+
+
+def kalman_hedge_ratio(price1, price2, delta: float = KALMAN_DELTA, observation_variance: float = KALMAN_OBSERVATION_VARIANCE,
+                       carry=None):
+    """
+    Hedge ratio from a Kalman filter on price1 = hedge ratio * price2 + noise, with the hedge ratio following a random walk.
+    Each bar gets the estimate from the bars before it, so the spread never uses its own price.
+    The variance update is a linear fractional map and the estimate update is a linear map, so both run as prefix scans of
+    composed maps in log2(n) whole-array passes (like backtest.run_states) instead of a python loop.
+    The filter forgets old bars quickly, so the scans stop once every composed map no longer depends on where it started. NaN bars are skipped
+    Parameters:
+        price1, price2 (array): prices of stock1 and stock2, oldest to newest. Bars x paths arrays filter each column on its own
+        delta, observation_variance (float): filter noise, see KALMAN_DELTA
+        carry (tuple): carry returned for the previous chunk, None to start before the first bar
+    Returns (hedge_ratio, carry) where hedge_ratio is an array, NaN on the first bar when starting fresh
+    """
+    price1 = np.asarray(price1, dtype=float)
+    price2 = np.asarray(price2, dtype=float)
+    hedge_ratio, variance = carry or (0.0, KALMAN_INITIAL_VARIANCE)
+    n = len(price1)
+    if not n:
+        return np.empty(0), (hedge_ratio, variance)
+
+    transition_variance = delta / (1 - delta)
+    valid = ~(np.isnan(price1) | np.isnan(price2))
+    squared = np.where(valid, price2 * price2, 0.0) # skipped bars only add the transition variance
+
+    # Variance after each bar: v -> R (v + Q) / (x^2 (v + Q) + R), a 2x2 matrix [[a, b], [c, d]] acting on (v, 1)
+    a = np.full(price1.shape, observation_variance)
+    b = np.full(price1.shape, observation_variance * transition_variance)
+    c = squared.copy()
+    d = squared * transition_variance + observation_variance
+    determinant = np.full(price1.shape, observation_variance ** 2) # tracked on its own, a * d - b * c cancels to rounding noise
+    most_skipped = n - valid.sum(axis=0).min()
+    largest = max(variance, observation_variance / squared[valid].min(initial=np.inf)) + transition_variance * (most_skipped + 1) # bound on any variance
+    step = 1
+    while step < n:
+        # Later map times earlier map, right hand sides are evaluated before assignment
+        a[step:], b[step:], c[step:], d[step:] = (a[step:] * a[:-step] + b[step:] * c[:-step], a[step:] * b[:-step] + b[step:] * d[:-step],
+                                                  c[step:] * a[:-step] + d[step:] * c[:-step], c[step:] * b[:-step] + d[step:] * d[:-step])
+        scale = a[step:] + b[step:] + c[step:] + d[step:] # entries are positive, rescaling keeps them in range without changing the map
+        a[step:] /= scale
+        b[step:] /= scale
+        c[step:] /= scale
+        d[step:] /= scale
+        determinant[step:] = determinant[step:] * determinant[:-step] / scale ** 2
+        step *= 2
+        if np.all(determinant[step:] * largest <= 1e-17 * b[step:] * d[step:]): # slope of the map is negligible
+            break
+    variances = (a * variance + b) / (c * variance + d)
+
+    # Estimate after each bar: h -> keep * h + gain * y, an affine map
+    previous_variance = np.concatenate([np.full((1,) + price1.shape[1:], variance), variances[:-1]])
+    predicted = previous_variance + transition_variance
+    denominator = squared * predicted + observation_variance
+    keep = np.where(valid, observation_variance / denominator, 1.0) # 1 - gain * x without the cancellation
+    shift = np.where(valid, predicted * price2 * price1 / denominator, 0.0)
+    step = 1
+    while step < n:
+        keep[step:], shift[step:] = keep[step:] * keep[:-step], keep[step:] * shift[:-step] + shift[step:]
+        step *= 2
+        if np.all(keep[step:] <= 1e-17): # the estimate before the window no longer matters
+            break
+    estimates = keep * hedge_ratio + shift
+
+    hedge_ratios = np.concatenate([np.full((1,) + price1.shape[1:], hedge_ratio if carry else np.nan), estimates[:-1]])
+    if price1.ndim == 1:
+        return hedge_ratios, (float(estimates[-1]), float(variances[-1]))
+    return hedge_ratios, (estimates[-1], variances[-1])
+
+
+def hedge_ratios(price1, price2, model: str = "equal", lookback: int = 0):
+    """
+    Calculates the hedge ratio (shares of stock2 per share of stock1) for a hedge model
+        - "equal": 1, the same number of shares of each stock
+        - "ols": least squares over the whole history, as a float
+        - "rolling": least squares over the last lookback bars at each bar, as an array
+        - "kalman": Kalman filter estimate from the bars before each bar, as an array
+    """
+    if model == "equal":
+        return 1.0
+    if model == "ols":
+        return ols_hedge_ratio(price1, price2)
+    if model == "rolling":
+        if lookback < 2:
+            raise ValueError("Lookback must be at least 2 bars")
+        return rolling_hedge_ratio(price1, price2, lookback)
+    if model == "kalman":
+        return kalman_hedge_ratio(price1, price2)[0]
+    raise ValueError(f"Unknown hedge model: {model}")
@@ -0,0 +1,180 @@
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+from instrument import span
+
+# Cleaned price series are cached here as memory mappable .npy files, one per quote file
+CACHE_DIR = os.environ.get("PAIRS_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".pairs_trading_cache"))
+
+CACHE_DTYPE = np.dtype([("date", "<i8"), ("close", "<f8")]) # date stored as nanoseconds since epoch
+
+
+def clean_prices(prices):
+    """
+    Converts a price column like "$71.65" to floats without using regex
+    """
+    if not pd.api.types.is_numeric_dtype(prices):
+        prices = prices.str.replace("$", "", regex=False).str.replace(",", "", regex=False)
+    return pd.to_numeric(prices, errors="coerce") # Convert to numbers
+
+
+def parse_dates(dates):
+    """
+    Converts NASDAQ "MM/DD/YYYY" dates (or "MM/DD/YYYY HH:MM[:SS]" for intraday bars) to datetimes, falling back to inferring the format
+    """
+    parsed = _parse_fixed_width_dates(dates)
+    if parsed is not None:
+        return parsed
+    try:
+        return pd.to_datetime(dates, format="%m/%d/%Y")
+    except ValueError:
+        return pd.to_datetime(dates)
+
+
+def _parse_fixed_width_dates(dates):
+    """
+    Fast path for zero padded NASDAQ dates, reads the digits straight from the characters with array arithmetic.
+    Around 30x faster than pd.to_datetime, which matters for millions of minute bars.
+    Returns None if the dates aren't all in the same "MM/DD/YYYY", "MM/DD/YYYY HH:MM" or "MM/DD/YYYY HH:MM:SS" layout
+    """
+    if not len(dates) or pd.api.types.is_datetime64_any_dtype(dates):
+        return None
+    try:
+        raw = np.asarray(dates, dtype="S")
+    except (UnicodeEncodeError, ValueError, TypeError):
+        return None
+    width = raw.dtype.itemsize
+    separators = {2: b"/", 5: b"/", 10: b" ", 13: b":", 16: b":"}
+    if width not in (10, 16, 19):
+        return None
+    chars = raw.view(np.uint8).reshape(len(raw), width)
+    if not (chars != 0).all(): # every date the same length
+        return None
+
+    digit_columns = [i for i in range(width) if i not in separators]
+    if not all((chars[:, i] == ord(separator)).all() for i, separator in separators.items() if i < width):
+        return None
+    digits = chars[:, digit_columns].astype(np.int64) - ord("0")
+    if not ((digits >= 0) & (digits <= 9)).all():
+        return None
+
+    month = digits[:, 0] * 10 + digits[:, 1]
+    day = digits[:, 2] * 10 + digits[:, 3]
+    year = digits[:, 4] * 1000 + digits[:, 5] * 100 + digits[:, 6] * 10 + digits[:, 7]
+    hour = digits[:, 8] * 10 + digits[:, 9] if width > 10 else 0
+    minute = digits[:, 10] * 10 + digits[:, 11] if width > 10 else 0
+    second = digits[:, 12] * 10 + digits[:, 13] if width > 16 else 0
+
+    month_start = ((year - 1970) * 12 + month - 1).astype("datetime64[M]")
+    days_in_month = ((month_start + 1).astype("datetime64[D]") - month_start.astype("datetime64[D]")).astype(np.int64)
+    if not ((month >= 1) & (month <= 12) & (day >= 1) & (day <= days_in_month)
+            & (hour <= 23) & (minute <= 59) & (second <= 59)).all():
+        return None # let pandas report the bad date
+
+    seconds = (hour * 60 + minute) * 60 + second
+    values = month_start.astype("datetime64[D]") + (day - 1) + seconds.astype("timedelta64[s]") if width > 10 else month_start.astype("datetime64[D]") + (day - 1)
+    unit = pd.to_datetime(pd.Series(["01/01/2000"]), format="%m/%d/%Y").dtype # same resolution pandas would give
+    return pd.Series(values.astype(unit), index=getattr(dates, "index", None), name=getattr(dates, "name", None))
+
+
+def parse_quotes(file_path: str):
+    """
+    Reads a NASDAQ historical quotes file and returns a df with datetime "Date" and numeric "Close/Last" columns, oldest to newest
+    """
+    with span("read_csv"):
+        stock_df = pd.read_csv(file_path, usecols = ["Date", "Close/Last"])
+    with span("parse dates"):
+        stock_df["Date"] = parse_dates(stock_df["Date"])
+    with span("clean prices"):
+        stock_df["Close/Last"] = clean_prices(stock_df["Close/Last"])
+    with span("sort"):
+        return stock_df.sort_values("Date", kind="stable").reset_index(drop=True)
+
+
+def file_identity(file_path: str):
+    """
+    Returns (path, size, modification time) of a file, which changes whenever the file is edited
+    """
+    file_stat = os.stat(file_path)
+    return (os.path.abspath(file_path), file_stat.st_size, file_stat.st_mtime_ns)
+
+
+def cache_path(file_path: str, suffix: str = ".npy"):
+    """
+    Returns the cache file for a quote file, keyed by its identity so edited files are re-parsed
+    """
+    key = "|".join(str(part) for part in file_identity(file_path))
+    return os.path.join(CACHE_DIR, hashlib.sha1(key.encode()).hexdigest() + suffix)
+
+
+def read_quotes(file_path: str, use_cache: bool = True):
+    """
+    Returns the cleaned quotes of a NASDAQ file, oldest to newest
+    The first load parses the CSV and stores the result in CACHE_DIR, later loads of the unchanged file memory map the cache
+    """
+    if not use_cache:
+        return parse_quotes(file_path)
+
+    cached_file = cache_path(file_path)
+    try:
+        with span("read cache"):
+            cached = np.load(cached_file, mmap_mode="r")
+            return pd.DataFrame({"Date": pd.to_datetime(cached["date"]), "Close/Last": cached["close"]})
+    except (FileNotFoundError, ValueError, OSError):
+        pass # not cached yet or unreadable cache, parse the CSV
+
+    stock_df = parse_quotes(file_path)
+
+    records = np.empty(len(stock_df), dtype=CACHE_DTYPE)
+    records["date"] = stock_df["Date"].to_numpy(dtype="datetime64[ns]").view("i8")
+    records["close"] = stock_df["Close/Last"].to_numpy(dtype=float)
+    try:
+        with span("write cache"):
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            temp_file = f"{cached_file}.{os.getpid()}.tmp"
+            with open(temp_file, "wb") as f:
+                np.save(f, records)
+            os.replace(temp_file, cached_file) # atomic so other processes never see a partial file
+    except OSError:
+        pass # caching is only an optimisation, carry on without it
+
+    return stock_df
+
+
+def clear_cache():
+    """
+    Deletes all cached price series
+    """
+    if not os.path.isdir(CACHE_DIR):
+        return
+    for file_name in os.listdir(CACHE_DIR):
+        if file_name.endswith((".npy", ".bin")):
+            os.remove(os.path.join(CACHE_DIR, file_name))
+
+
+def load_pair(file_path1: str, file_path2: str, stock1_price_col: str, stock2_price_col: str):
+    """
+    Reads and cleans both stock files and merges them into one df sorted from oldest to newest
+    Parameters:
+        file_path1, file_path2 (str): NASDAQ quote files for stock1 and stock2
+        stock1_price_col, stock2_price_col (str): names for the merged price columns
+    """
+    with span(f"read {os.path.basename(file_path1)}"):
+        stock1_df = read_quotes(file_path1)
+    with span(f"read {os.path.basename(file_path2)}"):
+        stock2_df = read_quotes(file_path2)
+    return merge_quotes(stock1_df, stock2_df, stock1_price_col, stock2_price_col)
+
+
+def merge_quotes(stock1_df, stock2_df, stock1_price_col: str, stock2_price_col: str):
+    """
+    Merges two cleaned quote dfs from read_quotes on their shared dates, sorted from oldest to newest
+    """
+    with span("merge"):
+        df = pd.merge(stock1_df, stock2_df, on = "Date", how = "inner")
+        df.rename(columns={"Close/Last_x": stock1_price_col, "Close/Last_y": stock2_price_col}, inplace = True)
+        df = df.sort_values("Date", kind="stable").reset_index(drop=True) # Sort from oldest to newest
+    return df
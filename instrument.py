@@ -0,0 +1,140 @@
+import cProfile
+import itertools
+import json
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict
+from datetime import datetime
+
+
+@dataclass
+class Span:
+    """
+    One timed stage of a run
+    """
+    name: str
+    start: float # seconds after the tracer was cleared
+    duration: float # seconds
+    thread: int # thread id, stages on the background task and the Tk thread are told apart
+    span_id: int
+    parent_id: int # span_id of the enclosing span on the same thread, -1 for a top level span
+
+
+class Tracer:
+    """
+    Records named timing spans of the stages of a run. A span costs about a microsecond so they are left in permanently,
+    spans can be recorded from any thread. Optionally captures a cProfile of code run inside profiled()
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local() # stack of open span ids per thread
+        self.ids = itertools.count()
+        self.clear()
+
+    def clear(self):
+        """
+        Forgets the spans and profile of the previous run
+        """
+        with self.lock:
+            self.spans = []
+            self.profile_stats = None # pstats.Stats of everything run inside profiled() since the last clear
+            self.origin = time.perf_counter()
+            self.started = datetime.now()
+
+    @contextmanager
+    def span(self, name: str):
+        """
+        Times the code inside the with block as a stage called name, spans opened inside it are its children
+        """
+        stack = self.local.__dict__.setdefault("stack", [])
+        span_id = next(self.ids)
+        parent_id = stack[-1] if stack else -1
+        stack.append(span_id)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            stack.pop()
+            with self.lock:
+                self.spans.append(Span(name, start - self.origin, end - start, threading.get_ident(), span_id, parent_id))
+
+    @contextmanager
+    def profiled(self, enabled: bool = True):
+        """
+        Runs the code inside the with block under cProfile when enabled, only the calling thread is profiled.
+        Profiles of several blocks in one run are added together
+        """
+        if not enabled:
+            yield
+            return
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            with self.lock:
+                if self.profile_stats is None:
+                    self.profile_stats = pstats.Stats(profile)
+                else:
+                    self.profile_stats.add(profile)
+
+    def ordered_spans(self):
+        """
+        Spans sorted by start time, parents before their children
+        """
+        with self.lock:
+            return sorted(self.spans, key=lambda span: (span.start, span.span_id))
+
+    def profile_rows(self, limit: int = 30):
+        """
+        Returns the profiled functions with the most cumulative time as dicts, empty if nothing was profiled
+        """
+        if self.profile_stats is None:
+            return []
+        rows = [{"function": pstats.func_std_string(function), "calls": calls, "total_seconds": total_time, "cumulative_seconds": cumulative_time}
+                for function, (primitive_calls, calls, total_time, cumulative_time, callers) in self.profile_stats.stats.items()]
+        return sorted(rows, key=lambda row: row["cumulative_seconds"], reverse=True)[:limit]
+
+    def to_json(self):
+        """
+        Returns the run's spans (and profile if one was captured) as a JSON serialisable dict
+        """
+        return {
+            "started": self.started.isoformat(timespec="seconds"),
+            "spans": [asdict(span) for span in self.ordered_spans()],
+            "profile": self.profile_rows(),
+        }
+
+    def to_chrome_trace(self):
+        """
+        Returns the run's spans in the Chrome trace event format, open it in chrome://tracing or Perfetto
+        """
+        events = [{"name": span.name, "cat": "pairs", "ph": "X", "ts": span.start * 1e6, "dur": span.duration * 1e6,
+                   "pid": os.getpid(), "tid": span.thread} for span in self.ordered_spans()]
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def export(self, file_path: str, trace_format: str = "json"):
+        """
+        Saves the run as "json" (see to_json) or "chrome" (see to_chrome_trace)
+        """
+        if trace_format not in ("json", "chrome"):
+            raise ValueError(f"Unknown trace format: {trace_format}")
+        with open(file_path, "w") as f:
+            json.dump(self.to_json() if trace_format == "json" else self.to_chrome_trace(), f, indent=2)
+            f.write("\n")
+
+
+# Shared by every module so one run's stages end up in one place
+tracer = Tracer()
+
+
+def span(name: str):
+    """
+    Times a stage on the shared tracer, use as "with span(name):"
+    """
+    return tracer.span(name)
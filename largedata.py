@@ -0,0 +1,344 @@
+import math
+import os
+
+import numpy as np
+import pandas as pd
+
+from analysis import PairAnalysis, result_cache, result_key
+from backtest import FLAT, UPPER, LOWER, compute_spread, rolling_spread_stats, expanding_spread_stats, simulate_trades, z_score
+from hedge import HEDGE_MODELS, kalman_hedge_ratio, rolling_hedge_ratio
+from ingest import CACHE_DIR, cache_path, clean_prices, parse_dates
+from instrument import span
+
+BYTES_PER_ROW = 400 # rough peak memory per aligned row while a chunk is backtested, used to size chunks from a memory limit
+POSITION_STATE = {0: FLAT, 1: UPPER, -1: LOWER} # trade_active -> trade state code
+
+
+def _no_progress(fraction: float, message: str = ""):
+    pass
+
+
+def chunk_rows_for(max_memory_mb: float):
+    """
+    Number of rows processed at once that keeps peak memory under about max_memory_mb
+    """
+    return max(10_000, int(max_memory_mb * 2 ** 20 / BYTES_PER_ROW))
+
+
+class RunningMoments:
+    """
+    Count, means and co-moments of several columns, combined chunk by chunk (Chan et al.) so the whole history never has to be in memory.
+    Rows with a NaN in any column are skipped
+    """
+    def __init__(self, num_columns: int):
+        self.count = 0
+        self.mean = np.zeros(num_columns)
+        self.comoment = np.zeros((num_columns, num_columns)) # sums of products of deviations from the mean
+
+    def add(self, *columns):
+        values = np.column_stack(columns).astype(float)
+        values = values[~np.isnan(values).any(axis=1)]
+        count = len(values)
+        if not count:
+            return
+        chunk_mean = values.mean(axis=0)
+        centered = values - chunk_mean
+        total = self.count + count
+        delta = chunk_mean - self.mean
+        self.comoment += centered.T @ centered + np.outer(delta, delta) * (self.count * count / total)
+        self.mean += delta * (count / total)
+        self.count = total
+
+    def stdev(self, column: int = 0):
+        """
+        Sample standard deviation, same as pandas
+        """
+        return math.sqrt(self.comoment[column, column] / (self.count - 1)) if self.count > 1 else math.nan
+
+    def correlation(self, column1: int, column2: int):
+        return self.comoment[column1, column2] / math.sqrt(self.comoment[column1, column1] * self.comoment[column2, column2])
+
+
+def _map(file_path: str, dtype):
+    """
+    Memory maps a column file, empty files can't be mapped so they give an empty array
+    """
+    if os.path.getsize(file_path) == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(file_path, dtype=dtype, mode="r")
+
+
+def compact_quotes(file_path: str, chunk_rows: int = 1_000_000, price_dtype=np.float32):
+    """
+    Streams a NASDAQ quote file into two compact column files in CACHE_DIR, int64 nanosecond dates and float32 closes, oldest to newest.
+    Only chunk_rows rows of the CSV are in memory at once, later loads of the unchanged file memory map the columns straight away
+    Returns (dates, closes) memory mapped arrays
+    """
+    price_dtype = np.dtype(price_dtype)
+    dates_file = cache_path(file_path, ".dates.bin")
+    closes_file = cache_path(file_path, f".{price_dtype.name}.bin")
+    if not (os.path.exists(dates_file) and os.path.exists(closes_file)):
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        _write_columns(file_path, dates_file, closes_file, chunk_rows, price_dtype)
+    return _map(dates_file, np.int64), _map(closes_file, price_dtype)
+
+
+def _write_columns(file_path: str, dates_file: str, closes_file: str, chunk_rows: int, price_dtype):
+    """
+    Parses the CSV chunk by chunk into the column files. NASDAQ exports are newest first, so they are reversed afterwards
+    in chunks. A file in no order at all has to be sorted in memory
+    """
+    temp_suffix = f".{os.getpid()}.tmp"
+    raw_dates, raw_closes = dates_file + temp_suffix, closes_file + temp_suffix
+    ascending = descending = True
+    previous = None
+    with open(raw_dates, "wb") as dates_out, open(raw_closes, "wb") as closes_out:
+        for chunk in pd.read_csv(file_path, usecols=["Date", "Close/Last"], chunksize=chunk_rows):
+            dates = parse_dates(chunk["Date"]).to_numpy(dtype="datetime64[ns]").view(np.int64)
+            closes = clean_prices(chunk["Close/Last"]).to_numpy(dtype=price_dtype)
+            if len(dates):
+                steps = np.diff(dates if previous is None else np.concatenate([[previous], dates]))
+                ascending = ascending and bool((steps >= 0).all())
+                descending = descending and bool((steps <= 0).all())
+                previous = dates[-1]
+            dates_out.write(dates.tobytes())
+            closes_out.write(closes.tobytes())
+
+    if ascending:
+        os.replace(raw_dates, dates_file)
+        os.replace(raw_closes, closes_file)
+    elif descending:
+        _reverse_column(raw_dates, dates_file, np.int64, chunk_rows)
+        _reverse_column(raw_closes, closes_file, price_dtype, chunk_rows)
+    else:
+        dates = np.fromfile(raw_dates, dtype=np.int64)
+        order = np.argsort(dates, kind="stable")
+        _write_atomic(dates_file, dates[order])
+        del dates
+        _write_atomic(closes_file, np.fromfile(raw_closes, dtype=price_dtype)[order])
+        os.remove(raw_dates)
+        os.remove(raw_closes)
+
+
+def _reverse_column(source: str, destination: str, dtype, chunk_rows: int):
+    """
+    Writes a column file in reverse order, reading chunk_rows values at a time
+    """
+    values = _map(source, dtype)
+    temp_file = destination + f".{os.getpid()}.rev"
+    with open(temp_file, "wb") as out:
+        for end in range(len(values), 0, -chunk_rows):
+            out.write(values[max(end - chunk_rows, 0):end][::-1].tobytes())
+    del values # release the map before deleting the file
+    os.replace(temp_file, destination)
+    os.remove(source)
+
+
+def _write_atomic(file_path: str, values):
+    temp_file = f"{file_path}.{os.getpid()}.tmp2"
+    values.tofile(temp_file)
+    os.replace(temp_file, file_path)
+
+
+def chunk_hedge_ratio(price1, price2, hedge: str, lookback: int, carry=None):
+    """
+    Hedge ratio of one chunk, continuing from the chunks before it
+    Parameters:
+        price1, price2 (array): prices of this chunk
+        hedge (str): "equal", "rolling" or "kalman". A full history OLS hedge ratio comes from the first pass statistics instead
+        lookback (int): bars in the rolling OLS window
+        carry: carry returned for the previous chunk, None for the first
+    Returns (hedge_ratio, carry)
+    """
+    if hedge == "kalman":
+        return kalman_hedge_ratio(price1, price2, carry=carry)
+    if hedge == "rolling":
+        tail1, tail2 = carry or (np.empty(0), np.empty(0)) # last lookback - 1 bars, the start of the first window in this chunk
+        history1 = np.concatenate([tail1, price1])
+        history2 = np.concatenate([tail2, price2])
+        keep = len(history1) - (lookback - 1)
+        return rolling_hedge_ratio(history1, history2, lookback)[len(tail1):], (history1[keep:], history2[keep:])
+    return 1.0, None
+
+
+def aligned_chunks(dates1, closes1, dates2, closes2, chunk_rows: int):
+    """
+    Merge-joins two tickers on their sorted timestamps, yielding (fraction done, dates, price1, price2) for the dates both have a price for.
+    Each chunk of stock1 is matched against the range of stock2 it covers, found by binary search on the memory mapped dates,
+    so only about chunk_rows rows of each ticker are read at once. Timestamps are expected to be unique within a ticker
+    """
+    for start in range(0, len(dates1), chunk_rows):
+        chunk_dates = np.asarray(dates1[start:start + chunk_rows])
+        low = np.searchsorted(dates2, chunk_dates[0], side="left")
+        high = np.searchsorted(dates2, chunk_dates[-1], side="right")
+        other_dates = np.asarray(dates2[low:high])
+        fraction = min(start + chunk_rows, len(dates1)) / len(dates1)
+        if not len(other_dates):
+            continue
+
+        position = np.minimum(np.searchsorted(other_dates, chunk_dates), len(other_dates) - 1)
+        matched = other_dates[position] == chunk_dates
+        if not matched.any():
+            continue
+        yield (fraction, chunk_dates[matched], np.asarray(closes1[start:start + chunk_rows])[matched],
+               np.asarray(closes2[low:high])[position[matched]])
+
+
+def analyze_large_pair(stock1_name: str, file_path1: str, stock2_name: str, file_path2: str, num_stdevs: float, capital: float,
+                       order_size: int, window: str = "full", lookback: int = 0, hedge: str = "equal", max_memory_mb: float = 512,
+                       preview_rows: int = 200_000, price_dtype=np.float32, progress=None):
+    """
+    Same as analysis.analyze_pair for histories too large to hold in memory, eg years of minute bars.
+    The quote files are compacted to memory mapped columns, then two passes run over the merge-joined pair one chunk at a time:
+    the first gathers the spread and price statistics, the second backtests each chunk carrying the trade state, cash,
+    hedge ratio and window statistics across chunk boundaries. Peak memory depends on max_memory_mb, not the length of the history
+    Parameters:
+        stock1_name ... hedge: same as analyze_pair
+        max_memory_mb (float): rough limit on the memory used for processing chunks
+        preview_rows (int): about how many bars are kept for the charts, every bar with a trade signal is always kept
+        price_dtype: storage type of the compacted prices, float32 halves the disk and memory use of float64
+        progress (function): called with (fraction, message) between chunks, may raise to cancel
+    Returns a PairAnalysis whose df holds the preview bars
+    """
+    progress = progress or _no_progress
+    key = result_key(stock1_name, file_path1, stock2_name, file_path2, num_stdevs, capital, order_size, window, lookback, hedge) + ("large", np.dtype(price_dtype).name)
+    analysis = result_cache.get(key)
+    if analysis is not None:
+        return analysis
+
+    if window not in ("full", "rolling", "expanding"):
+        raise ValueError(f"Unknown window mode: {window}")
+    if hedge not in HEDGE_MODELS:
+        raise ValueError(f"Unknown hedge model: {hedge}")
+    if (window != "full" or hedge == "rolling") and lookback < 2:
+        raise ValueError("Lookback must be at least 2 bars")
+    chunk_rows = chunk_rows_for(max_memory_mb)
+    stock1_price_col = f"{stock1_name} Price"
+    stock2_price_col = f"{stock2_name} Price"
+
+    with span("compact quotes"):
+        progress(0.0, f"Compacting {stock1_name}")
+        dates1, closes1 = compact_quotes(file_path1, chunk_rows, price_dtype)
+        progress(0.15, f"Compacting {stock2_name}")
+        dates2, closes2 = compact_quotes(file_path2, chunk_rows, price_dtype)
+
+    # First pass: statistics of the whole history
+    stats = RunningMoments(2) # price1, price2
+    spread_stats = RunningMoments(1)
+    hedge_carry = None
+    num_rows = 0
+    with span("measure spread"):
+        for fraction, dates, price1, price2 in aligned_chunks(dates1, closes1, dates2, closes2, chunk_rows):
+            price1 = price1.astype(float)
+            price2 = price2.astype(float)
+            stats.add(price1, price2)
+            if hedge != "ols":
+                hedge_ratio, hedge_carry = chunk_hedge_ratio(price1, price2, hedge, lookback, hedge_carry)
+                spread_stats.add(compute_spread(price1, price2, hedge_ratio))
+            num_rows += len(dates)
+            progress(0.3 + 0.2 * fraction, "Measuring spread")
+    if not num_rows:
+        raise ValueError(f"{stock1_name} and {stock2_name} have no dates in common")
+
+    if hedge == "ols":
+        # Slope and spread moments straight from the price co-moments, the spread can't be measured before the slope is known
+        hedge_ratio = stats.comoment[0, 1] / stats.comoment[1, 1]
+        full_mean = stats.mean[0] - hedge_ratio * stats.mean[1]
+        spread_squares = stats.comoment[0, 0] - 2 * hedge_ratio * stats.comoment[0, 1] + hedge_ratio ** 2 * stats.comoment[1, 1]
+        full_stdev = math.sqrt(max(spread_squares, 0.0) / (stats.count - 1)) if stats.count > 1 else math.nan
+    else:
+        full_mean, full_stdev = spread_stats.mean[0], spread_stats.stdev(0)
+
+    # Second pass: backtest chunk by chunk, carrying everything that crosses a chunk boundary
+    stride = max(1, math.ceil(num_rows / preview_rows)) # keep every stride-th bar for the charts
+    state, cash = FLAT, capital
+    hedge_carry = None
+    entry_hedge_ratio = None # hedge ratio of a trade left open at the end of the last chunk
+    spread_tail = np.empty(0) # last lookback - 1 spreads, the start of the first rolling window in the next chunk
+    expanding_carry = None
+    returns = RunningMoments(1)
+    last_value = None
+    num_trades = 0
+    offset = 0
+    previews = []
+    with span("backtest chunks"):
+        for fraction, dates, price1, price2 in aligned_chunks(dates1, closes1, dates2, closes2, chunk_rows):
+            price1 = price1.astype(float)
+            price2 = price2.astype(float)
+            if hedge != "ols":
+                hedge_ratio, hedge_carry = chunk_hedge_ratio(price1, price2, hedge, lookback, hedge_carry)
+            spread = compute_spread(price1, price2, hedge_ratio)
+
+            if window == "full":
+                mean_spread, spread_stdev = full_mean, full_stdev
+            elif window == "rolling":
+                history = np.concatenate([spread_tail, spread])
+                mean_spread, spread_stdev = (values[len(spread_tail):] for values in rolling_spread_stats(history, lookback))
+                spread_tail = history[len(history) - (lookback - 1):]
+            else:
+                mean_spread, spread_stdev, expanding_carry = expanding_spread_stats(spread, lookback, expanding_carry)
+            upper_threshold = mean_spread + (num_stdevs * spread_stdev)
+            lower_threshold = mean_spread - (num_stdevs * spread_stdev)
+
+            result = simulate_trades(price1, price2, upper_threshold, lower_threshold, cash, order_size, spread=spread, initial_state=state,
+                                     hedge_ratio=hedge_ratio, entry_hedge_ratio=entry_hedge_ratio)
+            state = POSITION_STATE[result.final_position]
+            entry_hedge_ratio = float(result.trade_hedge_ratio[-1])
+            cash = float(result.cash[-1])
+            num_trades += result.num_trades
+
+            values = result.portfolio_value
+            joined = values if last_value is None else np.concatenate([[last_value], values])
+            returns.add(joined[1:] / joined[:-1] - 1) # same as pct_change across the whole history
+            last_value = values[-1]
+
+            # Bars kept for the charts
+            index = offset + np.arange(len(dates))
+            keep = (index % stride == 0) | ~np.isnan(result.entries) | ~np.isnan(result.exits)
+            keep[-1] = True
+            previews.append(pd.DataFrame({
+                "Date": dates[keep].view("datetime64[ns]"),
+                stock1_price_col: price1[keep],
+                stock2_price_col: price2[keep],
+                "Spread": spread[keep],
+                "Hedge Ratio": np.broadcast_to(hedge_ratio, spread.shape)[keep],
+                "Z-Score": z_score(spread, mean_spread, spread_stdev)[keep],
+                "Entries": result.entries[keep],
+                "Exits": result.exits[keep],
+                "Portfolio Value": values[keep],
+                "Mean Spread": np.broadcast_to(mean_spread, spread.shape)[keep],
+                "Upper Threshold": np.broadcast_to(upper_threshold, spread.shape)[keep],
+                "Lower Threshold": np.broadcast_to(lower_threshold, spread.shape)[keep],
+            }))
+            offset += len(dates)
+            progress(0.5 + 0.5 * fraction, f"Backtested {offset:,} of {num_rows:,} bars")
+
+    df = pd.concat(previews, ignore_index=True)
+    thresholds = [df.pop(col).to_numpy() for col in ["Mean Spread", "Upper Threshold", "Lower Threshold"]]
+    if window == "full":
+        thresholds = [float(values[0]) for values in thresholds]
+    if hedge in ("equal", "ols"):
+        hedge_ratio = float(hedge_ratio)
+    else:
+        hedge_ratio = df["Hedge Ratio"].to_numpy()
+
+    analysis = PairAnalysis(
+        df=df,
+        stock1_name=stock1_name,
+        stock2_name=stock2_name,
+        stock1_price_col=stock1_price_col,
+        stock2_price_col=stock2_price_col,
+        correlation=stats.correlation(0, 1),
+        stock1_mean_price=stats.mean[0],
+        stock2_mean_price=stats.mean[1],
+        mean_spread=thresholds[0],
+        upper_threshold=thresholds[1],
+        lower_threshold=thresholds[2],
+        sharpe_ratio=returns.mean[0] / returns.stdev(0) if returns.stdev(0) > 0 else math.nan,
+        return_pct=(last_value - capital) / capital * 100,
+        num_trades=num_trades,
+        final_position=int(result.final_position),
+        hedge_ratio=hedge_ratio,
+    )
+    result_cache.put(key, analysis)
+    return analysis
@@ -0,0 +1,177 @@
+import csv
+import json
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from analysis import cached_prepare_pair, hedged_spread, spread_window_stats
+from backtest import simulate_trades, compute_metrics
+from instrument import span
+
+PAIR_FIELDS = ["stock1", "file1", "stock2", "file2", "order_size"] # order_size is optional
+
+
+@dataclass
+class PortfolioResult:
+    """
+    Results of backtesting several pairs together from one pool of capital.
+    2D arrays are bars x pairs on the union of the pairs' dates, pairs are in the order given
+    """
+    dates: np.ndarray
+    pair_names: list # "stock1/stock2" of each pair
+    order_sizes: np.ndarray # shares of stock1 per trade of each pair
+    allocations: np.ndarray # capital set aside for each pair, they add up to the starting capital
+    quoted: np.ndarray # True where a pair has a quote on the date, pairs hold their last state on the other dates
+    positions: np.ndarray # 1 in an upper trade (short stock1), -1 in a lower trade (long stock1), 0 flat, see backtest.STATE_SIGN
+    cash: np.ndarray # each pair's share of the pool's cash
+    equity: np.ndarray # each pair's cash and long legs
+    portfolio_value: np.ndarray # whole book, the sum of every pair's equity
+    sharpe_ratio: float # of the whole book
+    return_pct: float
+    num_trades: int
+    pair_sharpe: np.ndarray # of each pair's equity, over the dates it has quotes
+    pair_return: np.ndarray # on each pair's allocation
+    pair_trades: np.ndarray
+
+
+def read_pairs(file_path: str, order_size: int):
+    """
+    Reads pairs from a JSON list of objects or a CSV with a header row, using PAIR_FIELDS as keys.
+    Pairs without an order size use order_size
+    Returns (stock1, file1, stock2, file2, order_size) tuples
+    """
+    with open(file_path, "r", newline="") as f:
+        if file_path.lower().endswith(".json"):
+            rows = json.load(f)
+        else:
+            rows = list(csv.DictReader(f))
+
+    pairs = []
+    for row in rows:
+        missing = [key for key in PAIR_FIELDS[:4] if row.get(key) in ("", None)]
+        if missing:
+            raise ValueError(f"Pair {len(pairs) + 1} in {file_path} is missing {', '.join(missing)}")
+        size = row.get("order_size")
+        pairs.append((row["stock1"], row["file1"], row["stock2"], row["file2"], int(size) if size not in ("", None) else order_size))
+    return pairs
+
+
+def _aligned(columns, dates):
+    """
+    Puts per pair series (indexed by date) side by side on dates, as a bars x pairs array
+    """
+    return pd.DataFrame({i: series for i, series in enumerate(columns)}).reindex(dates).to_numpy(dtype=float)
+
+
+def backtest_portfolio(pairs, num_stdevs: float, capital: float, order_size: int = 10, window: str = "full", lookback: int = 0,
+                       hedge: str = "equal", progress=None):
+    """
+    Backtests several pairs together from one pool of capital, each pair gets an equal share of it.
+    Each pair's spread and thresholds are worked out as in a single test (and cached the same way), then the pairs are
+    aligned on the union of their dates and the trades, cash and equity of the whole book are simulated in one pass of
+    bars x pairs arrays. On dates a pair has no quote its spread is missing so it keeps its trade state, and its prices
+    carry forward
+    Parameters:
+        pairs (list): (stock1, file1, stock2, file2) or (stock1, file1, stock2, file2, order_size) tuples
+        num_stdevs, window, lookback, hedge: trade settings shared by every pair, same as the single test
+        capital (float): starting capital of the whole book
+        order_size (int): shares of stock1 per trade for pairs that don't give one
+        progress (function): called with (fraction, message) after each pair is loaded, may raise to cancel
+    """
+    if not pairs:
+        raise ValueError("No pairs to backtest")
+    names, sizes = [], []
+    columns = {key: [] for key in ["price1", "price2", "spread", "hedge_ratio", "upper", "lower"]}
+    with span("prepare pairs"):
+        for i, pair in enumerate(pairs):
+            stock1_name, file_path1, stock2_name, file_path2 = pair[:4]
+            if progress:
+                progress(i / len(pairs), f"Loading {stock1_name}/{stock2_name}")
+            prepared = cached_prepare_pair(stock1_name, file_path1, stock2_name, file_path2)
+            hedge_ratio, spread = hedged_spread(prepared, hedge, lookback)
+            mean_spread, spread_stdev = spread_window_stats(prepared, window, lookback, hedge)
+
+            df = prepared.df
+            values = {
+                "price1": df[prepared.stock1_price_col],
+                "price2": df[prepared.stock2_price_col],
+                "spread": spread,
+                "hedge_ratio": np.broadcast_to(hedge_ratio, len(df)),
+                "upper": np.broadcast_to(mean_spread + (num_stdevs * spread_stdev), len(df)),
+                "lower": np.broadcast_to(mean_spread - (num_stdevs * spread_stdev), len(df)),
+            }
+            unique = ~df["Date"].duplicated(keep="last").to_numpy() # a date quoted twice keeps its last bar
+            for key, value in values.items():
+                columns[key].append(pd.Series(np.asarray(value, dtype=float)[unique], index=df["Date"].to_numpy()[unique]))
+            names.append(f"{stock1_name}/{stock2_name}")
+            sizes.append(pair[4] if len(pair) > 4 else order_size)
+
+    with span("align pairs"):
+        dates = pd.DatetimeIndex(sorted(set().union(*(series.index for series in columns["spread"]))))
+        quoted = ~np.isnan(_aligned(columns["price1"], dates))
+        aligned = {key: _aligned(value, dates) for key, value in columns.items()}
+        for key in ["price1", "price2", "hedge_ratio", "upper", "lower"]:
+            aligned[key] = pd.DataFrame(aligned[key]).ffill().to_numpy() # missing quotes carry the last price forward
+
+    # Each pair runs on its own column with its allocation as starting cash, so a single pair gives the same values as a single test
+    order_sizes = np.array(sizes, dtype=float)
+    allocations = np.full(len(pairs), capital / len(pairs))
+    with span("simulate portfolio"):
+        result = simulate_trades(aligned["price1"], aligned["price2"], aligned["upper"], aligned["lower"], allocations, order_sizes,
+                                 spread=aligned["spread"], hedge_ratio=aligned["hedge_ratio"])
+    equity = result.portfolio_value # before a pair's first quote it can't trade, so its equity is its allocation
+
+    with span("metrics"):
+        portfolio_value = equity.sum(axis=1)
+        sharpe_ratio, return_pct = compute_metrics(portfolio_value, capital)
+        pair_sharpe = compute_metrics(np.where(quoted, equity, np.nan), allocations)[0]
+        pair_return = (equity[-1] - allocations) / allocations * 100
+        pair_trades = np.count_nonzero(~np.isnan(result.exits), axis=0)
+
+    return PortfolioResult(
+        dates=dates.to_numpy(),
+        pair_names=names,
+        order_sizes=order_sizes,
+        allocations=allocations,
+        quoted=quoted,
+        positions=result.positions,
+        cash=result.cash,
+        equity=equity,
+        portfolio_value=portfolio_value,
+        sharpe_ratio=float(sharpe_ratio),
+        return_pct=float(return_pct),
+        num_trades=int(pair_trades.sum()),
+        pair_sharpe=pair_sharpe,
+        pair_return=pair_return,
+        pair_trades=pair_trades,
+    )
+
+
+def portfolio_table(result: PortfolioResult):
+    """
+    Returns a df with each pair's order size, allocation, Sharpe ratio, return and trades, and the whole book last
+    """
+    table = pd.DataFrame({
+        "pair": result.pair_names,
+        "order_size": result.order_sizes.astype(int),
+        "allocation": result.allocations,
+        "sharpe_ratio": result.pair_sharpe,
+        "return_pct": result.pair_return,
+        "num_trades": result.pair_trades,
+        "final_position": result.positions[-1],
+    })
+    total = {"pair": "Portfolio", "allocation": result.allocations.sum(), "sharpe_ratio": result.sharpe_ratio, "return_pct": result.return_pct,
+             "num_trades": result.num_trades}
+    table = pd.concat([table, pd.DataFrame([total])], ignore_index=True)
+    return table.astype({"order_size": "Int64", "final_position": "Int64"}) # blank rather than NaN for the whole book
+
+
+def equity_table(result: PortfolioResult):
+    """
+    Returns a df of the equity curves by date, a column per pair and the whole book last
+    """
+    table = pd.DataFrame(result.equity, columns=result.pair_names)
+    table.insert(0, "Date", result.dates)
+    table["Portfolio"] = result.portfolio_value
+    return table
@@ -0,0 +1,252 @@
+"""
+Renders the price/spread and portfolio charts of many pairs off screen, with a CSV and HTML summary of their metrics
+
+Examples:
+    python report.py --pairs pairs.csv --output report/
+    python report.py --screen quotes/ --top 200 --output report/ --format png svg
+
+Charts are drawn with the Agg backend across a process pool, each process builds the figures once and reuses them for every pair
+"""
+import argparse
+import csv
+import html
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from analysis import analyze_pair
+from sweep import collect_results
+
+CHART_FORMATS = ["png", "svg"]
+REPORT_FIELDS = ["stock1", "stock2", "order_size", "correlation", "coint_p_value", "half_life", "hedge_ratio", "sharpe_ratio", "return_pct",
+                 "num_trades", "final_position", "prices_chart", "portfolio_chart", "error"]
+
+# Output folder, chart settings and the figure template in each worker process, set by _init_worker and chart_template
+_worker_data = {}
+
+
+def chart_template():
+    """
+    Returns the PairCharts of this process, created the first time and then updated in place for each pair.
+    Building the figures, axes and artists is most of the cost of a chart, so it's only done once per process
+    Imports matplotlib here so processes that never draw a chart don't load it
+    """
+    if "charts" not in _worker_data:
+        import matplotlib
+        if "matplotlib.pyplot" not in sys.modules:
+            matplotlib.use("Agg") # a process that already uses pyplot (eg the app) keeps its backend, figures are still saved with Agg
+        from charts import PairCharts
+        _worker_data["charts"] = PairCharts()
+    return _worker_data["charts"]
+
+
+def chart_name(stock1: str, stock2: str, order_size: int):
+    """
+    File name stem of a pair's charts, characters that can't be in a file name are replaced
+    """
+    name = f"{stock1}_{stock2}_size{order_size}"
+    return "".join(char if char.isalnum() or char in "-_." else "_" for char in name)
+
+
+def _init_worker(output_dir, formats, dpi, settings):
+    """
+    Stores the output folder, chart formats and backtest settings in the worker
+    """
+    _worker_data["output_dir"] = output_dir
+    _worker_data["formats"] = formats
+    _worker_data["dpi"] = dpi
+    _worker_data["settings"] = settings
+
+
+def _render_pair(pair):
+    """
+    Backtests one pair and saves its charts in every format, errors are reported in the row so one bad file doesn't stop the report
+    """
+    stock1, file1, stock2, file2, order_size = pair
+    num_stdevs, capital, window, lookback, hedge = _worker_data["settings"]
+    row = {"stock1": stock1, "stock2": stock2, "order_size": order_size}
+    try:
+        analysis = analyze_pair(stock1, file1, stock2, file2, num_stdevs, capital, order_size, window, lookback, hedge)
+        row.update({
+            "correlation": float(analysis.correlation),
+            "coint_p_value": float(analysis.coint_p_value),
+            "half_life": float(analysis.half_life),
+            "hedge_ratio": float(analysis.df["Hedge Ratio"].iloc[-1]), # latest for rolling OLS and Kalman
+            "sharpe_ratio": float(analysis.sharpe_ratio),
+            "return_pct": float(analysis.return_pct),
+            "num_trades": analysis.num_trades,
+            "final_position": analysis.final_position,
+        })
+
+        charts = chart_template()
+        charts.update(analysis, show_thresholds=True, show_means=False, show_signals=True, draw=False)
+        name = chart_name(stock1, stock2, order_size)
+        for fmt in _worker_data["formats"]:
+            for key, fig, suffix in [("prices_chart", charts.fig1, "prices"), ("portfolio_chart", charts.fig2, "portfolio")]:
+                file_name = f"{name}_{suffix}.{fmt}"
+                fig.savefig(os.path.join(_worker_data["output_dir"], file_name), dpi=_worker_data["dpi"])
+                row.setdefault(key, file_name) # the summary links the first format
+    except Exception as error:
+        row["error"] = f"{type(error).__name__}: {error}"
+    return row
+
+
+def _format_value(key: str, value):
+    """
+    Formats a summary value for the HTML table
+    """
+    if value is None or value == "" or value != value: # missing or NaN
+        return ""
+    if key == "return_pct":
+        return f"{value:.2f}%"
+    if key == "half_life":
+        return f"{value:.1f}"
+    if isinstance(value, float):
+        return f"{value:.4f}"
+    return html.escape(str(value))
+
+
+def write_summary(rows, output_dir: str, title: str = "Pairs Report"):
+    """
+    Writes summary.csv and summary.html of the report's rows into output_dir, the HTML shows each pair's charts under its metrics
+    Returns the HTML file's path
+    """
+    with open(os.path.join(output_dir, "summary.csv"), "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS, extrasaction="ignore", lineterminator="\n")
+        writer.writeheader()
+        writer.writerows(rows)
+
+    metric_fields = REPORT_FIELDS[:-3]
+    headings = "".join(f"<th>{html.escape(field.replace('_', ' ').title())}</th>" for field in metric_fields)
+    table_rows = []
+    for row in rows:
+        cells = "".join(f"<td>{_format_value(field, row.get(field))}</td>" for field in metric_fields)
+        if row.get("error"):
+            charts = f'<td class="error">{html.escape(row["error"])}</td>'
+        else:
+            charts = "<td>" + "".join(f'<a href="{html.escape(row[key])}"><img src="{html.escape(row[key])}" loading="lazy"></a>'
+                                      for key in ["prices_chart", "portfolio_chart"]) + "</td>"
+        table_rows.append(f"<tr>{cells}{charts}</tr>")
+
+    html_path = os.path.join(output_dir, "summary.html")
+    with open(html_path, "w") as f:
+        f.write(f"""<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{html.escape(title)}</title>
+<style>
+body {{ background: #190831; color: white; font-family: "Helvetica Neue", sans-serif; font-size: 13px; }}
+table {{ border-collapse: collapse; }}
+th, td {{ border: 1px solid #444; padding: 4px 8px; text-align: right; vertical-align: top; }}
+td img {{ width: 350px; }}
+.error {{ color: #ff6b6b; text-align: left; }}
+</style>
+</head>
+<body>
+<h1>{html.escape(title)}</h1>
+<table>
+<tr>{headings}<th>Charts</th></tr>
+{chr(10).join(table_rows)}
+</table>
+</body>
+</html>
+""")
+    return html_path
+
+
+def generate_report(pairs, output_dir: str, num_stdevs: float, capital: float, window: str = "full", lookback: int = 0, hedge: str = "equal",
+                    formats=("png",), dpi: int = 100, max_workers=None, progress=None):
+    """
+    Backtests each pair, saves its price/spread and portfolio charts and writes a CSV and HTML summary, see write_summary
+    Returns the summary rows in the same order as pairs
+    Parameters:
+        pairs (list): (stock1, file1, stock2, file2, order_size) tuples
+        output_dir (str): folder for the charts and summaries, created if missing
+        num_stdevs, capital, window, lookback, hedge: backtest settings, same as the single test
+        formats (list): chart file formats, of CHART_FORMATS
+        dpi (int): resolution of PNG charts
+        max_workers (int): number of processes, defaults to the number of cores. 1 runs in this process
+        progress (function): called with (fraction, message) as pairs finish, may raise to cancel
+    """
+    unknown = [fmt for fmt in formats if fmt not in CHART_FORMATS]
+    if unknown:
+        raise ValueError(f"Unknown chart format: {', '.join(unknown)}")
+    os.makedirs(output_dir, exist_ok=True)
+    pairs = [tuple(pair) for pair in pairs]
+    initargs = (output_dir, list(formats), dpi, (num_stdevs, capital, window, lookback, hedge))
+    if max_workers is None:
+        max_workers = min(os.cpu_count() or 1, len(pairs))
+
+    if max_workers <= 1:
+        _init_worker(*initargs)
+        rows = collect_results(map(_render_pair, pairs), len(pairs), progress)
+    else:
+        chunksize = max(1, len(pairs) // (max_workers * 4))
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, initargs=initargs) as executor:
+            rows = collect_results(executor.map(_render_pair, pairs, chunksize=chunksize), len(pairs), progress, executor)
+
+    write_summary(rows, output_dir)
+    return rows
+
+
+def screened_pairs(results, file_paths: dict, order_size: int):
+    """
+    Turns the output of screener.screen_universe into pairs for generate_report
+    """
+    return [(stock1, file_paths[stock1], stock2, file_paths[stock2], order_size) for stock1, stock2 in zip(results["stock1"], results["stock2"])]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Save charts and a summary of many pairs from NASDAQ quote files without the GUI")
+    parser.add_argument("--pair", nargs=4, action="append", default=[], metavar=("TICKER1", "FILE1", "TICKER2", "FILE2"),
+                        help="pair to chart, can be given more than once")
+    parser.add_argument("--pairs", help="JSON or CSV file of pairs with columns stock1, file1, stock2, file2 and optionally order_size")
+    parser.add_argument("--screen", metavar="FOLDER", help="screen a folder of quote files and chart the --top pairs by Sharpe ratio")
+    parser.add_argument("--top", type=int, default=20, help="number of most correlated pairs to test when screening")
+    parser.add_argument("--output", required=True, help="folder to save the charts, summary.csv and summary.html in")
+    parser.add_argument("--format", nargs="+", choices=CHART_FORMATS, default=["png"], help="chart file formats")
+    parser.add_argument("--dpi", type=int, default=100, help="resolution of PNG charts")
+    parser.add_argument("--num-stdevs", type=float, default=1.5, help="SD threshold")
+    parser.add_argument("--capital", type=float, default=10000, help="starting capital")
+    parser.add_argument("--order-size", type=int, default=10, help="order size for pairs that don't give one")
+    parser.add_argument("--window", choices=["full", "rolling", "expanding"], default="full", help="bars used for the spread mean and stdev")
+    parser.add_argument("--lookback", type=int, default=60, help="bars in the rolling window and the rolling OLS hedge")
+    parser.add_argument("--hedge", choices=["equal", "ols", "rolling", "kalman"], default="equal", help="hedge ratio model for the stock2 leg")
+    parser.add_argument("--workers", type=int, default=None, help="number of processes, defaults to the number of cores")
+    parser.add_argument("--quiet", action="store_true", help="don't report progress on stderr")
+    return parser, parser.parse_args(argv)
+
+
+def main(argv=None):
+    parser, args = parse_args(argv)
+    if args.top < 1:
+        parser.error("--top must be at least 1")
+
+    def report(fraction, message):
+        print(f"\r{message}", end="", file=sys.stderr, flush=True)
+    progress = None if args.quiet else report
+
+    pairs = [(stock1, file1, stock2, file2, args.order_size) for stock1, file1, stock2, file2 in args.pair]
+    if args.pairs:
+        from portfolio import read_pairs
+        pairs += read_pairs(args.pairs, args.order_size)
+    if args.screen:
+        from analysis import cointegration_store
+        from screener import load_universe, screen_universe
+        prices, file_paths = load_universe(args.screen, progress=progress)
+        results = screen_universe(prices, args.num_stdevs, args.capital, args.order_size, top_k=args.top, window=args.window, lookback=args.lookback,
+                                  hedge=args.hedge, store=cointegration_store, max_workers=args.workers, progress=progress)
+        pairs += screened_pairs(results, file_paths, args.order_size)
+    if not pairs:
+        parser.error("nothing to chart, give --pair, --pairs or --screen")
+
+    rows = generate_report(pairs, args.output, args.num_stdevs, args.capital, args.window, args.lookback, args.hedge, args.format, args.dpi,
+                           max_workers=args.workers, progress=progress)
+    if not args.quiet:
+        print(f"\nSaved {os.path.join(args.output, 'summary.html')}", file=sys.stderr)
+    return 1 if any("error" in row for row in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,163 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from backtest import compute_spread, window_thresholds, simulate_trades, compute_metrics
+from cointegration import cointegration_tests, spread_half_life
+from hedge import hedge_ratios
+from ingest import read_quotes
+from sweep import collect_results
+
+METRIC_FIELDS = ["half_life", "sharpe_ratio", "return_pct", "num_trades"] # backtest columns added to each screened pair
+
+# Aligned prices shared by every task in a worker process, set once by _init_worker
+_worker_data = {}
+
+
+def ticker_from_path(file_path: str):
+    """
+    Gets the ticker from a NASDAQ export file name, eg "KO historical quotes.csv" -> "KO"
+    """
+    return os.path.basename(file_path).split(" ")[0].split(".")[0].upper()
+
+
+def load_universe(folder: str, progress=None):
+    """
+    Reads every CSV in folder and aligns the closing prices on one date index, oldest to newest
+    Returns (prices, file_paths) where prices is a df with one column per ticker (NaN where a ticker has no quote)
+    and file_paths maps each ticker to its file
+    progress (function) is called with (fraction, message) after each file, may raise to cancel
+    """
+    file_paths = {}
+    columns = {}
+    file_names = [file_name for file_name in sorted(os.listdir(folder)) if file_name.lower().endswith(".csv")]
+    for i, file_name in enumerate(file_names):
+        if progress:
+            progress(i / len(file_names), f"Loading {file_name}")
+        file_path = os.path.join(folder, file_name)
+        ticker = ticker_from_path(file_path)
+        stock_df = read_quotes(file_path)
+        columns[ticker] = stock_df.drop_duplicates("Date").set_index("Date")["Close/Last"]
+        file_paths[ticker] = file_path
+
+    prices = pd.DataFrame(columns).sort_index() # outer join on dates
+    return prices, file_paths
+
+
+def correlation_matrix(prices):
+    """
+    Calculates the N x N Pearson correlation of every pair of columns in one pass of matrix products.
+    Each pair only uses the dates where both tickers have a price, the same as df.corr()
+    """
+    values = np.asarray(prices, dtype=float)
+    present = (~np.isnan(values)).astype(float)
+    centered = np.where(present > 0, values - np.nanmean(values, axis=0), 0.0) # centering keeps the sums well conditioned
+
+    count = present.T @ present # number of shared dates per pair
+    sum_x = centered.T @ present # sum of column i over dates shared with column j
+    sum_xx = (centered ** 2).T @ present
+    sum_xy = centered.T @ centered
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        covariance = sum_xy - sum_x * sum_x.T / count
+        variance_x = sum_xx - sum_x ** 2 / count
+        correlation = covariance / np.sqrt(variance_x * variance_x.T)
+    correlation[count < 2] = np.nan
+    return np.clip(correlation, -1, 1)
+
+
+def rank_pairs_by_correlation(prices):
+    """
+    Returns every pair of tickers ranked from highest to lowest correlation
+    """
+    correlation = correlation_matrix(prices)
+    rows, cols = np.triu_indices(len(prices.columns), k=1)
+    pairs = pd.DataFrame({
+        "stock1": prices.columns[rows],
+        "stock2": prices.columns[cols],
+        "correlation": correlation[rows, cols],
+    })
+    return pairs.sort_values("correlation", ascending=False, na_position="last").reset_index(drop=True)
+
+
+def _init_worker(prices, settings):
+    """
+    Stores the aligned price matrix and backtest settings in the worker so they are only sent once per process
+    """
+    _worker_data["prices"] = prices
+    _worker_data["settings"] = settings
+
+
+def _screen_chunk(pairs):
+    """
+    Measures mean reversion and backtests a chunk of (column1, column2) pairs on the worker's prices
+    """
+    prices = _worker_data["prices"]
+    num_stdevs, capital, order_size, window, lookback, hedge = _worker_data["settings"]
+
+    rows = []
+    for column1, column2 in pairs:
+        price1 = prices[:, column1]
+        price2 = prices[:, column2]
+        shared = ~(np.isnan(price1) | np.isnan(price2)) # only trade dates both stocks have quotes for
+        price1 = price1[shared]
+        price2 = price2[shared]
+
+        hedge_ratio = hedge_ratios(price1, price2, hedge, lookback)
+        spread = compute_spread(price1, price2, hedge_ratio)
+        mean_spread, spread_stdev, upper_threshold, lower_threshold = window_thresholds(spread, num_stdevs, window, lookback)
+        result = simulate_trades(price1, price2, upper_threshold, lower_threshold, capital, order_size, spread=spread, hedge_ratio=hedge_ratio)
+        sharpe_ratio, return_pct = compute_metrics(result.portfolio_value, capital)
+
+        rows.append({
+            "half_life": float(spread_half_life(spread[~np.isnan(spread)])),
+            "sharpe_ratio": sharpe_ratio,
+            "return_pct": return_pct,
+            "num_trades": result.num_trades,
+        })
+    return rows
+
+
+def screen_universe(prices, num_stdevs: float, capital: float, order_size: int, top_k: int = 20, chunk_size: int = 8,
+                    window: str = "full", lookback: int = 0, hedge: str = "equal", store=None, max_workers=None, progress=None):
+    """
+    Ranks every pair by correlation, then tests the top_k most correlated pairs for cointegration in batches
+    and backtests them in chunks across a process pool
+    Returns a df of the top_k pairs sorted by Sharpe ratio, with no rows (but the same columns) if there are no pairs to test
+    Parameters:
+        prices (df): aligned prices from load_universe
+        num_stdevs, capital, order_size, window, lookback, hedge: backtest settings, same as the single test
+        top_k (int): number of pairs to backtest
+        store (CointegrationStore): saved cointegration results, only pairs whose prices changed are tested again
+        chunk_size (int): number of pairs sent to a worker at once
+        max_workers (int): number of processes, defaults to the number of cores. 1 runs in this process
+        progress (function): called with (fraction, message) as chunks finish, may raise to cancel the screen
+    """
+    if len(prices.columns) < 2:
+        raise ValueError(f"Screening needs at least two quote files, found {len(prices.columns)}")
+    ranked = rank_pairs_by_correlation(prices)
+    top_pairs = ranked.head(top_k).copy()
+    cointegration = cointegration_tests(prices, list(zip(top_pairs["stock1"], top_pairs["stock2"])), store)
+    top_pairs["p_value"] = cointegration["p_value"].to_numpy()
+
+    column_index = {ticker: i for i, ticker in enumerate(prices.columns)}
+    pair_columns = [(column_index[stock1], column_index[stock2]) for stock1, stock2 in zip(top_pairs["stock1"], top_pairs["stock2"])]
+    chunks = [pair_columns[i:i + chunk_size] for i in range(0, len(pair_columns), chunk_size)]
+
+    values = prices.to_numpy(dtype=float)
+    settings = (num_stdevs, capital, order_size, window, lookback, hedge)
+    if max_workers is None:
+        max_workers = min(os.cpu_count() or 1, len(chunks))
+
+    if max_workers <= 1:
+        _init_worker(values, settings)
+        chunk_results = collect_results(map(_screen_chunk, chunks), len(chunks), progress)
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, initargs=(values, settings)) as executor:
+            chunk_results = collect_results(executor.map(_screen_chunk, chunks), len(chunks), progress, executor)
+
+    metrics = pd.DataFrame([row for rows in chunk_results for row in rows], index=top_pairs.index, columns=METRIC_FIELDS)
+    top_pairs = pd.concat([top_pairs, metrics], axis=1)
+    return top_pairs.sort_values("sharpe_ratio", ascending=False, na_position="last").reset_index(drop=True)
@@ -0,0 +1,218 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+import numpy as np
+
+from backtest import compute_spread, rolling_spread_stats, simulate_trades, compute_metrics
+from hedge import hedge_ratios
+from sweep import collect_results
+
+METHODS = ("bootstrap", "permute")
+BYTES_PER_CELL = 160 # rough peak memory per bar of each simulated path, used to size batches from a memory limit
+
+# Prices, strategy returns and settings shared by every batch in a worker process, set once by _init_worker
+_worker_data = {}
+
+
+@dataclass
+class SignificanceResult:
+    """
+    How likely the backtest's Sharpe ratio and return are to be luck
+    """
+    sharpe_ratio: float # of the tested strategy
+    return_pct: float
+    sharpe_interval: tuple # (low, high) confidence interval from block bootstrapping the strategy's per bar returns
+    return_interval: tuple
+    sharpe_p_value: float # share of random paths the strategy did at least as well on, small values mean it's unlikely to be luck
+    return_p_value: float
+    untraded_paths: int # random paths the strategy never traded on, they have no Sharpe ratio so sharpe_p_value leaves them out
+    null_sharpe: np.ndarray # Sharpe ratio of the strategy on each random path, NaN if it never traded
+    null_return: np.ndarray
+    bootstrap_sharpe: np.ndarray # Sharpe ratio of each bootstrap resample of the strategy's returns
+    bootstrap_return: np.ndarray
+    method: str
+    block_size: int
+    confidence: float
+
+
+def block_indices(num_bars: int, num_paths: int, block_size: int, rng, method: str = "bootstrap"):
+    """
+    Indices that rearrange num_bars bars into num_paths random paths made of blocks of block_size consecutive bars,
+    so each path keeps the short term dependence of the original. Returned as a bars x paths array
+        - "bootstrap": blocks start anywhere and wrap around the end (circular block bootstrap), drawn with replacement
+        - "permute": the history is cut into blocks which are shuffled, so every bar is used once
+    """
+    block_size = max(1, min(block_size, num_bars))
+    num_blocks = -(-num_bars // block_size)
+    offsets = np.arange(block_size)
+    if method == "bootstrap":
+        starts = rng.integers(0, num_bars, (num_paths, num_blocks))
+        indices = ((starts[:, :, None] + offsets) % num_bars).reshape(num_paths, -1)[:, :num_bars]
+    elif method == "permute":
+        order = np.argsort(rng.random((num_paths, num_blocks)), axis=1)
+        indices = (order[:, :, None] * block_size + offsets).reshape(num_paths, -1)
+        indices = indices[indices < num_bars].reshape(num_paths, num_bars) # the short last block can land anywhere
+    else:
+        raise ValueError(f"Unknown resampling method: {method}")
+    return indices.T
+
+
+def _path_hedge_ratios(price1, price2, hedge: str, lookback: int):
+    """
+    Hedge ratios of bars x paths price arrays, every path at once. Full history OLS is one matrix pass, rolling OLS and Kalman
+    run their running sums and scans down each column
+    """
+    if hedge == "ols":
+        centered1 = price1 - price1.mean(axis=0)
+        centered2 = price2 - price2.mean(axis=0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            hedge_ratio = (centered1 * centered2).sum(axis=0) / (centered2 ** 2).sum(axis=0)
+        return np.where(price2.min(axis=0) == price2.max(axis=0), np.nan, hedge_ratio) # flat paths, like hedge.ols_hedge_ratio
+    return hedge_ratios(price1, price2, hedge, lookback)
+
+
+def _path_spread_stats(spread, window: str, lookback: int):
+    """
+    Spread mean and standard deviation of a bars x paths spread for a window mode, see backtest.window_thresholds
+    """
+    if window == "full":
+        return np.nanmean(spread, axis=0), np.nanstd(spread, axis=0, ddof=1)
+    return rolling_spread_stats(spread, lookback, expanding=(window == "expanding"))
+
+
+def strategy_metrics(price1, price2, num_stdevs: float, capital: float, order_size: int, window: str = "full", lookback: int = 0,
+                     hedge: str = "equal"):
+    """
+    Backtests the strategy on every column of bars x paths price arrays at once
+    Returns (sharpe_ratio, return_pct, portfolio_value) with a value (or column) per path
+    """
+    hedge_ratio = _path_hedge_ratios(price1, price2, hedge, lookback)
+    spread = compute_spread(price1, price2, hedge_ratio)
+    mean_spread, spread_stdev = _path_spread_stats(spread, window, lookback)
+    upper_threshold = mean_spread + (num_stdevs * spread_stdev)
+    lower_threshold = mean_spread - (num_stdevs * spread_stdev)
+    result = simulate_trades(price1, price2, upper_threshold, lower_threshold, capital, order_size, spread=spread, hedge_ratio=hedge_ratio)
+    sharpe_ratio, return_pct = compute_metrics(result.portfolio_value, capital)
+    return sharpe_ratio, return_pct, result.portfolio_value
+
+
+def _init_worker(price1, price2, strategy_returns, settings):
+    """
+    Stores the prices, the tested strategy's returns and the settings in the worker so they are only sent once per process
+    """
+    _worker_data["log_returns"] = np.diff(np.log(np.column_stack([price1, price2])), axis=0)
+    _worker_data["start_prices"] = np.array([price1[0], price2[0]])
+    _worker_data["strategy_returns"] = strategy_returns
+    _worker_data["settings"] = settings
+
+
+def _run_batch(batch):
+    """
+    Builds a batch of random price paths from blocks of the pair's joint log returns and backtests the strategy on all of them,
+    then bootstraps the tested strategy's returns the same number of times
+    """
+    seed, num_paths = batch
+    log_returns, start_prices, strategy_returns = _worker_data["log_returns"], _worker_data["start_prices"], _worker_data["strategy_returns"]
+    num_stdevs, capital, order_size, window, lookback, hedge, block_size, method = _worker_data["settings"]
+    rng = np.random.default_rng(seed)
+
+    # Both legs take the same blocks, so their volatility and co-movement are kept but any long run mean reversion is broken up
+    indices = block_indices(len(log_returns), num_paths, block_size, rng, method)
+    paths = []
+    for leg in range(2):
+        path = np.empty((len(log_returns) + 1, num_paths))
+        path[0] = 0.0
+        np.cumsum(log_returns[indices, leg], axis=0, out=path[1:])
+        paths.append(start_prices[leg] * np.exp(path))
+    null_sharpe, null_return = strategy_metrics(paths[0], paths[1], num_stdevs, capital, order_size, window, lookback, hedge)[:2]
+    del paths
+
+    resampled = strategy_returns[block_indices(len(strategy_returns), num_paths, block_size, rng, "bootstrap")]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        bootstrap_sharpe = np.nanmean(resampled, axis=0) / np.nanstd(resampled, axis=0, ddof=1)
+    bootstrap_return = (np.nanprod(1 + resampled, axis=0) - 1) * 100
+
+    return {"null_sharpe": null_sharpe, "null_return": null_return, "bootstrap_sharpe": bootstrap_sharpe, "bootstrap_return": bootstrap_return}
+
+
+def _p_value(null, observed: float):
+    """
+    Share of random paths at least as good as observed, counting the observed result as one of them so it's never 0.
+    Paths without a value (NaN) are left out of both counts
+    """
+    if np.isnan(observed):
+        return np.nan
+    null = null[~np.isnan(null)]
+    return (1 + np.count_nonzero(null >= observed)) / (1 + len(null))
+
+
+def significance_test(price1, price2, num_stdevs: float, capital: float, order_size: int, window: str = "full", lookback: int = 0,
+                      hedge: str = "equal", num_paths: int = 2000, block_size: int = 20, method: str = "bootstrap", confidence: float = 0.95,
+                      seed=None, max_memory_mb: float = 512, max_workers=None, progress=None):
+    """
+    Tests whether the strategy's Sharpe ratio and return on a pair could be luck.
+    The p-values come from backtesting the same strategy on num_paths random price paths built from blocks of the pair's joint
+    log returns, which keep each leg's volatility and their short term co-movement but not the mean reversion being traded.
+    The confidence intervals come from block bootstrapping the tested strategy's own per bar returns.
+    Paths are simulated in batches of bars x paths arrays across a process pool
+    Parameters:
+        price1, price2 (array): prices of stock1 and stock2, oldest to newest
+        num_stdevs, capital, order_size, window, lookback, hedge: backtest settings, same as the single test
+        num_paths (int): random paths and bootstrap resamples
+        block_size (int): consecutive bars kept together, should cover how long the spread takes to revert
+        method (str): "bootstrap" to draw blocks with replacement or "permute" to shuffle them, see block_indices
+        confidence (float): coverage of the confidence intervals
+        seed (int): random seed, None for a different result each run. Results repeat for the same seed, memory limit and workers
+        max_memory_mb (float): rough limit on the memory of all batches in flight
+        max_workers (int): number of processes, defaults to the number of cores. 1 runs in this process
+        progress (function): called with (fraction, message) as batches finish, may raise to cancel
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown resampling method: {method}")
+    price1 = np.asarray(price1, dtype=float)
+    price2 = np.asarray(price2, dtype=float)
+    valid = ~(np.isnan(price1) | np.isnan(price2))
+    price1, price2 = price1[valid], price2[valid]
+    if len(price1) < 3:
+        raise ValueError(f"Significance test needs at least 3 bars, there are {len(price1)}")
+    if (price1 <= 0).any() or (price2 <= 0).any():
+        raise ValueError("Significance test needs positive prices")
+
+    sharpe_ratio, return_pct, portfolio_value = strategy_metrics(price1[:, None], price2[:, None], num_stdevs, capital, order_size,
+                                                                 window, lookback, hedge)
+    strategy_returns = portfolio_value[1:, 0] / portfolio_value[:-1, 0] - 1
+
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    paths_per_batch = max(1, int(max_memory_mb * 1024 ** 2 / (BYTES_PER_CELL * len(price1) * max_workers)))
+    batch_sizes = [min(paths_per_batch, num_paths - start) for start in range(0, num_paths, paths_per_batch)]
+    batches = list(zip(np.random.SeedSequence(seed).spawn(len(batch_sizes)), batch_sizes))
+    max_workers = min(max_workers, len(batches))
+
+    settings = (num_stdevs, capital, order_size, window, lookback, hedge, block_size, method)
+    if max_workers <= 1:
+        _init_worker(price1, price2, strategy_returns, settings)
+        batch_results = collect_results(map(_run_batch, batches), len(batches), progress)
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, initargs=(price1, price2, strategy_returns, settings)) as executor:
+            batch_results = collect_results(executor.map(_run_batch, batches), len(batches), progress, executor)
+
+    combined = {key: np.concatenate([result[key] for result in batch_results]) for key in batch_results[0]}
+    tail = (1 - confidence) / 2 * 100
+    return SignificanceResult(
+        sharpe_ratio=float(sharpe_ratio[0]),
+        return_pct=float(return_pct[0]),
+        sharpe_interval=tuple(float(bound) for bound in np.nanpercentile(combined["bootstrap_sharpe"], [tail, 100 - tail])),
+        return_interval=tuple(float(bound) for bound in np.nanpercentile(combined["bootstrap_return"], [tail, 100 - tail])),
+        sharpe_p_value=_p_value(combined["null_sharpe"], float(sharpe_ratio[0])),
+        return_p_value=_p_value(combined["null_return"], float(return_pct[0])),
+        untraded_paths=int(np.isnan(combined["null_sharpe"]).sum()),
+        null_sharpe=combined["null_sharpe"],
+        null_return=combined["null_return"],
+        bootstrap_sharpe=combined["bootstrap_sharpe"],
+        bootstrap_return=combined["bootstrap_return"],
+        method=method,
+        block_size=block_size,
+        confidence=confidence,
+    )
@@ -0,0 +1,518 @@
+import math
+import os
+import queue
+import socket
+import sys
+import threading
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime
+
+import numpy as np
+
+from backtest import FLAT, UPPER, LOWER, STATE_SIGN, compute_spread, window_thresholds, simulate_trades
+from hedge import HEDGE_MODELS, KALMAN_DELTA, KALMAN_INITIAL_VARIANCE, hedge_ratios, kalman_hedge_ratio, kalman_step
+
+
+class RunningStats:
+    """
+    Mean and sample standard deviation updated in O(1) per value (Welford's algorithm).
+    With a lookback only the last lookback values are used, older values are removed as new ones arrive. NaN values are skipped
+    """
+    def __init__(self, lookback: int = 0, min_periods: int = 2):
+        self.lookback = lookback # 0 keeps every value
+        self.min_periods = min_periods
+        self.window = deque() # last lookback values, only kept when rolling
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0 # sum of squared deviations from the mean
+
+    def seed(self, values):
+        """
+        Starts from a history of values in one pass of array operations
+        """
+        values = np.asarray(values, dtype=float)
+        if self.lookback:
+            values = values[-self.lookback:]
+            self.window.extend(values.tolist())
+        values = values[~np.isnan(values)]
+        self.count = len(values)
+        self.mean = float(values.mean()) if self.count else 0.0
+        self.m2 = float(((values - self.mean) ** 2).sum())
+
+    def add(self, value: float):
+        if self.lookback:
+            self.window.append(value)
+            if len(self.window) > self.lookback:
+                self._remove(self.window.popleft())
+        if math.isnan(value):
+            return
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    def _remove(self, value: float):
+        if math.isnan(value):
+            return
+        self.count -= 1
+        if self.count == 0:
+            self.mean = 0.0
+            self.m2 = 0.0
+            return
+        previous_mean = self.mean
+        self.mean -= (value - self.mean) / self.count
+        self.m2 = max(self.m2 - (value - previous_mean) * (value - self.mean), 0.0)
+
+    @property
+    def ready(self):
+        return self.count >= self.min_periods
+
+    @property
+    def stdev(self):
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else math.nan
+
+
+class RunningHedge:
+    """
+    Hedge ratio of hedge.hedge_ratios updated in O(1) per bar. A full history OLS hedge continues as an expanding window,
+    its slope comes from running variances of price1 + price2, price1 - price2 and price2 like hedge.rolling_hedge_ratio
+    """
+    def __init__(self, model: str = "equal", lookback: int = 0):
+        if model not in HEDGE_MODELS:
+            raise ValueError(f"Unknown hedge model: {model}")
+        self.model = model
+        rolling = model == "rolling"
+        self.price_stats = [RunningStats(lookback if rolling else 0, max(lookback, 2) if rolling else 2) for _ in range(3)]
+        self.kalman = None # (hedge_ratio, variance) after the last bar, None before the first
+        self.hedge_ratio = 1.0 if model == "equal" else math.nan # after the last bar
+        self.bars = 0
+        self.last_price2 = (math.nan, None) # (price2, bar) of the last bar with both prices
+        self.price2_changed = None # last bar with both prices whose price2 differs from the latest, None if it never changed
+
+    def seed(self, price1, price2):
+        """
+        Starts from a history of prices in one pass of array operations
+        """
+        price1 = np.asarray(price1, dtype=float)
+        price2 = np.asarray(price2, dtype=float)
+        if self.model == "kalman" and len(price1):
+            self.kalman = kalman_hedge_ratio(price1, price2)[1]
+            self.hedge_ratio = self.kalman[0]
+        elif self.model in ("ols", "rolling"):
+            invalid = np.isnan(price1) | np.isnan(price2)
+            price1 = np.where(invalid, np.nan, price1)
+            price2 = np.where(invalid, np.nan, price2)
+            for stats, values in zip(self.price_stats, [price1 + price2, price1 - price2, price2]):
+                stats.seed(values)
+            valid_bars = np.flatnonzero(~invalid)
+            if len(valid_bars):
+                self.last_price2 = (float(price2[valid_bars[-1]]), int(valid_bars[-1]))
+                changed = valid_bars[price2[valid_bars] != self.last_price2[0]]
+                self.price2_changed = int(changed[-1]) if len(changed) else None
+            self.bars = len(price1)
+            self.hedge_ratio = self._slope()
+
+    def _flat(self):
+        """
+        Whether price2 has the same value on every bar of the window, where the slope is NaN like hedge.rolling_hedge_ratio.
+        The running variance of a flat window is only rounding noise, so it's found from the last bar price2 changed
+        """
+        if self.price2_changed is None:
+            return True
+        return self.model == "rolling" and self.price2_changed < self.bars - self.price_stats[2].lookback
+
+    def _slope(self):
+        sum_stats, difference_stats, price2_stats = self.price_stats
+        if not price2_stats.ready or self._flat():
+            return math.nan
+        return (sum_stats.stdev ** 2 - difference_stats.stdev ** 2) / (4 * price2_stats.stdev ** 2)
+
+    def add(self, price1: float, price2: float):
+        """
+        Applies one new pair of prices and returns the hedge ratio for that bar
+        """
+        valid = not (math.isnan(price1) or math.isnan(price2))
+        if self.model == "kalman":
+            # The Kalman hedge ratio of a bar is the estimate from the bars before it
+            hedge_ratio = self.kalman[0] if self.kalman else math.nan
+            hedge_ratio_before, variance = self.kalman or (0.0, KALMAN_INITIAL_VARIANCE)
+            if valid:
+                self.kalman = kalman_step(hedge_ratio_before, variance, price1, price2)
+            else:
+                self.kalman = (hedge_ratio_before, variance + KALMAN_DELTA / (1 - KALMAN_DELTA))
+            self.hedge_ratio = self.kalman[0]
+            return hedge_ratio
+        if self.model in ("ols", "rolling"):
+            values = [price1 + price2, price1 - price2, price2] if valid else [math.nan] * 3
+            for stats, value in zip(self.price_stats, values):
+                stats.add(value)
+            if valid:
+                last_price2, last_bar = self.last_price2
+                if last_bar is not None and price2 != last_price2:
+                    self.price2_changed = last_bar
+                self.last_price2 = (price2, self.bars)
+            self.bars += 1
+            self.hedge_ratio = self._slope()
+        return self.hedge_ratio
+
+
+@dataclass
+class LiveBar:
+    """
+    Signals and portfolio after one live update
+    """
+    timestamp: datetime
+    price1: float
+    price2: float
+    hedge_ratio: float
+    spread: float
+    mean_spread: float
+    upper_threshold: float
+    lower_threshold: float
+    position: int # trade_active after this bar
+    entry: float # spread if a trade was opened on this bar, else NaN
+    exit: float # spread if a trade was closed on this bar, else NaN
+    portfolio_value: float
+    sharpe_ratio: float
+    return_pct: float
+    num_trades: int
+
+
+def next_state(state: int, spread: float, upper_threshold: float, lower_threshold: float):
+    """
+    One step of the trade state machine, the same rules as backtest.transition_codes
+    """
+    if state == FLAT:
+        if spread > upper_threshold:
+            return UPPER
+        if spread < lower_threshold:
+            return LOWER
+        return FLAT
+    if state == UPPER:
+        return FLAT if spread < upper_threshold else UPPER
+    return FLAT if spread > lower_threshold else LOWER
+
+
+class LivePair:
+    """
+    Carries the spread statistics, trade state and cash of a pair forward one price update at a time, in O(1) per update.
+    With a rolling or expanding window it gives the same signals and portfolio value as running simulate_trades over the whole history again.
+    A full history window (and OLS hedge) continues as an expanding window since future prices aren't known yet
+    """
+    def __init__(self, num_stdevs: float, capital: float, order_size: int, window: str = "full", lookback: int = 0, hedge: str = "equal"):
+        if window not in ("full", "rolling", "expanding"):
+            raise ValueError(f"Unknown window mode: {window}")
+        if window != "full" and lookback < 2:
+            raise ValueError("Lookback must be at least 2 bars")
+
+        self.num_stdevs = num_stdevs
+        self.capital = capital
+        self.order_size = order_size
+        self.spread_stats = RunningStats(lookback if window == "rolling" else 0, 2 if window == "full" else max(lookback, 2))
+        self.hedge = RunningHedge(hedge, lookback)
+        self.trade_hedge_ratio = math.nan # hedge ratio locked in when the open trade was entered
+        self.return_stats = RunningStats() # per bar portfolio returns, for the Sharpe ratio
+        self.state = FLAT
+        self.cash = capital
+        self.portfolio_value = capital
+        self.num_trades = 0
+
+    @classmethod
+    def from_history(cls, price1, price2, num_stdevs: float, capital: float, order_size: int, window: str = "full", lookback: int = 0,
+                     hedge: str = "equal"):
+        """
+        Backtests the history once and continues from where it finished
+        Parameters:
+            price1, price2 (array): prices of stock1 and stock2, oldest to newest
+            num_stdevs, capital, order_size, window, lookback, hedge: backtest settings, same as analyze_pair
+        """
+        live_pair = cls(num_stdevs, capital, order_size, window, lookback, hedge)
+        price1 = np.asarray(price1, dtype=float)
+        price2 = np.asarray(price2, dtype=float)
+        if not len(price1):
+            return live_pair
+
+        hedge_ratio = hedge_ratios(price1, price2, hedge, lookback)
+        spread = compute_spread(price1, price2, hedge_ratio)
+        mean_spread, spread_stdev, upper_threshold, lower_threshold = window_thresholds(spread, num_stdevs, window, lookback)
+        result = simulate_trades(price1, price2, upper_threshold, lower_threshold, capital, order_size, spread=spread, hedge_ratio=hedge_ratio)
+
+        live_pair.hedge.seed(price1, price2)
+        live_pair.trade_hedge_ratio = float(result.trade_hedge_ratio[-1])
+        live_pair.spread_stats.seed(spread)
+        live_pair.return_stats.seed(result.portfolio_value[1:] / result.portfolio_value[:-1] - 1)
+        live_pair.state = {0: FLAT, 1: UPPER, -1: LOWER}[int(result.positions[-1])]
+        live_pair.cash = float(result.cash[-1])
+        live_pair.portfolio_value = float(result.portfolio_value[-1])
+        live_pair.num_trades = result.num_trades
+        return live_pair
+
+    @property
+    def sharpe_ratio(self):
+        """
+        Mean over standard deviation of the per bar returns so far, same as backtest.compute_metrics
+        """
+        stdev = self.return_stats.stdev
+        return self.return_stats.mean / stdev if stdev > 0 else math.nan
+
+    def update(self, timestamp, price1: float, price2: float):
+        """
+        Applies one new pair of prices and returns the resulting LiveBar
+        """
+        hedge_ratio = self.hedge.add(price1, price2)
+        spread = price1 - hedge_ratio * price2
+        self.spread_stats.add(spread)
+        if self.spread_stats.ready:
+            mean_spread = self.spread_stats.mean
+            spread_stdev = self.spread_stats.stdev
+        else:
+            mean_spread = spread_stdev = math.nan
+        upper_threshold = mean_spread + (self.num_stdevs * spread_stdev)
+        lower_threshold = mean_spread - (self.num_stdevs * spread_stdev)
+
+        previous = int(STATE_SIGN[self.state])
+        self.state = next_state(self.state, spread, upper_threshold, lower_threshold)
+        position = int(STATE_SIGN[self.state])
+
+        opened = position != 0 and previous == 0
+        closed = position == 0 and previous != 0
+        self.num_trades += closed
+        if opened:
+            self.trade_hedge_ratio = hedge_ratio
+
+        # Trade each leg in the same order as simulate_trades so the cash matches it exactly
+        leg1_value = price1 * self.order_size
+        leg2_value = price2 * (self.order_size * self.trade_hedge_ratio)
+        delta = position - previous
+        if delta:
+            self.cash += delta * leg1_value
+            self.cash += -delta * leg2_value
+
+        # Portfolio value --> cash + value of the long legs, stock2 is long in a lower trade with a negative hedge ratio too
+        holdings_value = (leg1_value if position == -1 else 0.0) + (abs(leg2_value) if position * self.trade_hedge_ratio > 0 else 0.0)
+        portfolio_value = self.cash + holdings_value
+        if closed:
+            self.trade_hedge_ratio = math.nan
+        self.return_stats.add(portfolio_value / self.portfolio_value - 1)
+        self.portfolio_value = portfolio_value
+
+        return LiveBar(
+            timestamp=timestamp,
+            price1=price1,
+            price2=price2,
+            hedge_ratio=hedge_ratio,
+            spread=spread,
+            mean_spread=mean_spread,
+            upper_threshold=upper_threshold,
+            lower_threshold=lower_threshold,
+            position=position,
+            entry=spread if opened else math.nan,
+            exit=spread if closed else math.nan,
+            portfolio_value=portfolio_value,
+            sharpe_ratio=self.sharpe_ratio,
+            return_pct=(portfolio_value - self.capital) / self.capital * 100,
+            num_trades=self.num_trades,
+        )
+
+
+def parse_timestamp(text: str):
+    """
+    Reads an ISO timestamp, a NASDAQ "MM/DD/YYYY" date or seconds since the epoch, returns None if it's none of them
+    Timestamps with a time zone are converted to naive local time so they compare with the NASDAQ dates
+    """
+    try:
+        timestamp = datetime.fromisoformat(text)
+        return timestamp.astimezone().replace(tzinfo=None) if timestamp.tzinfo else timestamp
+    except ValueError:
+        pass
+    try:
+        return datetime.strptime(text, "%m/%d/%Y")
+    except ValueError:
+        pass
+    try:
+        return datetime.fromtimestamp(float(text))
+    except (ValueError, OverflowError, OSError):
+        return None
+
+
+def parse_tick(line: str):
+    """
+    Parses a "timestamp,ticker,price" feed record into (timestamp, ticker, price)
+    Returns None for headers, blank lines and records that can't be read
+    """
+    parts = [part.strip().strip('"') for part in line.split(",")]
+    if len(parts) != 3:
+        return None
+    timestamp, ticker, price = parts
+    try:
+        price = float(price.replace("$", ""))
+    except ValueError:
+        return None
+    timestamp = parse_timestamp(timestamp)
+    if timestamp is None or not ticker:
+        return None
+    return timestamp, ticker.upper(), price
+
+
+def follow_file(file_path: str, stop_event, poll_interval: float = 0.2):
+    """
+    Yields the lines of a file, then keeps yielding lines as they are appended until stop_event is set
+    Partial lines are held back until they are finished, if the file is truncated it is read again from the start
+    """
+    with open(file_path, "r", newline="") as f:
+        partial = ""
+        while not stop_event.is_set():
+            line = f.readline()
+            if not line:
+                if f.tell() > os.fstat(f.fileno()).st_size:
+                    f.seek(0) # truncated, eg the feed was restarted
+                    partial = ""
+                stop_event.wait(poll_interval)
+                continue
+            partial += line
+            if partial.endswith("\n"):
+                yield partial
+                partial = ""
+
+
+def read_socket(host: str, port: int, stop_event, timeout: float = 0.5):
+    """
+    Yields lines sent to a TCP socket until the connection closes or stop_event is set
+    """
+    with socket.create_connection((host, port)) as connection:
+        connection.settimeout(timeout) # wake up regularly to check stop_event
+        partial = b""
+        while not stop_event.is_set():
+            try:
+                data = connection.recv(65536)
+            except socket.timeout:
+                continue
+            if not data:
+                break
+            *lines, partial = (partial + data).split(b"\n")
+            for line in lines:
+                yield line.decode(errors="replace")
+
+
+def read_stream(stream, stop_event):
+    """
+    Yields lines from an open text stream such as stdin until it closes or stop_event is set
+    """
+    for line in stream:
+        if stop_event.is_set():
+            break
+        yield line
+
+
+def open_feed(source: str, stop_event):
+    """
+    Returns the lines of a live feed
+    Parameters:
+        source (str): "-" for stdin, "tcp://host:port" for a socket, otherwise a CSV file that is followed as it grows
+        stop_event (threading.Event): stops the feed once set
+    """
+    if source == "-":
+        return read_stream(sys.stdin, stop_event)
+    if source.startswith("tcp://"):
+        host, port = source[len("tcp://"):].rsplit(":", 1)
+        return read_socket(host, int(port), stop_event)
+    return follow_file(source, stop_event)
+
+
+def align_ticks(lines, ticker1: str, ticker2: str, after=None):
+    """
+    Turns feed lines into (timestamp, price1, price2) updates using the latest price of each ticker.
+    An update is made for every tick of either ticker once both have a price, ticks older than the last update
+    (or than after) are skipped
+    """
+    ticker1, ticker2 = ticker1.upper(), ticker2.upper()
+    prices = {ticker1: None, ticker2: None}
+    last_timestamp = after
+    for line in lines:
+        tick = parse_tick(line)
+        if tick is None or tick[1] not in prices:
+            continue
+        timestamp, ticker, price = tick
+        if last_timestamp is not None and timestamp < last_timestamp:
+            continue
+        prices[ticker] = price
+        if prices[ticker1] is None or prices[ticker2] is None:
+            continue
+        last_timestamp = timestamp
+        yield timestamp, prices[ticker1], prices[ticker2]
+
+
+class LiveFeed:
+    """
+    Reads a live feed on a background thread and applies each update to a LivePair.
+    New bars are handed to the Tk event loop in batches every frame_interval ms, so the charts are redrawn
+    at a steady frame rate no matter how fast ticks arrive
+    """
+    def __init__(self, source: str, ticker1: str, ticker2: str, live_pair: LivePair, after=None, frame_interval: int = 200):
+        self.source = source
+        self.ticker1 = ticker1
+        self.ticker2 = ticker2
+        self.live_pair = live_pair
+        self.after = after # ticks before this timestamp are skipped, eg the end of the loaded history
+        self.frame_interval = frame_interval
+        self.bars = queue.Queue()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.error = None
+        self.finished = False
+
+    def start(self, widget, on_bars, on_error=None, on_stop=None):
+        """
+        Starts following the feed
+        Parameters:
+            widget: any Tk widget, used for scheduling after() callbacks
+            on_bars (function): called on the Tk thread with a list of new LiveBars
+            on_error (function): called with the exception if the feed fails
+            on_stop (function): called once the feed has ended or been stopped
+        """
+        self.widget = widget
+        self.callbacks = {"bars": on_bars, "error": on_error, "stop": on_stop}
+        self.thread = threading.Thread(target=self._run, daemon=True) # daemon so a blocking read doesn't stop the app closing
+        self.thread.start()
+        self.widget.after(self.frame_interval, self._poll)
+
+    def stop(self):
+        self.stop_event.set()
+
+    def _run(self):
+        try:
+            lines = open_feed(self.source, self.stop_event)
+            for timestamp, price1, price2 in align_ticks(lines, self.ticker1, self.ticker2, self.after):
+                if self.stop_event.is_set():
+                    break
+                self.bars.put(self.live_pair.update(timestamp, price1, price2))
+        except Exception as error:
+            self.error = error
+        finally:
+            self.finished = True
+
+    def _poll(self):
+        """
+        Passes every bar that arrived since the last frame to on_bars, runs on the Tk event loop
+        """
+        finished = self.finished or self.stop_event.is_set() # read before draining so no bar is left behind, a blocked stdin read isn't waited for
+        bars = []
+        while True:
+            try:
+                bars.append(self.bars.get_nowait())
+            except queue.Empty:
+                break
+        if bars and not self.stop_event.is_set():
+            self.callbacks["bars"](bars)
+
+        if not finished:
+            self.widget.after(self.frame_interval, self._poll)
+            return
+        if self.error is not None and not self.stop_event.is_set():
+            if self.callbacks["error"]:
+                self.callbacks["error"](self.error)
+            else:
+                raise self.error
+        if self.callbacks["stop"]:
+            self.callbacks["stop"]()
@@ -0,0 +1,146 @@
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from backtest import compute_spread, compute_metrics, simulate_trades, window_thresholds
+from hedge import hedge_ratios
+
+# Prices shared by every task in a worker process, set once by _init_worker
+_worker_data = {}
+
+
+def parse_values(text: str, value_type=float):
+    """
+    Parses a comma separated list of numbers, eg "5, 10, 20"
+    Raises ValueError naming the first value that isn't a number
+    """
+    kind = "an integer" if value_type is int else "a number"
+    values = []
+    for value in text.replace(" ", "").split(","):
+        if value == "":
+            continue
+        try:
+            values.append(value_type(value))
+        except ValueError:
+            raise ValueError(f"{value} is not {kind}") from None
+    return values
+
+
+def sd_range(start: float, stop: float, step: float):
+    """
+    Returns SD thresholds from start to stop inclusive, rounded to avoid floating point drift
+    Raises ValueError if step isn't positive or start is past stop
+    """
+    if not step > 0:
+        raise ValueError(f"SD step must be more than 0, got {step}")
+    if not start <= stop:
+        raise ValueError(f"SD start ({start}) must not be more than SD stop ({stop})")
+    count = int(round((stop - start) / step)) + 1
+    return [round(start + i * step, 10) for i in range(count)]
+
+
+def parse_sd_range(text: str):
+    """
+    Parses "start, stop, step" into the SD thresholds of sd_range, eg "0.5, 3.0, 0.1"
+    """
+    values = parse_values(text)
+    if len(values) != 3:
+        raise ValueError("SD range needs a start, stop and step, eg 0.5, 3.0, 0.1")
+    return sd_range(*values)
+
+
+def _init_worker(price1, price2, window, lookback, hedge):
+    """
+    Stores the cleaned prices and spread statistics in the worker so they are only sent and calculated once per process
+    """
+    hedge_ratio = hedge_ratios(price1, price2, hedge, lookback)
+    spread = compute_spread(price1, price2, hedge_ratio)
+    mean_spread, spread_stdev, upper_threshold, lower_threshold = window_thresholds(spread, 0, window, lookback)
+    _worker_data["price1"] = price1
+    _worker_data["price2"] = price2
+    _worker_data["hedge_ratio"] = hedge_ratio
+    _worker_data["spread"] = spread
+    _worker_data["mean_spread"] = mean_spread
+    _worker_data["spread_stdev"] = spread_stdev
+
+
+def _run_point(params):
+    """
+    Backtests a single (num_stdevs, order_size, capital) combination on the worker's prices
+    """
+    num_stdevs, order_size, capital = params
+    mean_spread = _worker_data["mean_spread"]
+    spread_stdev = _worker_data["spread_stdev"]
+
+    result = simulate_trades(_worker_data["price1"], _worker_data["price2"],
+                             mean_spread + num_stdevs * spread_stdev, mean_spread - num_stdevs * spread_stdev,
+                             capital, order_size, spread=_worker_data["spread"], hedge_ratio=_worker_data["hedge_ratio"])
+    sharpe_ratio, return_pct = compute_metrics(result.portfolio_value, capital)
+    return {
+        "num_stdevs": num_stdevs,
+        "order_size": order_size,
+        "capital": capital,
+        "sharpe_ratio": sharpe_ratio,
+        "return_pct": return_pct,
+        "num_trades": result.num_trades,
+    }
+
+
+def run_sweep(price1, price2, num_stdevs_values, order_sizes, capitals, window: str = "full", lookback: int = 0, hedge: str = "equal",
+              max_workers=None, progress=None):
+    """
+    Backtests every combination of SD threshold, order size and starting capital across a process pool
+    Returns a df with one row per combination
+    Parameters:
+        price1, price2 (array): cleaned prices of stock1 and stock2, oldest to newest
+        num_stdevs_values, order_sizes, capitals (list): values to cross
+        window, lookback: spread window mode, see backtest.window_thresholds
+        hedge (str): hedge ratio model, see hedge.hedge_ratios
+        max_workers (int): number of processes, defaults to the number of cores. 1 runs in this process
+        progress (function): called with (fraction, message) as results arrive, may raise to cancel the sweep
+    """
+    price1 = np.asarray(price1, dtype=float)
+    price2 = np.asarray(price2, dtype=float)
+    grid = list(itertools.product(num_stdevs_values, order_sizes, capitals))
+
+    if max_workers is None:
+        max_workers = min(os.cpu_count() or 1, len(grid))
+
+    if max_workers <= 1:
+        _init_worker(price1, price2, window, lookback, hedge)
+        rows = collect_results(map(_run_point, grid), len(grid), progress)
+    else:
+        chunksize = max(1, len(grid) // (max_workers * 4)) # few large chunks keep inter-process overhead low
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, initargs=(price1, price2, window, lookback, hedge)) as executor:
+            rows = collect_results(executor.map(_run_point, grid, chunksize=chunksize), len(grid), progress, executor)
+
+    return pd.DataFrame(rows)
+
+
+def collect_results(results, total: int, progress=None, executor=None):
+    """
+    Gathers results into a list, reporting progress after each one
+    If progress raises (eg the user cancelled) queued work in the executor is dropped before re-raising
+    """
+    rows = []
+    try:
+        for row in results:
+            rows.append(row)
+            if progress:
+                progress(len(rows) / total, f"Tested {len(rows)} of {total}")
+    except BaseException:
+        if executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+        raise
+    return rows
+
+
+def sweep_table(results, value_col: str):
+    """
+    Pivots sweep results into a 2D table for a heatmap
+    Rows are (capital, order_size) combinations, columns are SD thresholds
+    """
+    return results.pivot_table(index=["capital", "order_size"], columns="num_stdevs", values=value_col, dropna=False)
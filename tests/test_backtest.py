@@ -0,0 +1,131 @@
+"""
+Checks the vectorized backtest against the original day by day loop on the bundled KO and PEP quotes
+"""
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from backtest import compute_spread, spread_thresholds, simulate_trades
+
+QUOTE_FILES = {"KO": "KO historical quotes.csv", "PEP": "PEP historical quotes.csv"}
+
+
+def read_quotes(ticker: str):
+    """
+    Reads and cleans a quote file the way the app originally did
+    """
+    stock_df = pd.read_csv(os.path.join(ROOT, QUOTE_FILES[ticker]), usecols = ["Date", "Close/Last"])
+    stock_df["Close/Last"] = stock_df["Close/Last"].replace({"\\$": ""}, regex=True) # Remove '$' symbol
+    stock_df["Close/Last"] = pd.to_numeric(stock_df["Close/Last"], errors="coerce") # Convert to numbers
+    return stock_df
+
+
+def merged_pair(stock1_name: str, stock2_name: str):
+    """
+    Merges two tickers' quotes oldest to newest into columns "price1" and "price2"
+    """
+    df = pd.merge(read_quotes(stock1_name), read_quotes(stock2_name), on = "Date", how = "inner")
+    df.rename(columns={"Close/Last_x": "price1", "Close/Last_y": "price2"}, inplace = True)
+    return df.iloc[::-1] # Sort from oldest to newest
+
+
+def loop_trades(df, upper_threshold: float, lower_threshold: float, capital: float, order_size: int):
+    """
+    The original iterrows simulation from analyze_stocks, kept as the reference
+    Returns (df with Entries, Exits and Portfolio Value columns, num_trades, trade_active at the end)
+    """
+    df = df.copy()
+    df["Entries"] = np.nan
+    df["Exits"] = np.nan
+    num_trades = 0
+    trade_active = 0 # 0 = not in trade, -1 = trade on lower, 1 = trade on upper
+    stock1_position = 0 # -1 is short, 1 is long
+    stock2_position = 0
+
+    for index, row in df.iterrows(): # iterate through each day
+        # Open trades
+        if trade_active == 0:
+            if row["Spread"] > upper_threshold:
+                stock1_position = -1
+                capital += row["price1"] * order_size
+                stock2_position = 1
+                capital -= row["price2"] * order_size
+                trade_active = 1
+                df.loc[index, "Entries"] = df.loc[index, "Spread"]
+
+            elif row["Spread"] < lower_threshold:
+                stock1_position = 1
+                capital -= row["price1"] * order_size
+                stock2_position = -1
+                capital += row["price2"] * order_size
+                trade_active = -1
+                df.loc[index, "Entries"] = df.loc[index, "Spread"]
+
+        # Close trades
+        elif trade_active == -1 and row["Spread"] > lower_threshold:
+            stock1_position = 0
+            capital += row["price1"] * order_size # sell
+            stock2_position = 0
+            capital -= row["price2"] * order_size # buy to cover
+            trade_active = 0
+            num_trades += 1
+            df.loc[index, "Exits"] = df.loc[index, "Spread"]
+
+        elif trade_active == 1 and row["Spread"] < upper_threshold:
+            stock1_position = 0
+            capital -= row["price1"] * order_size # buy to cover
+            stock2_position = 0
+            capital += row["price2"] * order_size # sell
+            trade_active = 0
+            num_trades += 1
+            df.loc[index, "Exits"] = df.loc[index, "Spread"]
+
+        # Get portfolio value --> cash + holdings
+        holdings_value = 0
+        if stock1_position == 1:
+            holdings_value = row["price1"] * order_size
+        elif stock2_position == 1:
+            holdings_value = row["price2"] * order_size
+        df.loc[index, "Portfolio Value"] = capital + holdings_value
+
+    return df, num_trades, trade_active
+
+
+@pytest.mark.parametrize("num_stdevs", [0.5, 1.0, 2.0])
+@pytest.mark.parametrize("stocks", [("KO", "PEP"), ("PEP", "KO")])
+@pytest.mark.parametrize("absolute", [True, False], ids=["abs spread", "signed spread"])
+def test_simulate_trades_matches_loop(stocks, num_stdevs, absolute):
+    df = merged_pair(*stocks)
+    spread = compute_spread(df["price1"], df["price2"])
+    df["Spread"] = np.abs(spread) if absolute else spread # the original app traded the absolute spread
+    upper_threshold, lower_threshold = spread_thresholds(df["Spread"].to_numpy(), num_stdevs)[2:]
+    capital, order_size = 10000.0, 10
+
+    expected, num_trades, final_position = loop_trades(df, upper_threshold, lower_threshold, capital, order_size)
+    result = simulate_trades(df["price1"].to_numpy(), df["price2"].to_numpy(), upper_threshold, lower_threshold, capital, order_size,
+                             spread=df["Spread"].to_numpy())
+
+    np.testing.assert_array_equal(result.entries, expected["Entries"].to_numpy())
+    np.testing.assert_array_equal(result.exits, expected["Exits"].to_numpy())
+    np.testing.assert_array_equal(result.portfolio_value, expected["Portfolio Value"].to_numpy())
+    assert result.num_trades == num_trades
+    assert result.final_position == final_position
+    assert not np.isnan(expected["Entries"]).all() # the thresholds actually open a trade
+
+
+def test_long_stock2_with_negative_hedge_ratio():
+    # A lower trade (long stock1) with a hedge ratio of -0.5 buys 5 shares of stock2 for every 10 of stock1
+    price1 = np.array([10.0, 10.0, 12.0, 11.0])
+    price2 = np.array([20.0, 20.0, 18.0, 19.0])
+    spread = np.array([0.0, -2.0, -2.0, 1.0])
+    result = simulate_trades(price1, price2, 1.5, -1.0, 1000.0, 10, spread=spread, hedge_ratio=-0.5)
+
+    np.testing.assert_array_equal(result.positions, [0, -1, -1, 0])
+    np.testing.assert_array_equal(result.cash, [1000.0, 800.0, 800.0, 1005.0])
+    np.testing.assert_array_equal(result.portfolio_value, [1000.0, 1000.0, 1010.0, 1005.0]) # cash + 10 stock1 + 5 stock2
@@ -0,0 +1,42 @@
+"""
+Checks the screener's handling of folders and settings that leave nothing to screen
+"""
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from report import main as report_main
+from screener import METRIC_FIELDS, screen_universe
+
+
+def universe(tickers, num_bars: int = 300):
+    """
+    Random walk prices of tickers on a daily date index
+    """
+    rng = np.random.default_rng(0)
+    dates = pd.date_range("2020-01-01", periods=num_bars, freq="D")
+    return pd.DataFrame({ticker: 100 + np.cumsum(rng.normal(0, 1, num_bars)) for ticker in tickers}, index=dates)
+
+
+@pytest.mark.parametrize("tickers", [[], ["KO"]])
+def test_screen_needs_two_tickers(tickers):
+    with pytest.raises(ValueError, match="at least two quote files"):
+        screen_universe(universe(tickers), 1.5, 10000, 10, max_workers=1)
+
+
+def test_screen_without_pairs_to_test():
+    results = screen_universe(universe(["KO", "PEP", "MSFT"]), 1.5, 10000, 10, top_k=0, max_workers=1)
+    assert results.empty
+    assert {"stock1", "stock2", "correlation", "p_value", *METRIC_FIELDS} <= set(results.columns)
+
+
+def test_report_rejects_top_below_one(tmp_path):
+    with pytest.raises(SystemExit) as exit_info:
+        report_main(["--screen", str(tmp_path), "--top", "0", "--output", str(tmp_path / "report"), "--quiet"])
+    assert exit_info.value.code == 2
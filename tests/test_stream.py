@@ -0,0 +1,42 @@
+"""
+Checks that live updates give the same portfolio as backtesting the whole history
+"""
+import os
+import sys
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from backtest import compute_spread, window_thresholds, simulate_trades
+from hedge import hedge_ratios
+from stream import LivePair
+
+
+def test_live_pair_matches_backtest_with_negative_hedge_ratio():
+    # Prices that move against each other, so the rolling OLS hedge ratio is negative and lower trades are long both stocks
+    rng = np.random.default_rng(0)
+    price1 = 100 + np.cumsum(rng.normal(0, 1, 400))
+    price2 = 250 - price1 + rng.normal(0, 2, 400)
+    num_stdevs, capital, order_size, lookback, seeded = 1.0, 10000.0, 10, 30, 100
+
+    hedge_ratio = hedge_ratios(price1, price2, "rolling", lookback)
+    spread = compute_spread(price1, price2, hedge_ratio)
+    upper_threshold, lower_threshold = window_thresholds(spread, num_stdevs, "rolling", lookback)[2:]
+    result = simulate_trades(price1, price2, upper_threshold, lower_threshold, capital, order_size, spread=spread, hedge_ratio=hedge_ratio)
+
+    live_pair = LivePair.from_history(price1[:seeded], price2[:seeded], num_stdevs, capital, order_size, "rolling", lookback, "rolling")
+    bars, cash = [], []
+    for i in range(seeded, len(price1)):
+        bars.append(live_pair.update(i, price1[i], price2[i]))
+        cash.append(live_pair.cash)
+
+    positions = np.array([bar.position for bar in bars])
+    holdings_value = np.array([bar.portfolio_value for bar in bars]) - cash
+    long_both = (positions == -1) & (result.trade_hedge_ratio[seeded:] < 0)
+    assert long_both.any()
+    # Long stock1 and long stock2, so the holdings are worth more than the stock1 leg alone
+    assert (holdings_value[long_both] > price1[seeded:][long_both] * order_size).all()
+    np.testing.assert_array_equal(positions, result.positions[seeded:])
+    np.testing.assert_allclose([bar.portfolio_value for bar in bars], result.portfolio_value[seeded:], rtol=1e-9)
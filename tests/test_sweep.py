@@ -0,0 +1,34 @@
+"""
+Checks parsing of the sweep settings typed into the app
+"""
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sweep import parse_sd_range, parse_values
+
+
+def test_parse_sd_range():
+    assert parse_sd_range("0.5, 1.5, 0.5") == [0.5, 1.0, 1.5]
+    assert parse_sd_range("2, 2, 0.1") == [2.0]
+
+
+@pytest.mark.parametrize("text, message", [
+    ("0.5, 3.0, 0", "step must be more than 0"),
+    ("0.5, 3.0, -0.1", "step must be more than 0"),
+    ("3.0, 0.5, 0.1", "must not be more than SD stop"),
+    ("0.5, 3.0", "start, stop and step"),
+    ("0.5, x, 0.1", "x is not a number"),
+])
+def test_parse_sd_range_rejects(text, message):
+    with pytest.raises(ValueError, match=message):
+        parse_sd_range(text)
+
+
+def test_parse_values_rejects_non_integer():
+    with pytest.raises(ValueError, match="2.5 is not an integer"):
+        parse_values("5, 2.5", int)
@@ -0,0 +1,186 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from backtest import compute_spread, spread_thresholds, simulate_trades, compute_metrics
+from hedge import hedge_ratios, ols_hedge_ratio
+from sweep import collect_results
+
+# Prices and settings shared by every fold in a worker process, set once by _init_worker
+_worker_data = {}
+
+
+@dataclass
+class WalkForwardResult:
+    """
+    Out-of-sample results of a walk-forward test
+    """
+    folds: pd.DataFrame # one row per fold with its windows, fitted settings and test metrics
+    portfolio_value: np.ndarray # out-of-sample portfolio value per bar, folds stitched end to end. NaN before the first test window
+    entries: np.ndarray # spread value on bars where a test trade was opened, NaN elsewhere
+    exits: np.ndarray # spread value on bars where a test trade was closed, NaN elsewhere
+    sharpe_ratio: float # of the stitched out-of-sample portfolio
+    return_pct: float
+    num_trades: int
+
+
+def fold_bounds(num_bars: int, train_bars: int, test_bars: int):
+    """
+    Splits the bars into walk-forward folds: each fold trains on train_bars bars and tests on the test_bars after them,
+    then the window moves forward by test_bars so the test windows cover the history once without overlapping
+    Returns a list of (train_start, test_start, test_end) indices, the last test window may be shorter
+    """
+    if train_bars < 2 or test_bars < 1:
+        raise ValueError("Walk-forward needs at least 2 training bars and 1 test bar")
+    return [(test_start - train_bars, test_start, min(test_start + test_bars, num_bars))
+            for test_start in range(train_bars, num_bars, test_bars)]
+
+
+def _init_worker(price1, price2, settings):
+    """
+    Stores the prices and walk-forward settings in the worker so they are only sent once per process
+    Rolling OLS and Kalman hedge ratios only use past bars so they are calculated once over the whole history,
+    a full history OLS hedge ratio is fitted on each training window instead
+    """
+    hedge, lookback = settings[3:]
+    hedge_ratio = 1.0 if hedge == "ols" else hedge_ratios(price1, price2, hedge, lookback)
+    _worker_data["price1"] = price1
+    _worker_data["price2"] = price2
+    _worker_data["hedge_ratio"] = np.broadcast_to(hedge_ratio, price1.shape)
+    _worker_data["spread"] = compute_spread(price1, price2, hedge_ratio)
+    _worker_data["settings"] = settings
+
+
+def close_out(result, price1, price2, spread, order_size):
+    """
+    Closes a trade still open on the last bar of a window at that bar's prices, so the window's last portfolio value is all cash.
+    Portfolio value only counts the long legs, so an open short would otherwise count its sale proceeds as profit
+    Returns (portfolio_value, exits, num_trades) of the window with the trade closed
+    """
+    portfolio_value, exits, num_trades = result.portfolio_value.copy(), result.exits.copy(), result.num_trades
+    position = result.positions[-1]
+    if position != 0:
+        # Same cash flows as simulate_trades: stock1 is bought back (or sold) and the stock2 leg kept since entry is unwound
+        portfolio_value[-1] = result.cash[-1] - position * price1[-1] * order_size + position * price2[-1] * order_size * result.trade_hedge_ratio[-1]
+        exits[-1] = spread[-1]
+        num_trades += 1
+    return portfolio_value, exits, num_trades
+
+
+def _run_fold(bounds):
+    """
+    Fits the spread statistics (and the best SD threshold if there are several) on a fold's training window,
+    then trades its test window with them starting flat with the full capital, closing any trade still open on its last bar
+    """
+    train_start, test_start, test_end = bounds
+    price1, price2, hedge_ratio, spread = _worker_data["price1"], _worker_data["price2"], _worker_data["hedge_ratio"], _worker_data["spread"]
+    num_stdevs_values, capital, order_size, hedge, lookback = _worker_data["settings"]
+    train = slice(train_start, test_start)
+    test = slice(test_start, test_end)
+    if hedge == "ols":
+        hedge_ratio = np.broadcast_to(ols_hedge_ratio(price1[train], price2[train]), price1.shape)
+        spread = compute_spread(price1, price2, hedge_ratio[0])
+
+    # Pick the SD threshold with the best Sharpe ratio on the training window
+    num_stdevs, train_sharpe = num_stdevs_values[0], np.nan
+    if len(num_stdevs_values) > 1:
+        scores = []
+        for candidate in num_stdevs_values:
+            mean_spread, spread_stdev, upper_threshold, lower_threshold = spread_thresholds(spread[train], candidate)
+            result = simulate_trades(price1[train], price2[train], upper_threshold, lower_threshold, capital, order_size, spread=spread[train],
+                                     hedge_ratio=hedge_ratio[train])
+            scores.append(compute_metrics(close_out(result, price1[train], price2[train], spread[train], order_size)[0], capital)[0])
+        scores = np.where(np.isnan(scores), -np.inf, scores) # never trading scores worst
+        best = int(np.argmax(scores))
+        num_stdevs, train_sharpe = num_stdevs_values[best], scores[best]
+
+    mean_spread, spread_stdev, upper_threshold, lower_threshold = spread_thresholds(spread[train], num_stdevs)
+    result = simulate_trades(price1[test], price2[test], upper_threshold, lower_threshold, capital, order_size, spread=spread[test],
+                             hedge_ratio=hedge_ratio[test])
+    # The next fold starts flat with its own thresholds, so a trade open at the end of the test window is closed on its last bar
+    portfolio_value, exits, num_trades = close_out(result, price1[test], price2[test], spread[test], order_size)
+    sharpe_ratio, return_pct = compute_metrics(portfolio_value, capital)
+
+    return {
+        "bounds": bounds,
+        "num_stdevs": num_stdevs,
+        "train_sharpe": train_sharpe,
+        "hedge_ratio": float(hedge_ratio[test_start]),
+        "mean_spread": mean_spread,
+        "spread_stdev": spread_stdev,
+        "sharpe_ratio": sharpe_ratio,
+        "return_pct": return_pct,
+        "num_trades": num_trades,
+        "portfolio_value": portfolio_value,
+        "entries": result.entries,
+        "exits": exits,
+    }
+
+
+def walk_forward(dates, price1, price2, train_bars: int, test_bars: int, num_stdevs_values, capital: float, order_size: int,
+                 hedge: str = "equal", lookback: int = 0, max_workers=None, progress=None):
+    """
+    Walk-forward test: thresholds are fitted on each training window and only traded on the bars after it,
+    so every trade in the stitched portfolio is out of sample. Folds run across a process pool
+    Parameters:
+        dates (array): date of each bar, oldest to newest
+        price1, price2 (array): prices of stock1 and stock2, oldest to newest
+        train_bars, test_bars (int): length of the training and test windows
+        num_stdevs_values (list): SD thresholds, with more than one the best on each training window is traded
+        capital (float): starting capital of every fold
+        order_size (int): number of stocks to buy/sell for each trade
+        hedge, lookback: hedge ratio model and rolling OLS window, see hedge.hedge_ratios
+        max_workers (int): number of processes, defaults to the number of cores. 1 runs in this process
+        progress (function): called with (fraction, message) as folds finish, may raise to cancel
+    """
+    price1 = np.asarray(price1, dtype=float)
+    price2 = np.asarray(price2, dtype=float)
+    folds = fold_bounds(len(price1), train_bars, test_bars)
+    if not folds:
+        raise ValueError(f"Walk-forward needs more than {train_bars} bars of history, there are {len(price1)}")
+
+    settings = (list(num_stdevs_values), capital, order_size, hedge, lookback)
+    if max_workers is None:
+        max_workers = min(os.cpu_count() or 1, len(folds))
+
+    if max_workers <= 1:
+        _init_worker(price1, price2, settings)
+        fold_results = collect_results(map(_run_fold, folds), len(folds), progress)
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, initargs=(price1, price2, settings)) as executor:
+            fold_results = collect_results(executor.map(_run_fold, folds), len(folds), progress, executor)
+
+    # Stitch folds: every fold ends flat and profits don't depend on the starting cash, so each fold carries on from the last one's profit
+    portfolio_value = np.full(len(price1), np.nan)
+    entries = np.full(len(price1), np.nan)
+    exits = np.full(len(price1), np.nan)
+    profit = 0.0
+    rows = []
+    for fold, result in enumerate(fold_results, start=1):
+        train_start, test_start, test_end = result["bounds"]
+        portfolio_value[test_start:test_end] = result["portfolio_value"] + profit
+        entries[test_start:test_end] = result["entries"]
+        exits[test_start:test_end] = result["exits"]
+        profit += result["portfolio_value"][-1] - capital
+        rows.append({
+            "fold": fold,
+            "train_start": dates[train_start],
+            "test_start": dates[test_start],
+            "test_end": dates[test_end - 1],
+            **{key: result[key] for key in ["num_stdevs", "train_sharpe", "hedge_ratio", "mean_spread", "spread_stdev", "sharpe_ratio", "return_pct", "num_trades"]},
+        })
+
+    tested = portfolio_value[folds[0][1]:]
+    sharpe_ratio, return_pct = compute_metrics(np.concatenate([[capital], tested]), capital)
+    return WalkForwardResult(
+        folds=pd.DataFrame(rows),
+        portfolio_value=portfolio_value,
+        entries=entries,
+        exits=exits,
+        sharpe_ratio=sharpe_ratio,
+        return_pct=return_pct,
+        num_trades=sum(row["num_trades"] for row in rows),
+    )
@@ -0,0 +1,99 @@
+import queue
+import threading
+
+
+class TaskCancelled(Exception):
+    """
+    Raised inside a background task when the user cancels it
+    """
+
+
+class BackgroundTask:
+    """
+    Runs a function on a background thread so the Tk window stays responsive.
+    Progress and results are handed back to the Tk event loop by polling a queue with after(), Tk widgets are never touched from the thread.
+    The function is called with the task so it can report progress, task.progress() raises TaskCancelled once cancel() is called
+    """
+    def __init__(self, function, poll_interval: int = 100):
+        self.function = function
+        self.poll_interval = poll_interval # ms between checks for messages from the thread
+        self.messages = queue.Queue()
+        self.cancel_event = threading.Event()
+        self.thread = None
+        self.finished = False
+
+    def start(self, widget, on_done, on_progress=None, on_error=None, on_cancel=None):
+        """
+        Starts the thread and begins polling for messages
+        Parameters:
+            widget: any Tk widget, used for scheduling after() callbacks
+            on_done (function): called with the function's return value
+            on_progress (function): called with (fraction, message) as the task reports progress
+            on_error (function): called with the exception if the function fails
+            on_cancel (function): called once the task has stopped after being cancelled
+        """
+        self.widget = widget
+        self.callbacks = {"done": on_done, "progress": on_progress, "error": on_error, "cancelled": on_cancel}
+        self.thread = threading.Thread(target=self._run, daemon=True) # daemon so an open task doesn't stop the app closing
+        self.thread.start()
+        self.widget.after(self.poll_interval, self._poll)
+
+    def progress(self, fraction: float, message: str = ""):
+        """
+        Reports progress from inside the task, fraction is between 0 and 1
+        """
+        if self.cancel_event.is_set():
+            raise TaskCancelled()
+        self.messages.put(("progress", (fraction, message)))
+
+    def cancel(self):
+        """
+        Asks the task to stop at its next progress report
+        """
+        self.cancel_event.set()
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def _run(self):
+        try:
+            result = self.function(self)
+            if self.cancel_event.is_set():
+                self.messages.put(("cancelled", None))
+            else:
+                self.messages.put(("done", result))
+        except TaskCancelled:
+            self.messages.put(("cancelled", None))
+        except Exception as error:
+            self.messages.put(("error", error))
+
+    def _poll(self):
+        """
+        Passes messages from the thread to the callbacks, runs on the Tk event loop
+        """
+        latest_progress = None
+        while True:
+            try:
+                kind, value = self.messages.get_nowait()
+            except queue.Empty:
+                break
+
+            if kind == "progress":
+                latest_progress = value # only the newest progress needs drawing
+                continue
+
+            self.finished = True
+            callback = self.callbacks[kind]
+            if callback:
+                if kind == "cancelled":
+                    callback()
+                else:
+                    callback(value)
+            elif kind == "error":
+                raise value # nothing to handle it, let Tk report it
+            return
+
+        if latest_progress and self.callbacks["progress"]:
+            self.callbacks["progress"](*latest_progress)
+        self.widget.after(self.poll_interval, self._poll)